@@ -1,24 +1,40 @@
 # app/streamlit_ui.py
 import streamlit as st
 import pandas as pd
-import tempfile
 import sys
 import os
-import json
-import requests
+import time
+import uuid
 from datetime import datetime
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.arxiv_search import search_arxiv
-from utils.semantic_scholar_search import search_semantic_scholar
-from utils.pdf_text_extractor import extract_text_from_pdf, save_text_to_file
-from utils.summarizer import summarize_text
-from utils.pdf_downloader import download_pdf
-from utils.summarizer import save_summary_to_file
-from utils.db_manager import init_db, insert_or_update_paper, update_paper_status, update_summary_to_db
-from utils.db_manager import fetch_all_papers
+# 検索・要約・ベクトル索引のモジュールは読み込みが重いので、使うセクションの中で import する
+# （一度読み込めばプロセス内で使い回されるので、2回目以降の再実行では読み込まない）
+from utils.db_manager import init_db
+from utils.job_queue import job_counts, fetch_recent_jobs
+from utils.exporter import export_to_file, FORMATS as EXPORT_FORMATS
+from utils.metrics import configure_logging, summarize_metrics
 
-init_db()  # データベースの初期化
+EXPORT_DIR = os.path.join("data", "exports")
+FACET_SIZE = 100  # キーワード・著者の絞り込みに出す候補の数
+METRICS_CACHE_SECONDS = 30  # パフォーマンスの集計を使い回す秒数
+
+configure_logging()  # LOG_LEVEL=DEBUG でプロンプト・応答も表示
+
+
+@st.cache_resource
+def setup_database():
+    """データベースの初期化（テーブル作成・移行）はプロセスで1回だけ行う（再実行のたびに書き込みロックを取らない）。"""
+    init_db()
+
+
+setup_database()
+
+
+@st.cache_data(ttl=METRICS_CACHE_SECONDS, show_spinner=False)
+def cached_metrics(window_hours: int) -> dict:
+    """直近 window_hours 時間の計測の集計（METRICS_CACHE_SECONDS 秒の間は再実行しても集計し直さない）。"""
+    return summarize_metrics(since=time.time() - window_hours * 3600)
 
 st.set_page_config(page_title="論文検索＆PDF要約", layout="wide")
 st.title("📚 論文検索＆PDF要約アプリ")
@@ -29,26 +45,44 @@ st.title("📚 論文検索＆PDF要約アプリ")
 st.header("🔍 キーワードから論文を検索")
 
 keyword = st.text_input("キーワードを入力してください", placeholder="例: Transformer, Climate Change")
-max_results = st.slider("論文を検索するソースはarXivとsemantic scholarです。それぞれのソースで取得する論文数を選択してください。その中からPDFがダウンロードできるもののみ抽出します。", 1, 10, 5)
+max_results = st.slider("論文を検索するソースはarXivとsemantic scholarです。それぞれのソースで1ページあたりに取得する論文数を選択してください。その中からPDFがダウンロードできるもののみ抽出します。", 1, 100, 5)
+page = st.number_input("ページ", min_value=1, value=1, step=1)
 
 all_papers = []
 
 if keyword:
+    from utils.paper_search import search_all_sources
+    from utils.db_manager import insert_or_update_papers
+    from utils.pipeline import run_pipeline, paper_id_of
+    from utils.croma_manager import find_near_duplicates
+    from utils.paper_resolver import dedupe_papers, register_papers
+    from utils.job_queue import enqueue_papers
+    from utils.prefetcher import (
+        prefetch, cancel_prefetch, prefetch_status, claim, PREFETCH_ENABLED,
+        PENDING as PREFETCH_PENDING, RUNNING as PREFETCH_RUNNING, DONE as PREFETCH_DONE,
+        FAILED as PREFETCH_FAILED, SKIPPED as PREFETCH_SKIPPED, CANCELLED as PREFETCH_CANCELLED,
+    )
+
     st.success(f"検索キーワード：{keyword}")
+    # 先読みはセッションごとに管理する（別のタブの検索で取り消されないように）
+    prefetch_owner = st.session_state.setdefault("prefetch_owner", uuid.uuid4().hex)
 
     with st.spinner("論文検索中..."):
-        arxiv_results = search_arxiv(keyword, max_results=max_results)
-        try:
-            semsch_results = search_semantic_scholar(keyword, limit=max_results)
-        except requests.exceptions.HTTPError as e:
-            st.warning(f"Semantic Scholar API制限のため、Semantic Scholarの検索はスキップします。: {e}")
-            semsch_results = []
-
-        all_papers = arxiv_results + semsch_results
-
+        # 両ソースを同時に検索（結果は一定時間キャッシュされる）
+        results, errors = search_all_sources(keyword, limit=max_results, offset=(page - 1) * max_results)
+        if "arXiv" in errors:
+            st.warning(f"arXivの検索に失敗したため、arXivの結果はスキップします。: {errors['arXiv']}")
+        if "SemanticScholar" in errors:
+            st.warning(f"Semantic Scholar API制限のため、Semantic Scholarの検索はスキップします。: {errors['SemanticScholar']}")
+
+        # 同じ論文がソースをまたいで重複していれば1件にまとめ、正規化IDを付ける
+        all_papers = dedupe_papers(results["arXiv"] + results["SemanticScholar"])
+
+        # メタデータだけを登録する（保存済みの論文の処理状態・要約はそのまま残る）
+        paper_records = []
         for paper in all_papers:
-            paper_id = paper["url"].split("/")[-1]
-            paper_record = {
+            paper_id = paper_id_of(paper)
+            paper_records.append({
                 "id": paper_id,
                 "title": paper["title"],
                 "authors": paper["authors"],
@@ -56,34 +90,28 @@ if keyword:
                 "source": paper["source"],
                 "query": keyword,
                 "searched_at": datetime.now().isoformat(),
-                "pdf_path": "",
-                "text_path": "",
-                "summary_path": "",
-                "downloaded": 0,
-                "summarized": 0,
                 "url": paper.get("url", ""),
                 "pdf_url": paper.get("pdf_url", ""),
-                "background": "",   # 空文字列で初期化
-                "purpose": "",
-                "novelty": "",
-                "method": "",
-                "results": "",
-                "discussion": "",
-                "concerns": "",
-                "conclusion": "",
-                "future_work": "",
-                "keywords": json.dumps([], ensure_ascii=False)  # 空リストのJSON文字列
-            }
-            insert_or_update_paper(paper_record)
+            })
+        insert_or_update_papers(paper_records)  # 1トランザクションでまとめて登録
+        register_papers(all_papers)
 
         if all_papers:
             st.write(f"📄 PDF取得可能な論文数: {len(all_papers)} 件")
 
-            for paper in all_papers:
+            # 保存済みの論文とタイトルがほぼ同じものは、ダウンロード・要約の前に知らせる
+            duplicates = find_near_duplicates(
+                [paper["title"] for paper in all_papers],
+                exclude_ids=[paper_id_of(paper) for paper in all_papers],
+            )
+
+            for paper, dups in zip(all_papers, duplicates):
                 st.markdown(f"### [{paper['title']}]({paper['url']})")
                 st.markdown(f"- 著者: {paper['authors']}")
-                st.markdown(f"- 年: {paper['year']} / 雜誌: {paper['venue']} / ソース: {paper['source']}")
+                st.markdown(f"- 年: {paper['year']} / 雜誌: {paper['venue']} / ソース: {', '.join(paper['sources'])}")
                 st.markdown(f"- [📄 PDFを開く]({paper['pdf_url']})")
+                if dups:
+                    st.warning("⚠️ 保存済みの論文と重複している可能性があります: " + ", ".join(f"`{d}`" for d, _ in dups))
                 st.markdown("---")
 
             df = pd.DataFrame(all_papers)
@@ -92,47 +120,64 @@ if keyword:
             csv = df.to_csv(index=False).encode("utf-8")
             st.download_button("📅 論文一覧をCSVでダウンロード", data=csv, file_name=f"{keyword}_papers.csv", mime="text/csv")
 
-            if st.button("🔽 検索結果のPDFを一括ダウンロード＆要約開始"):
-                summaries = []
-
-                for paper in all_papers:
-                    try:
-                        paper_id = paper["url"].split("/")[-1]
-                        safe_title = paper['title'].replace(' ', '_').replace('/', '_')[:30]
-                        filename = f"{paper['source']}_{paper['year']}_{safe_title}.pdf"
+            skip_duplicates = st.checkbox("重複の可能性がある論文は処理しない", value=True)
+            targets = [paper for paper, dups in zip(all_papers, duplicates) if not (skip_duplicates and dups)]
 
-                        pdf_path = download_pdf(pdf_url=paper["pdf_url"], save_dir="data/pdf", filename=filename)
-
-                        if pdf_path is None or not os.path.exists(pdf_path):
-                            st.error(f"❌ PDFのダウンロードに失敗しました: {paper['title']}。")
-                            continue
-
-                        update_paper_status(paper_id, pdf_path=pdf_path, downloaded=1)
-
-                        text = extract_text_from_pdf(pdf_path)
+            # 表示した論文のPDFをボタンを押す前から取得しておく（押したときには要約の時間だけで済むように）
+            if st.checkbox("📥 表示中の論文のPDFを先読みする", value=PREFETCH_ENABLED):
+                prefetch(targets, prefetch_owner)
+                prefetch_labels = {
+                    PREFETCH_DONE: "取得済み", PREFETCH_RUNNING: "取得中", PREFETCH_PENDING: "待機中",
+                    PREFETCH_FAILED: "失敗", PREFETCH_SKIPPED: "容量の上限で省略", PREFETCH_CANCELLED: "取り消し",
+                }
 
-                        text_filename = f"{paper['source']}_{paper['year']}_{safe_title}.txt"
-                        text_path = os.path.join("data/text", text_filename)
-                        save_text_to_file(text, text_path)
+                def prefetch_busy() -> bool:
+                    status = prefetch_status(prefetch_owner)
+                    return bool(status.get(PREFETCH_PENDING) or status.get(PREFETCH_RUNNING))
 
-                        update_paper_status(paper_id, text_path=text_path)
+                busy_prefetching = prefetch_busy()
 
-                        summary = summarize_text(text)
-                        summary["タイトル"] = paper["title"]
-                        summary["ソース"] = paper["source"]
-                        summary["年"] = paper["year"]
-                        summaries.append(summary)
+                # 先読み中の間だけ、件数の表示を1秒ごとに更新する
+                @st.fragment(run_every=1 if busy_prefetching else None)
+                def show_prefetch():
+                    status = prefetch_status(prefetch_owner)
+                    st.caption("📥 先読み: " + " / ".join(
+                        f"{label} {status[state]}件" for state, label in prefetch_labels.items() if state in status
+                    ))
+                    if busy_prefetching and not prefetch_busy():
+                        st.rerun()  # すべて終わったら定期更新を止める
 
-                        summary_path = save_summary_to_file(summary, pdf_path)
-                        # sammaryの詳細をDBに保存
-                        update_summary_to_db(paper_id, summary)
-                        #sammaryファイルパスと要約済みフラグを更新
-                        update_paper_status(paper_id, summary_path=summary_path, summarized=1)
+                show_prefetch()
+            else:
+                cancel_prefetch(prefetch_owner)
 
-                        st.success(f"✅ {paper['title']} の要約が完了しました。")
+            if st.button("🕒 バックグラウンドの処理キューに追加"):
+                added = enqueue_papers(targets)
+                st.success(f"{added} 件をキューに追加しました。`python -m utils.worker` で処理されます。")
 
-                    except Exception as e:
-                        st.error(f"❌ {paper['title']} の処理でエラーが発生しました: {e}")
+            if st.button("🔽 検索結果のPDFを一括ダウンロード＆要約開始"):
+                summaries = []
+                progress = st.progress(0.0, text="処理待ち...")
+
+                # 先読み中のものは引き取ってから処理する（取得済みのPDF・本文はそのまま使われる）
+                with claim(targets, prefetch_owner) as prefetched:
+                    if prefetched:
+                        st.caption(f"📥 {prefetched} 件は先読みでPDFを取得済みです。")
+                    # ダウンロード・抽出・要約のうち古くなったものだけを並列に進め、終わった論文から順に表示する
+                    for i, result in enumerate(run_pipeline(targets), start=1):
+                        paper = result["paper"]
+                        if result["error"] is None and result["skipped"]:
+                            if result["summary"]:
+                                summaries.append(result["summary"])
+                            st.info(f"⏭ {paper['title']} は要約済みです。")
+                        elif result["error"] is None:
+                            summaries.append(result["summary"])
+                            st.success(f"✅ {paper['title']} の要約が完了しました。")
+                        elif result["stage"] == "download":
+                            st.error(f"❌ PDFのダウンロードに失敗しました: {paper['title']}。")
+                        else:
+                            st.error(f"❌ {paper['title']} の処理でエラーが発生しました: {result['error']}")
+                        progress.progress(i / len(targets), text=f"{i}/{len(targets)} 件完了")
 
                 if summaries:
                     df_summary = pd.DataFrame(summaries)
@@ -144,7 +189,23 @@ if keyword:
 
 
         else:
+            cancel_prefetch(prefetch_owner)
             st.warning("PDF付きの論文が見つかりませんでした。")
+elif "prefetch_owner" in st.session_state:
+    # キーワードを消したら先読みもやめる
+    from utils.prefetcher import cancel_prefetch
+    cancel_prefetch(st.session_state["prefetch_owner"])
+
+# ---------------------------------------
+# 🕒 バックグラウンド処理の進捗（ワーカーが処理する）
+# ---------------------------------------
+queue_counts = job_counts()
+if any(queue_counts.values()):
+    with st.expander("🕒 バックグラウンド処理の進捗", expanded=True):
+        st.write(" / ".join(f"{state}: {count}" for state, count in queue_counts.items()))
+        st.dataframe(pd.DataFrame(fetch_recent_jobs(limit=20)))
+        if st.button("🔄 進捗を更新"):
+            st.rerun()
 
 # ---------------------------------------
 # 📄 セクション2：PDFをアップロードして要約
@@ -154,73 +215,56 @@ st.header("🧠 PDFをアップロードして要約")
 uploaded_files = st.file_uploader("📎 PDFファイルをアップロード（複数可）", type=["pdf"], accept_multiple_files=True)
 
 if uploaded_files:
-    summaries = []
+    from utils.upload_processor import (
+        submit_upload, retry_upload, upload_status,
+        PENDING as UPLOAD_PENDING, RUNNING as UPLOAD_RUNNING, DONE as UPLOAD_DONE, FAILED as UPLOAD_FAILED,
+    )
 
+    # 内容のハッシュはファイルごとに一度だけ計算し、未処理のものだけをバックグラウンドで要約する
+    upload_digests = st.session_state.setdefault("upload_digests", {})
     for uploaded_file in uploaded_files:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            tmp_file_path = tmp_file.name
-
-        with st.spinner(f"{uploaded_file.name} を要約中..."):
-            try:
-                # テキスト抽出
-                text = extract_text_from_pdf(tmp_file_path)
-
-                # テキスト保存
-                safe_name = uploaded_file.name.replace(' ', '_').replace('/', '_')[:30]
-                text_path = os.path.join("data/text", safe_name + ".txt")
-                save_text_to_file(text, text_path)
-
-                # 要約生成
-                summary = summarize_text(text)
-                summary["ファイル名"] = uploaded_file.name
+        if uploaded_file.file_id not in upload_digests:
+            upload_digests[uploaded_file.file_id] = submit_upload(uploaded_file.name, uploaded_file.getvalue())
+    uploads = [(uploaded_file.name, upload_digests[uploaded_file.file_id]) for uploaded_file in uploaded_files]
+
+    def uploads_busy() -> bool:
+        return any(upload_status(digest)["state"] in (UPLOAD_PENDING, UPLOAD_RUNNING) for _, digest in uploads)
+
+    busy = uploads_busy()
+
+    # 処理中のものがある間だけ、この部分を1秒ごとに更新する（要約の項目は確定したものから表示する）
+    @st.fragment(run_every=1 if busy else None)
+    def show_uploads():
+        summaries = []
+        for name, digest in uploads:
+            status = upload_status(digest)
+            if status["state"] == UPLOAD_DONE:
+                summary = dict(status["summary"] or {})
+                summary["ファイル名"] = name
                 summaries.append(summary)
+                st.success(f"✅ {name} の要約が完了しました。")
+            elif status["state"] == UPLOAD_FAILED:
+                st.error(f"{name} の要約に失敗しました：{status['error']}")
+                if st.button("🔁 再試行", key=f"retry-{digest}"):
+                    retry_upload(digest)
+                    st.rerun()
+            else:
+                st.info(f"⏳ {name} を要約中...")
+                for field, value in status["partial"].items():
+                    st.markdown(f"**{field}:** {', '.join(value) if isinstance(value, list) else value}")
 
-                # 要約をJSONファイルに保存
-                summary_path = save_summary_to_file(summary, tmp_file_path)
-
-                # DB保存処理（ファイルアップロードなのでIDがない場合はファイル名で仮ID）
-                paper_id = safe_name  # もしID体系があるなら適宜変えてください
-
-                # まず論文レコードを登録 or 更新
-                paper_record = {
-                    "id": paper_id,
-                    "title": uploaded_file.name,
-                    "authors": "",
-                    "year": "",
-                    "source": "uploaded_pdf",
-                    "query": "",
-                    "searched_at": datetime.now().isoformat(),
-                    "pdf_path": tmp_file_path,
-                    "text_path": text_path,
-                    "summary_path": summary_path,
-                    "downloaded": 1,
-                    "summarized": 1,
-                    "url": "",
-                    "pdf_url": "",
-                    "background": summary.get("背景", ""),
-                    "purpose": summary.get("目的", ""),
-                    "novelty": summary.get("新規性", ""),
-                    "method": summary.get("方法", ""),
-                    "results": summary.get("結果", ""),
-                    "discussion": summary.get("考察", ""),
-                    "concerns": summary.get("懸念点", ""),
-                    "conclusion": summary.get("結論", ""),
-                    "future_work": summary.get("今後の展望", ""),
-                    "keywords": json.dumps(summary.get("キーワード", []), ensure_ascii=False)
-                }
-                insert_or_update_paper(paper_record)
+        if summaries:
+            df_summary = pd.DataFrame(summaries)
+            st.subheader("📝 要約結果")
+            st.dataframe(df_summary)
 
-            except Exception as e:
-                st.error(f"{uploaded_file.name} の要約に失敗しました：{e}")
+            csv_summary = df_summary.to_csv(index=False).encode("utf-8")
+            st.download_button("📅 要約結果をCSVでダウンロード", data=csv_summary, file_name="summaries.csv", mime="text/csv")
 
-    if summaries:
-        df_summary = pd.DataFrame(summaries)
-        st.subheader("📝 要約結果")
-        st.dataframe(df_summary)
+        if busy and not uploads_busy():
+            st.rerun()  # すべて終わったら定期更新を止める
 
-        csv_summary = df_summary.to_csv(index=False).encode("utf-8")
-        st.download_button("📅 要約結果をCSVでダウンロード", data=csv_summary, file_name="summaries.csv", mime="text/csv")
+    show_uploads()
 
 
 # ---------------------------------------
@@ -229,24 +273,105 @@ if uploaded_files:
 
 st.header("📚 保存済み論文一覧")
 
-from utils.db_manager import fetch_all_papers
-
-papers = fetch_all_papers()
-
-if papers:
-    import pandas as pd
-    # いくつかの主要カラムだけ表示例
-    df = pd.DataFrame(papers)
-    display_cols = [
-        "id", "title", "authors", "year", "source", "downloaded", "summarized"
-    ]
-    st.dataframe(df[display_cols])
+from utils.db_manager import (
+    search_papers, fetch_papers_page, fetch_paper, count_papers, fetch_distinct_values, top_terms, related_keywords,
+)
+
+# タイトル・著者・要約・本文の全文検索
+fts_query = st.text_input("🔎 保存済み論文を全文検索（タイトル・著者・要約・本文）")
+if fts_query:
+    hits = search_papers(fts_query, limit=20)
+    if hits:
+        for hit in hits:
+            st.markdown(f"**{hit['title']}**（ID: `{hit['id']}` / {hit['source']} / {hit['year']}）")
+            st.caption(hit["snippet"])
+    else:
+        st.info("該当する論文が見つかりませんでした。")
+
+total_papers = count_papers()
+
+if total_papers:
+    # フィルタ（条件はSQLで絞り込み、表示するページ分だけ取得する）
+    col_source, col_year, col_summarized, col_size = st.columns(4)
+    source_filter = col_source.selectbox("ソース", ["すべて"] + fetch_distinct_values("source"))
+    year_filter = col_year.selectbox("年", ["すべて"] + fetch_distinct_values("year")[::-1])
+    summarized_filter = col_summarized.selectbox("要約", ["すべて", "要約済み", "未要約"])
+    page_size = col_size.selectbox("表示件数", [20, 50, 100], index=1)
+
+    # キーワード・著者のファセット（論文数の多い順。件数は集計済みの値を使う）
+    col_keyword, col_author = st.columns(2)
+    keyword_counts = dict(top_terms("keyword", FACET_SIZE))
+    author_counts = dict(top_terms("author", FACET_SIZE))
+    keyword_filter = col_keyword.selectbox(
+        "キーワード", ["すべて"] + list(keyword_counts),
+        format_func=lambda k: k if k == "すべて" else f"{k}（{keyword_counts[k]}）",
+    )
+    author_filter = col_author.selectbox(
+        "著者", ["すべて"] + list(author_counts),
+        format_func=lambda a: a if a == "すべて" else f"{a}（{author_counts[a]}）",
+    )
+
+    filters = {
+        "source": None if source_filter == "すべて" else source_filter,
+        "year": None if year_filter == "すべて" else year_filter,
+        "summarized": {"すべて": None, "要約済み": True, "未要約": False}[summarized_filter],
+        "keyword": None if keyword_filter == "すべて" else keyword_filter,
+        "author": None if author_filter == "すべて" else author_filter,
+    }
+
+    # ページごとの開始位置（キーセット）を保持し、条件が変わったら先頭に戻る
+    filter_key = (tuple(filters.values()), page_size)
+    if st.session_state.get("library_filter_key") != filter_key:
+        st.session_state["library_filter_key"] = filter_key
+        st.session_state["library_cursors"] = [None]
+    cursors = st.session_state["library_cursors"]
+
+    rows, next_cursor = fetch_papers_page(limit=page_size, after=cursors[-1], **filters)
+    st.caption(f"{count_papers(**filters)} 件中 {len(cursors)} ページ目")
+    if rows:
+        st.dataframe(pd.DataFrame(rows)[["id", "title", "authors", "year", "source", "downloaded", "summarized"]])
+
+    col_prev, col_next = st.columns(2)
+    if col_prev.button("◀ 前のページ", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if col_next.button("次のページ ▶", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+
+    with st.expander("🏷 キーワードの集計"):
+        queries = fetch_distinct_values("query")
+        query_filter = st.selectbox("検索キーワード", ["すべて"] + queries)
+        top = top_terms("keyword", 20, None if query_filter == "すべて" else query_filter)
+        if top:
+            st.dataframe(pd.DataFrame(top, columns=["キーワード", "論文数"]))
+        if filters["keyword"]:
+            co_keywords = related_keywords(filters["keyword"], limit=10)
+            if co_keywords:
+                st.markdown(f"「{filters['keyword']}」と一緒に付いているキーワード")
+                st.dataframe(pd.DataFrame(co_keywords, columns=["キーワード", "論文数"]))
+
+    # 絞り込んだ論文をすべてファイルに書き出す（少しずつ読んで書くので件数が多くても使うメモリは一定）
+    with st.expander("📦 一覧をエクスポート"):
+        col_format, col_text = st.columns(2)
+        export_format = col_format.selectbox("形式", EXPORT_FORMATS)
+        include_text = col_text.checkbox("抽出した本文も含める")
+        if st.button("エクスポートを作成"):
+            export_path = os.path.join(EXPORT_DIR, f"papers_{datetime.now():%Y%m%d_%H%M%S}.{export_format}")
+            with st.spinner("書き出し中..."):
+                exported = export_to_file(export_path, export_format, include_text=include_text, **filters)
+            st.session_state["export_path"] = export_path
+            st.success(f"{exported} 件を書き出しました: {export_path}")
+        export_path = st.session_state.get("export_path")
+        if export_path and os.path.exists(export_path):
+            with open(export_path, "rb") as f:
+                st.download_button("📥 ダウンロード", data=f, file_name=os.path.basename(export_path))
 
     # クリックで詳細表示（タイトルクリックなどの拡張も可）
     paper_id = st.text_input("詳細を見たい論文のIDを入力してください")
 
     if paper_id:
-        selected = next((p for p in papers if p["id"] == paper_id), None)
+        selected = fetch_paper(paper_id)
         if selected:
             st.subheader(f"📖 {selected['title']}")
             st.write(f"著者: {selected['authors']}")
@@ -265,8 +390,57 @@ if papers:
             st.write(f"**結論:** {selected.get('conclusion', '')}")
             st.write(f"**今後の展望:** {selected.get('future_work', '')}")
             st.write(f"**キーワード:** {selected.get('keywords', '')}")
+
+            from utils.croma_manager import related_papers
+            related = related_papers(paper_id, k=5)
+            if related:
+                st.markdown("### 関連する論文")
+                for related_id, score in related:
+                    related_paper = fetch_paper(related_id)
+                    if related_paper:
+                        st.write(f"- {related_paper['title']}（ID: `{related_id}` / 類似度 {score:.2f}）")
         else:
             st.warning("指定されたIDの論文が見つかりません。")
 else:
     st.info("まだ論文データがありません。")
 
+# ---------------------------------------
+# ⏱ 処理時間・API使用量（utils/metrics.py の記録）
+# ---------------------------------------
+with st.expander("⏱ パフォーマンス"):
+    window_hours = st.selectbox("集計期間", [1, 24, 24 * 7], index=1, format_func=lambda h: f"直近{h}時間")
+    # 集計はバッファの書き出しと期間内の全記録の読み込みを伴うので、表示を選んだときだけ行う（結果も少しの間使い回す）
+    if not st.toggle("集計を表示する", key="show_metrics"):
+        st.caption("オンにすると、記録された処理時間・件数を集計して表示します。")
+    else:
+        metrics = cached_metrics(window_hours)
+        durations = [
+            {
+                "処理": item["name"].removesuffix("_seconds"),
+                "ラベル": ", ".join(f"{k}={v}" for k, v in item["labels"].items()),
+                "回数": item["count"],
+                "p50 (ms)": round(item["p50"] * 1000, 1),
+                "p95 (ms)": round(item["p95"] * 1000, 1),
+            }
+            for item in metrics["histograms"] if item["name"].endswith("_seconds")
+        ]
+        others = [
+            {"指標": item["name"], "ラベル": ", ".join(f"{k}={v}" for k, v in item["labels"].items()),
+             "回数": item["count"], "p50": round(item["p50"], 2), "p95": round(item["p95"], 2)}
+            for item in metrics["histograms"] if not item["name"].endswith("_seconds")
+        ]
+        counters = [
+            {"指標": item["name"], "ラベル": ", ".join(f"{k}={v}" for k, v in item["labels"].items()), "合計": item["value"]}
+            for item in metrics["counters"]
+        ]
+        if durations:
+            st.markdown("#### 処理時間")
+            st.dataframe(pd.DataFrame(durations))
+        if others:
+            st.markdown("#### 転送量・ページあたりの時間など")
+            st.dataframe(pd.DataFrame(others))
+        if counters:
+            st.markdown("#### 件数・トークン数")
+            st.dataframe(pd.DataFrame(counters))
+        if not (durations or others or counters):
+            st.info("まだ記録がありません。")
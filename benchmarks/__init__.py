@@ -0,0 +1 @@
+# benchmarks: 検索→ダウンロード→抽出→要約のオフラインベンチマーク
@@ -0,0 +1,64 @@
+# benchmarks/compare.py
+# 2回分のベンチマーク結果を比べ、悪化したものを表示する
+#   python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json --threshold 0.1
+# 悪化（レイテンシの増加・スループットの低下）が threshold を超えたものがあれば終了コード 1 を返す。
+
+import argparse
+import json
+import sys
+
+# (指標名, 値の取り出し方, 大きいほど良いか)
+METRICS = [
+    ("p50_ms", lambda r: r["latency_ms"]["p50"], False),
+    ("p95_ms", lambda r: r["latency_ms"]["p95"], False),
+    ("ops_per_sec", lambda r: r["ops_per_sec"], True),
+    ("peak_rss_mb", lambda r: r.get("peak_rss_mb"), False),
+]
+
+
+def compare(before: dict, after: dict, threshold: float, include_rss: bool = False) -> list:
+    """ベンチマーク名ごとの変化率を計算し、(名前, 指標, 前, 後, 変化率, 悪化したか) のリストを返す。"""
+    rows = []
+    for name in sorted(set(before["results"]) & set(after["results"])):
+        for metric, get, higher_is_better in METRICS:
+            if metric == "peak_rss_mb" and not include_rss:
+                continue
+            old, new = get(before["results"][name]), get(after["results"][name])
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            rows.append((name, metric, old, new, change, worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="2回分のベンチマーク結果を比較します。")
+    parser.add_argument("before", help="基準となる結果のJSON")
+    parser.add_argument("after", help="比較する結果のJSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="悪化とみなす変化率（0.10 = 10%%）")
+    parser.add_argument("--rss", action="store_true", help="ピークRSSも比較する")
+    parser.add_argument("--all", action="store_true", help="悪化していないものも表示する")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+
+    rows = compare(before, after, args.threshold, args.rss)
+    regressions = [row for row in rows if row[5]]
+    for name, metric, old, new, change, regressed in rows:
+        if regressed or args.all:
+            mark = "❌" if regressed else "  "
+            print(f"{mark} {name:50s} {metric:12s} {old:>12.3f} → {new:>12.3f} ({change:+.1%})")
+
+    missing = sorted(set(before["results"]) - set(after["results"]))
+    if missing:
+        print(f"⚠️ 比較先にないベンチマーク: {', '.join(missing)}")
+    print(f"{len(regressions)}件の悪化（しきい値 {args.threshold:.0%}）")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+# benchmarks/run.py
+# 検索→ダウンロード→抽出→要約→DB書き込みを、ローカルのスタブサーバー相手に計測する
+#   python -m benchmarks.run                                  # すべて実行
+#   python -m benchmarks.run --only extract,clean --quick
+#   python -m benchmarks.run --llm-latency 0.5 --output before.json
+#   python -m benchmarks.compare before.json after.json       # 2回分を比較
+# 結果（スループット・レイテンシのパーセンタイル・ピークRSS）は JSON に保存する。
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.corpus import build_corpus, PAGE_COUNTS, QUICK_PAGE_COUNTS
+from benchmarks.stubs import StubServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+CORPUS_DIR = os.path.join(tempfile.gettempdir(), "paper_summary_bench_corpus")
+GROUPS = ["search", "download", "extract", "clean", "summarize", "db", "end_to_end", "startup"]
+# 新しいプロセスでの読み込み時間を測るモジュール
+STARTUP_MODULES = ["utils.db_manager", "utils.summarizer", "utils.pipeline", "utils.upload_processor", "utils.exporter"]
+UI_SCRIPT = os.path.join(REPO_ROOT, "app", "streamlit_ui.py")
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux は KB、macOS は bytes で返る
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(fn, iterations: int, warmup: int = 1, unit: str = None) -> dict:
+    """
+    fn(i) を warmup 回空回ししてから iterations 回計測する（i は計測の通し番号、空回しは負の値）。
+    fn が数値を返す場合は処理量（ページ数・バイト数など）として unit/秒 を計算する。
+    """
+    for i in range(warmup):
+        fn(-1 - i)
+    latencies, units = [], 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        amount = fn(i)
+        latencies.append(time.perf_counter() - t)
+        units += amount or 0
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "iterations": iterations,
+        "total_seconds": round(total, 4),
+        "ops_per_sec": round(iterations / total, 3) if total else None,
+        "latency_ms": {
+            "min": round(latencies[0] * 1000, 3),
+            "p50": round(_percentile(latencies, 0.5) * 1000, 3),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+        },
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+    if unit and total:
+        result["units"] = units
+        result[f"{unit}_per_sec"] = round(units / total, 3)
+    return result
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _pages_of(name: str) -> int:
+    """コーパスのファイル名（例: en_200p.pdf）からページ数を取り出す。"""
+    return int(name.split("_")[1].split("p")[0])
+
+
+def _paper_row(paper_id: str, i: int) -> dict:
+    from utils.db_manager import PAPER_COLUMNS
+    row = {column: None for column in PAPER_COLUMNS}
+    row.update(id=paper_id, title=f"Benchmark paper {i}", authors="Bench Author", year="2024", source="arXiv",
+               query="benchmark", searched_at=datetime.now().isoformat(), downloaded=0, summarized=0,
+               url=f"http://arxiv.org/abs/bench.{i}", pdf_url="")
+    return row
+
+
+# --- 各ベンチマーク ---
+
+def bench_search(server, args) -> dict:
+    from utils.arxiv_search import search_arxiv
+    from utils.semantic_scholar_search import search_semantic_scholar
+    return {
+        "search/arxiv": measure(lambda i: len(search_arxiv(f"bench {i}", max_results=args.search_limit)),
+                                args.iterations, unit="papers"),
+        "search/semantic_scholar": measure(
+            lambda i: len(search_semantic_scholar(f"bench {i}", limit=args.search_limit)),
+            args.iterations, unit="papers"),
+    }
+
+
+def bench_download(server, args) -> dict:
+    from utils.pdf_downloader import download_pdf
+    save_dir = os.path.join("data", "bench_download")
+    results = {}
+    for name in server.pdf_names:
+        def run(i, name=name):
+            # 毎回新しいファイル名にして、ETag・ハッシュによる省略を起こさない
+            path = download_pdf(f"{server.base_url}/pdf/{name}", save_dir, f"{i}_{name}")
+            size = os.path.getsize(path)
+            os.remove(path)
+            os.remove(path + ".meta.json")
+            return size
+        results[f"download/{name}"] = measure(run, args.iterations, unit="bytes")
+    return results
+
+
+def bench_extract(server, args) -> dict:
+    from utils.pdf_text_extractor import extract_text_from_pdf, page_count
+    results = {}
+    for name, path in sorted(server.corpus.items()):
+        pages = page_count(path)
+        results[f"extract/{name}"] = measure(
+            lambda i, path=path, pages=pages: extract_text_from_pdf(path, workers=1) and pages,
+            args.iterations, unit="pages")
+    largest = max(server.corpus, key=_pages_of)
+    pages = page_count(server.corpus[largest])
+    results[f"extract_parallel/{largest}"] = measure(
+        lambda i: extract_text_from_pdf(server.corpus[largest]) and pages, args.iterations, unit="pages")
+    return results
+
+
+# clean_pdf_text を1回の置換にする前の実装（出力が変わっていないことの確認用）
+def _reference_clean(text: str) -> str:
+    text = text.replace("\n", " ")
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\[\d+\]", "", text)
+    text = re.sub(r"[^\x00-\x7Fぁ-んァ-ン一-龥。、．，：；！？「」『』（）【】]", "", text)
+    return text.strip()
+
+
+# 差分を探すランダムな文字列に使う文字（空白・引用番号・対象外の文字の境目が出やすいもの）
+CLEAN_FUZZ_ALPHABET = list("ab1 [] \n\t\r") + ["é", "\u3000", "\xa0", "\x1c", "漢", "あ", "。", "ー", "١", "€"]
+
+
+def check_clean_equivalence(raw_texts, cases: int) -> int:
+    """clean_pdf_text と旧実装の出力を比べ、一致しない入力があれば AssertionError を送出する。比べた件数を返す。"""
+    from utils.pdf_text_extractor import clean_pdf_text
+    rng = random.Random(0)
+    inputs = list(raw_texts) + [
+        "".join(rng.choice(CLEAN_FUZZ_ALPHABET) for _ in range(rng.randint(0, 16))) for _ in range(cases)
+    ]
+    for text in inputs:
+        expected, actual = _reference_clean(text), clean_pdf_text(text)
+        if expected != actual:
+            raise AssertionError(f"clean_pdf_text が旧実装と異なります: {text[:80]!r} → {actual[:80]!r}（旧: {expected[:80]!r}）")
+    return len(inputs)
+
+
+def bench_clean(server, args) -> dict:
+    from utils.pdf_text_extractor import extract_raw_pages, clean_pdf_text
+    results = {}
+    raws = []
+    for prefix in ("en", "ja"):
+        name = max((n for n in server.corpus if n.startswith(prefix)), key=_pages_of)
+        raw = "\n".join(extract_raw_pages(server.corpus[name], workers=1))
+        raws.append(raw)
+        results[f"clean/{name}"] = measure(lambda i, raw=raw: clean_pdf_text(raw) and len(raw),
+                                           args.iterations, unit="chars")
+    checked = check_clean_equivalence(raws, 20000 if args.quick else 200000)
+    for result in results.values():
+        result["equivalence_checked"] = checked
+    return results
+
+
+def bench_summarize(server, args) -> dict:
+    from utils.pdf_text_extractor import extract_text_from_pdf
+    from utils.summarizer import summarize_text
+    from utils.text_sections import reduce_text
+    short = extract_text_from_pdf(server.corpus["en_10p.pdf"], workers=1)
+    long_name = max((n for n in server.corpus if n.startswith("en")), key=_pages_of)
+    long_text = extract_text_from_pdf(server.corpus[long_name], workers=1)
+    # 参考文献などを除いて予算内に収めてから要約する（map_reduce の全文要約と比べる）
+    reduced = measure(lambda i: summarize_text(reduce_text(long_text)[0], use_cache=False) and 1,
+                      max(1, args.iterations // 2))
+    _, stats = reduce_text(long_text)
+    reduced.update(text_tokens=stats["text_tokens"], input_tokens=stats["input_tokens"])
+    return {
+        "summarize/single": measure(lambda i: summarize_text(short, use_cache=False, mode="single") and 1,
+                                    args.iterations),
+        f"summarize/map_reduce_{long_name}": measure(
+            lambda i: summarize_text(long_text, use_cache=False, mode="map_reduce") and 1,
+            max(1, args.iterations // 2)),
+        f"summarize/reduced_{long_name}": reduced,
+        "summarize/cached": measure(lambda i: summarize_text(short) and 1, args.iterations),
+        "summarize/stream": bench_stream(short, args),
+    }
+
+
+def bench_stream(text: str, args) -> dict:
+    """ストリーミングで要約し、全体の時間に加えて最初の項目が届くまでの時間（first_field_ms）も記録する。"""
+    from utils.summarizer import summarize_text
+    first_fields = []
+
+    def run(i):
+        start = time.perf_counter()
+        first = []
+
+        def on_field(key, value):
+            if not first:
+                first.append(time.perf_counter() - start)
+
+        summarize_text(text, use_cache=False, mode="single", on_field=on_field)
+        if i >= 0:
+            first_fields.append(first[0])
+        return 1
+
+    result = measure(run, args.iterations)
+    first_fields.sort()
+    result["first_field_ms"] = {
+        "p50": round(_percentile(first_fields, 0.5) * 1000, 3),
+        "p95": round(_percentile(first_fields, 0.95) * 1000, 3),
+    }
+    return result
+
+
+def bench_db(server, args) -> dict:
+    from utils.db_manager import insert_or_update_papers, update_summary_to_db, update_paper_status
+    from benchmarks.stubs import SUMMARY
+    n = args.db_rows
+
+    def insert(i):
+        insert_or_update_papers([_paper_row(f"bench:{i}:{j}", j) for j in range(n)])
+        return n
+
+    def update_summaries(i):
+        for j in range(n):
+            update_summary_to_db(f"bench:{max(i, 0)}:{j}", SUMMARY)
+        return n
+
+    def update_status(i):
+        for j in range(n):
+            update_paper_status(f"bench:{max(i, 0)}:{j}", downloaded=1)
+        return n
+
+    return {
+        "db/insert_or_update_papers": measure(insert, args.iterations, unit="rows"),
+        "db/update_summary_to_db": measure(update_summaries, args.iterations, unit="rows"),
+        "db/update_paper_status": measure(update_status, args.iterations, unit="rows"),
+    }
+
+
+def bench_end_to_end(server, args) -> dict:
+    from utils.paper_search import search_all_sources
+    from utils.paper_resolver import dedupe_papers, register_papers
+    from utils.db_manager import insert_or_update_papers
+    from utils.pipeline import run_pipeline
+
+    def run(i):
+        results, errors = search_all_sources(f"end to end {i}", limit=args.e2e_papers)
+        if errors:
+            raise RuntimeError(f"検索に失敗しました: {errors}")
+        papers = dedupe_papers(p for source_papers in results.values() for p in source_papers)
+        rows = [{**_paper_row(p["id"], n), "title": p["title"], "pdf_url": p["pdf_url"]} for n, p in enumerate(papers)]
+        insert_or_update_papers(rows)
+        register_papers(papers)
+        done = [r for r in run_pipeline(papers) if r["error"] is None]
+        return len(done)
+
+    return {"end_to_end/pipeline": measure(run, max(1, args.iterations // 2), warmup=0, unit="papers")}
+
+
+def bench_startup(server, args) -> dict:
+    """
+    新しいプロセスで各モジュールを import するまでの時間（コールドスタート）と、
+    Streamlit の画面を再実行1回あたりにかかる時間を測る。startup/python は interpreter 自体の起動時間。
+    """
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT}
+
+    def run_python(code):
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+    results = {"startup/python": measure(lambda i: run_python("pass"), args.iterations)}
+    for module in STARTUP_MODULES:
+        results[f"startup/import_{module}"] = measure(lambda i, module=module: run_python(f"import {module}"),
+                                                      args.iterations)
+
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("  streamlit がないため startup/ui_rerun は省略します", flush=True)
+        return results
+    app = AppTest.from_file(UI_SCRIPT, default_timeout=120)
+
+    def rerun(i):
+        app.run()
+        if app.exception:
+            raise RuntimeError(f"画面の実行に失敗しました: {app.exception[0].value}")
+
+    results["startup/ui_rerun"] = measure(rerun, args.iterations)
+    return results
+
+
+BENCHMARKS = {
+    "search": bench_search,
+    "download": bench_download,
+    "extract": bench_extract,
+    "clean": bench_clean,
+    "summarize": bench_summarize,
+    "db": bench_db,
+    "end_to_end": bench_end_to_end,
+    "startup": bench_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="オフラインのベンチマークを実行します。")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"実行するグループ（カンマ区切り: {','.join(GROUPS)}）")
+    parser.add_argument("--iterations", type=int, default=5, help="各ベンチマークの計測回数")
+    parser.add_argument("--quick", action="store_true", help="200ページのPDFを使わず短時間で終える")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="OpenAI スタブの応答遅延（秒）")
+    parser.add_argument("--search-limit", type=int, default=50, help="1回の検索で取得する件数")
+    parser.add_argument("--db-rows", type=int, default=500, help="DBベンチマークの1回あたりの行数")
+    parser.add_argument("--e2e-papers", type=int, default=8, help="end_to_end で1ソースあたりに検索する件数")
+    parser.add_argument("--output", default=None, help="結果のJSON（省略時は benchmarks/results/<日時>.json）")
+    parser.add_argument("--keep-workdir", action="store_true", help="作業ディレクトリ（DB・PDFなど）を残す")
+    args = parser.parse_args()
+
+    groups = [g.strip() for g in args.only.split(",") if g.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"不明なグループです: {sorted(unknown)}")
+
+    page_counts = QUICK_PAGE_COUNTS if args.quick else PAGE_COUNTS
+    corpus = build_corpus(CORPUS_DIR, page_counts)
+    server = StubServer(corpus, llm_latency=args.llm_latency).start()
+
+    # utils を読み込む前に接続先をスタブへ切り替える（OpenAI のホストは読み込み時に決まる）
+    os.environ["ARXIV_API_URL"] = f"{server.base_url}/arxiv/api/query"
+    os.environ["SEMANTIC_SCHOLAR_API_URL"] = f"{server.base_url}/s2/graph/v1/paper/search"
+    os.environ["OPENAI_BASE_URL"] = f"{server.base_url}/openai/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    sys.path.insert(0, REPO_ROOT)
+
+    # utils は相対パスの data/ を使うので、一時ディレクトリで実行する
+    workdir = tempfile.mkdtemp(prefix="paper_summary_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from utils import rate_limiter
+        from utils.db_manager import init_db
+        # スタブへのアクセスはレート制限しない（本物のAPIの制限ではなく処理自体を測る）
+        rate_limiter.HOST_LIMITS[server.netloc] = (1e6, 1e6, 64)
+        init_db()
+
+        results = {}
+        for group in groups:
+            print(f"▶ {group}", flush=True)
+            for name, result in BENCHMARKS[group](server, args).items():
+                results[name] = result
+                first_field = f" first_field p50={result['first_field_ms']['p50']}ms" if "first_field_ms" in result else ""
+                tokens = f" tokens {result['text_tokens']}→{result['input_tokens']}" if "input_tokens" in result else ""
+                print(f"  {name}: p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms "
+                      f"{result['ops_per_sec']} ops/s{first_field}{tokens}", flush=True)
+    finally:
+        from utils.metrics import flush
+        flush()
+        os.chdir(cwd)
+        server.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "stub_requests": server.requests,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果を保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
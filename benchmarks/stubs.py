@@ -0,0 +1,229 @@
+# benchmarks/stubs.py
+# ベンチマーク用のローカルHTTPサーバー
+#   /pdf/<name>                       合成PDFを配信（ETag・Content-Length付き）
+#   /arxiv/api/query                  arXiv API（Atom）のスタブ
+#   /s2/graph/v1/paper/search         Semantic Scholar API（JSON）のスタブ
+#   /openai/v1/chat/completions       OpenAI Chat Completions のスタブ（応答の遅延を設定できる。stream にも対応）
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+SUMMARY = {
+    "背景": "大規模な論文集合を効率よく読む必要がある。",
+    "目的": "論文の要約を自動で作成する。",
+    "新規性": "検索から要約までを一貫して処理する。",
+    "方法": "PDFからテキストを抽出しLLMで要約する。",
+    "結果": "要約の品質と処理時間を評価した。",
+    "考察": "長い論文では分割要約が有効である。",
+    "懸念点": "抽出の品質がPDFに依存する。",
+    "結論": "提案する仕組みは実用的である。",
+    "今後の展望": "図表の扱いを改善する。",
+    "キーワード": ["要約", "論文", "LLM"],
+}
+
+
+STREAM_PIECE_CHARS = 8  # ストリーミングの応答で1回に送る文字数
+
+TITLE_WORDS = ("efficient scalable robust neural sparse adaptive contrastive hierarchical multilingual "
+               "retrieval summarization transformer graph diffusion reasoning benchmark alignment "
+               "distillation quantization compression attention memory planning").split()
+
+
+def _title(query: str, n: int) -> str:
+    """番号ごとに十分異なるタイトル（似たタイトルは重複として統合されるため）。"""
+    rng = random.Random(f"{query}-{n}")
+    return f"{' '.join(rng.sample(TITLE_WORDS, 6)).capitalize()} for {query}"
+
+
+def _paper_ids(query: str, start: int, count: int) -> list:
+    """クエリと位置から決まる arXiv 風のID（同じクエリなら同じIDを返す）。"""
+    prefix = int(hashlib.md5(query.encode("utf-8")).hexdigest()[:4], 16) % 900 + 1000
+    return [f"{prefix}.{i:05d}" for i in range(start, start + count)]
+
+
+class StubServer:
+    def __init__(self, corpus: dict, llm_latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.corpus = corpus
+        self.pdf_names = sorted(corpus)
+        self.llm_latency = llm_latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._etags = {name: hashlib.md5(f"{name}-{os.path.getsize(path)}".encode()).hexdigest()
+                       for name, path in corpus.items()}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def netloc(self) -> str:
+        return urlparse(self.base_url).netloc
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, route: str):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def pdf_url(self, index: int) -> str:
+        return f"{self.base_url}/pdf/{self.pdf_names[index % len(self.pdf_names)]}"
+
+    # --- 応答の生成 ---
+
+    def arxiv_feed(self, query: str, start: int, count: int) -> bytes:
+        entries = []
+        for i, arxiv_id in enumerate(_paper_ids(query, start, count)):
+            entries.append(f"""
+  <entry>
+    <id>http://arxiv.org/abs/{arxiv_id}v1</id>
+    <published>2024-01-{i % 28 + 1:02d}T00:00:00Z</published>
+    <title>{escape(_title(query, start + i))}</title>
+    <summary>Synthetic abstract for benchmark paper {start + i}.</summary>
+    <author><name>Author {i}</name></author>
+    <author><name>Author {i + 1}</name></author>
+    <link href="http://arxiv.org/abs/{arxiv_id}v1" rel="alternate" type="text/html"/>
+    <link title="pdf" href="{self.pdf_url(start + i)}" rel="related" type="application/pdf"/>
+  </entry>""")
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>arXiv Query: {escape(query)}</title>
+  {"".join(entries)}
+</feed>""".encode("utf-8")
+
+    def s2_results(self, query: str, offset: int, limit: int) -> bytes:
+        data = []
+        for i, arxiv_id in enumerate(_paper_ids(query, offset, limit)):
+            # 半分は arXiv と同じ論文（重複の統合の対象）、残りは S2 のみの論文
+            shared = i % 2 == 0
+            data.append({
+                "paperId": hashlib.sha1(f"{query}-{offset + i}".encode()).hexdigest(),
+                "externalIds": {"ArXiv": arxiv_id} if shared else {"DOI": f"10.9999/bench.{offset + i}"},
+                "title": _title(query, offset + i) if shared else _title(f"{query} companion", offset + i),
+                "authors": [{"name": f"Author {i}"}],
+                "year": 2024,
+                "venue": "Bench",
+                "url": f"https://www.semanticscholar.org/paper/{offset + i}",
+                "openAccessPdf": {"url": self.pdf_url(offset + i)},
+                "abstract": f"Synthetic abstract for benchmark paper {offset + i}.",
+            })
+        return json.dumps({"total": 10000, "offset": offset, "data": data}).encode("utf-8")
+
+    def chat_completion(self, body: dict) -> bytes:
+        if self.llm_latency:
+            time.sleep(self.llm_latency)
+        prompt = body["messages"][-1]["content"]
+        content = json.dumps(SUMMARY, ensure_ascii=False)
+        return json.dumps({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(content) // 2,
+                "total_tokens": len(prompt) // 4 + len(content) // 2,
+            },
+        }, ensure_ascii=False).encode("utf-8")
+
+    def chat_completion_chunks(self, body: dict):
+        """stream=True のときの応答（SSE の data 行）を、遅延を分けながら少しずつ返す。"""
+        prompt = body["messages"][-1]["content"]
+        content = json.dumps(SUMMARY, ensure_ascii=False)
+        pieces = [content[i:i + STREAM_PIECE_CHARS] for i in range(0, len(content), STREAM_PIECE_CHARS)]
+        base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "gpt-4o")}
+        for piece in pieces:
+            if self.llm_latency:
+                time.sleep(self.llm_latency / len(pieces))
+            chunk = {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 2,
+                 "total_tokens": len(prompt) // 4 + len(content) // 2}
+        yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode("utf-8")
+        yield b"data: [DONE]\n\n"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive を使う
+            disable_nagle_algorithm = True  # 小さな応答が遅延ACKで40ms待たされないように
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, chunks):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path.startswith("/pdf/"):
+                    server._count("pdf")
+                    name = url.path[len("/pdf/"):]
+                    if name not in server.corpus:
+                        return self._send(404, b"not found", "text/plain")
+                    etag = f'"{server._etags[name]}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    with open(server.corpus[name], "rb") as f:
+                        return self._send(200, f.read(), "application/pdf", {"ETag": etag})
+                if url.path == "/arxiv/api/query":
+                    server._count("arxiv")
+                    keyword = query.get("search_query", "").removeprefix("all:")
+                    body = server.arxiv_feed(keyword, int(query.get("start", 0)), int(query.get("max_results", 10)))
+                    return self._send(200, body, "application/atom+xml")
+                if url.path == "/s2/graph/v1/paper/search":
+                    server._count("s2")
+                    body = server.s2_results(query.get("query", ""), int(query.get("offset", 0)), int(query.get("limit", 10)))
+                    return self._send(200, body, "application/json")
+                self._send(404, b"not found", "text/plain")
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.rstrip("/").endswith("/chat/completions"):
+                    server._count("openai")
+                    if body.get("stream"):
+                        return self._send_stream(server.chat_completion_chunks(body))
+                    return self._send(200, server.chat_completion(body), "application/json")
+                self._send(404, b"not found", "text/plain")
+
+        return Handler
@@ -2,12 +2,18 @@
 import feedparser
 from urllib.parse import quote
 
-def search_arxiv(keyword: str, max_results: int = 10):#10件をデフォルトに設定
-    base_url = "http://export.arxiv.org/api/query"# arXivのAPIエンドポイント
-    query = f"search_query=all:{quote(keyword)}&start=0&max_results={max_results}"
+from utils.rate_limiter import request, endpoint
+from utils.pdf_downloader import get_session
+
+def search_arxiv(keyword: str, max_results: int = 10, offset: int = 0):#10件をデフォルトに設定、offsetで何件目から取得するかを指定
+    base_url = endpoint("ARXIV_API_URL", "http://export.arxiv.org/api/query")# arXivのAPIエンドポイント
+    query = f"search_query=all:{quote(keyword)}&start={offset}&max_results={max_results}"
     url = f"{base_url}?{query}"
 
-    feed = feedparser.parse(url)
+    # arXivの利用ルール（3秒に1回）に従い、429/503は待ってから再試行する
+    response = request("GET", url, session=get_session(url), timeout=30)
+    response.raise_for_status()
+    feed = feedparser.parse(response.content)
     papers = []
 
     for entry in feed.entries:
@@ -21,6 +27,8 @@ def search_arxiv(keyword: str, max_results: int = 10):#10件をデフォルト
                 "venue": "arXiv",
                 "url": entry.id,
                 "pdf_url": pdf_url,
+                "arxiv_id": entry.id.split("/abs/")[-1],
+                "doi": entry.get("arxiv_doi", ""),
                 "summary": entry.summary
             })
 
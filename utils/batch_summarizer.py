@@ -0,0 +1,330 @@
+# utils/batch_summarizer.py
+# 保存済みの論文をまとめて要約し直す（バックフィル）
+#   python -m utils.batch_summarizer --backend async --concurrency 16
+#   python -m utils.batch_summarizer --backend batch            # OpenAI Batch API（安いが最大24時間）
+#   python -m utils.batch_summarizer --resume                   # 投入済みのバッチの結果を取り込む
+#   python -m utils.batch_summarizer --older-than 2             # 版が2より古いプロンプトの要約を作り直す
+
+import argparse
+import io
+import json
+import logging
+import time
+
+from utils.summarizer import (
+    get_client, call_openai, completion_params, parse_summary, record_usage, count_tokens, summarize_text, summarize_texts,
+    summary_cache_key, cached_summary, PROMPT_TEMPLATE, MAX_PROMPT_TOKENS, BACKENDS, PROMPT_VERSION,
+)
+from utils.summary_cache import put_cached_summary
+from utils.db_manager import init_db, get_connection, transaction, fetch_paper
+from utils.pipeline import new_result, load_state, store_summary, summary_input
+from utils.blob_store import read_text_artifact
+from utils.metrics import configure_logging
+import utils.croma_manager  # noqa: F401  要約の保存時にベクトル索引も更新する
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+MAX_REQUESTS_PER_BATCH = 50000  # Batch API の1バッチあたりの上限
+MAX_BYTES_PER_BATCH = 190 * 1024 * 1024  # 入力ファイルの上限（200MB）より少し小さく
+POLL_INTERVAL = 30  # バッチの状態を確認する間隔（秒）
+DONE_STATES = {"completed", "failed", "expired", "cancelled"}
+
+_tables_ready = False
+
+
+def _ensure_table():
+    global _tables_ready
+    if _tables_ready:
+        return
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS summary_batches (
+                batch_id TEXT PRIMARY KEY,
+                status TEXT,
+                items TEXT,
+                created_at REAL,
+                collected_at REAL
+            )
+        ''')
+    _tables_ready = True
+
+
+# --- Batch API ---
+
+def _split_requests(lines: list) -> list:
+    """JSONLの行をBatch APIの件数・サイズ上限に収まるように分ける。"""
+    batches, current, size = [], [], 0
+    for line in lines:
+        line_size = len(line.encode("utf-8")) + 1
+        if current and (len(current) >= MAX_REQUESTS_PER_BATCH or size + line_size > MAX_BYTES_PER_BATCH):
+            batches.append(current)
+            current, size = [], 0
+        current.append(line)
+        size += line_size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def submit_batch(items: dict) -> list:
+    """
+    items（custom_id → {"text", "cache_key", "paper_id"}）を Batch API に投入し、バッチIDのリストを返す。
+    投入したバッチは summary_batches テーブルに記録し、あとから --resume で取り込める。
+    """
+    _ensure_table()
+    lines = [
+        json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": ENDPOINT,
+            "body": completion_params(PROMPT_TEMPLATE.format(text=item["text"])),
+        }, ensure_ascii=False)
+        for custom_id, item in items.items()
+    ]
+
+    batch_ids = []
+    for part in _split_requests(lines):
+        data = ("\n".join(part) + "\n").encode("utf-8")
+        input_file = call_openai(lambda: get_client().files.create(file=("summaries.jsonl", io.BytesIO(data)), purpose="batch"))
+        batch = call_openai(lambda: get_client().batches.create(
+            input_file_id=input_file.id, endpoint=ENDPOINT, completion_window=COMPLETION_WINDOW
+        ))
+        part_items = {
+            custom_id: {"cache_key": items[custom_id]["cache_key"], "paper_id": items[custom_id].get("paper_id")}
+            for custom_id in (json.loads(line)["custom_id"] for line in part)
+        }
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO summary_batches (batch_id, status, items, created_at) VALUES (?, ?, ?, ?)",
+                (batch.id, batch.status, json.dumps(part_items, ensure_ascii=False), time.time()),
+            )
+        logger.info("バッチを投入しました: %s（%d件）", batch.id, len(part))
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+def wait_for_batch(batch_id: str, poll_interval: float = POLL_INTERVAL):
+    """バッチが終わる（completed / failed / expired / cancelled）まで待つ。"""
+    _ensure_table()
+    while True:
+        batch = call_openai(lambda: get_client().batches.retrieve(batch_id))
+        with transaction() as conn:
+            conn.execute("UPDATE summary_batches SET status = ? WHERE batch_id = ?", (batch.status, batch_id))
+        if batch.status in DONE_STATES:
+            return batch
+        counts = batch.request_counts
+        if counts is not None:
+            logger.info("%s: %s（%d/%d件）", batch_id, batch.status, counts.completed, counts.total)
+        time.sleep(poll_interval)
+
+
+def _read_jsonl(file_id: str) -> list:
+    if not file_id:
+        return []
+    content = call_openai(lambda: get_client().files.content(file_id))
+    return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+
+def fetch_batch_results(batch) -> dict:
+    """
+    終わったバッチの結果を custom_id → 要約の辞書 で返す（失敗した要素は RuntimeError）。
+    要約はスキーマで検証し、成功したものはキャッシュにも保存する。
+    """
+    row = get_connection().execute("SELECT items FROM summary_batches WHERE batch_id = ?", (batch.id,)).fetchone()
+    items = json.loads(row[0]) if row else {}
+
+    results = {}
+    for line in _read_jsonl(batch.output_file_id) + _read_jsonl(batch.error_file_id):
+        custom_id = line.get("custom_id")
+        response = line.get("response") or {}
+        try:
+            if line.get("error") or response.get("status_code") != 200:
+                raise RuntimeError(line.get("error") or response.get("body", {}).get("error"))
+            record_usage(response["body"].get("usage"))
+            summary_dict = parse_summary(response["body"]["choices"][0]["message"]["content"])
+        except Exception as e:
+            results[custom_id] = RuntimeError(f"要約失敗: {e}")
+            continue
+        if custom_id in items:
+            put_cached_summary(items[custom_id]["cache_key"], summary_dict)
+        results[custom_id] = summary_dict
+
+    for custom_id in items:
+        results.setdefault(custom_id, RuntimeError(f"要約失敗: バッチが {batch.status} で終了しました"))
+    return results
+
+
+def summarize_batch(texts, use_cache: bool = True, poll_interval: float = POLL_INTERVAL) -> list:
+    """
+    summarize_texts(backend="batch") の本体。キャッシュ済みのものは使い、長い本文は分割要約（同期）で処理し、
+    残りを Batch API に投入して完了まで待つ。入力と同じ順番のリストを返す。
+    """
+    texts = list(texts)
+    results = [None] * len(texts)
+    items = {}
+    for i, text in enumerate(texts):
+        prompt = PROMPT_TEMPLATE.format(text=text)
+        if count_tokens(prompt) > MAX_PROMPT_TOKENS:
+            try:
+                results[i] = summarize_text(text, use_cache)
+            except Exception as e:
+                results[i] = e
+            continue
+        cache_key = summary_cache_key(text)
+        cached = cached_summary(cache_key) if use_cache else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            items[f"text-{i}"] = {"text": text, "cache_key": cache_key}
+
+    if items:
+        for batch_id in submit_batch(items):
+            batch_results = fetch_batch_results(wait_for_batch(batch_id, poll_interval))
+            for custom_id, result in batch_results.items():
+                results[int(custom_id.split("-", 1)[1])] = result
+            _mark_collected(batch_id)
+    return results
+
+
+def _mark_collected(batch_id: str):
+    with transaction() as conn:
+        conn.execute("UPDATE summary_batches SET collected_at = ? WHERE batch_id = ?", (time.time(), batch_id))
+
+
+# --- DBの論文のバックフィル ---
+
+def _result_for(paper: dict) -> dict:
+    return load_state(new_result(paper))
+
+
+def _store(paper_id: str, summary) -> bool:
+    if isinstance(summary, Exception):
+        logger.error("%s の要約に失敗しました: %s", paper_id, summary)
+        return False
+    paper = fetch_paper(paper_id)
+    if paper is None:
+        # 送信してから結果を受け取るまでの間に論文が削除された・IDが変わった
+        logger.error("%s の要約を保存できませんでした: 論文が見つかりません", paper_id)
+        return False
+    store_summary(_result_for(paper), summary)
+    return True
+
+
+def papers_to_summarize(limit: int = None, include_summarized: bool = False, older_than: int = None) -> list:
+    """
+    本文テキストが保存済みの論文のIDを返す。
+    既定では未要約のものと、要約が古いもの（本文が変わった・プロンプトの版が古い）のみ。
+    older_than を指定すると、その版より古いプロンプトで要約した論文だけを返す。
+    """
+    where = "text_path IS NOT NULL AND text_path != ''"
+    params = []
+    if older_than is not None:
+        where += " AND coalesce(summarized, 0) = 1 AND coalesce(summary_version, 0) < ?"
+        params.append(older_than)
+    elif not include_summarized:
+        where += (" AND (coalesce(summarized, 0) = 0 OR summary_text_sha256 IS NOT text_sha256"
+                  " OR coalesce(summary_version, 0) < ?)")
+        params.append(PROMPT_VERSION)
+    sql = f"SELECT id FROM papers WHERE {where} ORDER BY searched_at DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [row[0] for row in get_connection().execute(sql, params).fetchall()]
+
+
+def _read_text(paper_id: str) -> str:
+    """保存済みの本文を読み、要約に渡す部分を返す（pipeline.summary_input を参照）。"""
+    return summary_input(paper_id, read_text_artifact(fetch_paper(paper_id)["text_path"]))
+
+
+def collect_batch(batch_id: str, poll_interval: float = POLL_INTERVAL) -> int:
+    """バッチの完了を待ち、論文の要約を update_summary_to_db 経由でDBへ書き戻す。保存した件数を返す。"""
+    results = fetch_batch_results(wait_for_batch(batch_id, poll_interval))
+    row = get_connection().execute("SELECT items FROM summary_batches WHERE batch_id = ?", (batch_id,)).fetchone()
+    items = json.loads(row[0]) if row else {}
+    stored = sum(
+        _store(items[custom_id]["paper_id"], summary)
+        for custom_id, summary in results.items()
+        if items.get(custom_id, {}).get("paper_id")
+    )
+    _mark_collected(batch_id)
+    logger.info("%s: %d/%d件の要約を保存しました。", batch_id, stored, len(items))
+    return stored
+
+
+def resume_batches(poll_interval: float = POLL_INTERVAL) -> int:
+    """まだ取り込んでいないバッチをすべて取り込む。"""
+    _ensure_table()
+    rows = get_connection().execute(
+        "SELECT batch_id FROM summary_batches WHERE collected_at IS NULL ORDER BY created_at"
+    ).fetchall()
+    return sum(collect_batch(row[0], poll_interval) for row in rows)
+
+
+def backfill_summaries(backend: str = "async", limit: int = None, include_summarized: bool = False,
+                       max_concurrency: int = None, wait: bool = True, poll_interval: float = POLL_INTERVAL,
+                       older_than: int = None) -> int:
+    """
+    保存済みの論文をまとめて要約し、DBへ書き戻す。保存した件数を返す。
+    backend="batch" で wait=False の場合は投入だけ行い、結果は resume_batches で取り込む。
+    older_than を指定すると、その版より古いプロンプトで要約した論文だけを要約し直す。
+    """
+    init_db()
+    paper_ids = papers_to_summarize(limit, include_summarized, older_than)
+    logger.info("要約対象: %d件（%s）", len(paper_ids), backend)
+    if not paper_ids:
+        return 0
+
+    if backend != "batch":
+        summaries = summarize_texts([_read_text(pid) for pid in paper_ids], backend, max_concurrency)
+        return sum(_store(pid, summary) for pid, summary in zip(paper_ids, summaries))
+
+    stored, items = 0, {}
+    for paper_id in paper_ids:
+        text = _read_text(paper_id)
+        cache_key = summary_cache_key(text)
+        cached = cached_summary(cache_key)
+        if cached is None and count_tokens(PROMPT_TEMPLATE.format(text=text)) > MAX_PROMPT_TOKENS:
+            try:
+                cached = summarize_text(text)
+            except Exception as e:
+                cached = e
+        if cached is not None:
+            stored += _store(paper_id, cached)
+        else:
+            items[paper_id] = {"text": text, "cache_key": cache_key, "paper_id": paper_id}
+
+    if items:
+        batch_ids = submit_batch(items)
+        if wait:
+            stored += sum(collect_batch(batch_id, poll_interval) for batch_id in batch_ids)
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みの論文をまとめて要約します。")
+    parser.add_argument("--backend", choices=BACKENDS, default="async", help="要約の実行方法")
+    parser.add_argument("--limit", type=int, default=None, help="処理する論文数の上限")
+    parser.add_argument("--all", action="store_true", help="要約済みの論文も要約し直す")
+    parser.add_argument("--older-than", type=int, default=None, metavar="N",
+                        help=f"プロンプトの版が N より古い要約だけを作り直す（現在の版は {PROMPT_VERSION}）")
+    parser.add_argument("--concurrency", type=int, default=None, help="同時に処理する数（sync / async）")
+    parser.add_argument("--no-wait", action="store_true", help="batch の投入だけ行い、完了を待たない")
+    parser.add_argument("--resume", action="store_true", help="投入済みのバッチの結果を取り込む")
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL, help="バッチの状態を確認する間隔（秒）")
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.resume:
+        init_db()
+        stored = resume_batches(args.poll)
+    else:
+        stored = backfill_summaries(args.backend, args.limit, args.all, args.concurrency,
+                                    not args.no_wait, args.poll, args.older_than)
+    logger.info("%d件の要約を保存しました。", stored)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# utils/blob_maintenance.py
+# blob 保存領域の移行・掃除
+#   python -m utils.blob_maintenance migrate   # 旧形式（data/pdf, data/text, data/summaries）のファイルを blob へ移す
+#   python -m utils.blob_maintenance gc        # どの論文・ジョブからも参照されていない blob を消す
+#   python -m utils.blob_maintenance stats
+
+import argparse
+import json
+import logging
+import os
+import time
+
+from utils.db_manager import init_db, get_connection, transaction, update_paper_status
+from utils.blob_store import (
+    TMP_DIR, REF_PATTERN, is_ref, put_file, iter_blobs, store_stats,
+)
+from utils.metrics import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "data"
+LEGACY_DIRS = [os.path.join(DATA_DIR, name) for name in ("pdf", "text", "summaries")]
+PATH_COLUMNS = ("pdf_path", "text_path", "summary_path")
+# 書き込んだ直後でまだDBに記録されていない blob を消さないための猶予（秒）
+GC_GRACE_SECONDS = 3600
+
+
+def _jobs_table_exists(conn) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'jobs'").fetchone() is not None
+
+
+def referenced_digests() -> set:
+    """論文の pdf_path / text_path / summary_path とジョブの payload から参照されている sha256 を集める。"""
+    conn = get_connection()
+    digests = set()
+    for row in conn.execute(f"SELECT {', '.join(PATH_COLUMNS)} FROM papers"):
+        for value in row:
+            if is_ref(value):
+                digests.add(REF_PATTERN.fullmatch(value).group(1))
+    if _jobs_table_exists(conn):
+        for (payload,) in conn.execute("SELECT payload FROM jobs"):
+            digests.update(REF_PATTERN.findall(payload or ""))
+    return digests
+
+
+def collect_garbage(dry_run: bool = False, grace_seconds: float = GC_GRACE_SECONDS) -> dict:
+    """参照されていない blob と、残った書き込み途中のファイルを消す。消した件数とバイト数を返す。"""
+    referenced = referenced_digests()
+    cutoff = time.time() - grace_seconds
+    removed, freed = 0, 0
+    for digest, path, size, mtime in list(iter_blobs()):
+        if digest in referenced or mtime > cutoff:
+            continue
+        if not dry_run:
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue  # 一覧を作った後に同じ内容が保存し直された（blob_store._reuse）
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+        removed += 1
+        freed += size
+
+    if os.path.isdir(TMP_DIR):
+        for name in os.listdir(TMP_DIR):
+            path = os.path.join(TMP_DIR, name)
+            if os.path.getmtime(path) < cutoff:
+                size = os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+                removed += 1
+                freed += size
+    return {"removed": removed, "bytes": freed}
+
+
+def _is_under(path: str, directory: str) -> bool:
+    return os.path.abspath(path).startswith(os.path.abspath(directory) + os.sep)
+
+
+def _migrate_file(path: str, compress: bool, delete_original: bool) -> str | None:
+    """ファイルを blob に保存して参照を返す。ファイルがなければ None。"""
+    if not path or not os.path.isfile(path):
+        return None
+    # data/ の外（アップロード時の一時ファイルなど）は消さない
+    move = delete_original and _is_under(path, DATA_DIR)
+    ref = put_file(path, compress=compress, move=move)
+    if move and os.path.exists(path + ".meta.json"):
+        os.remove(path + ".meta.json")
+    return ref
+
+
+def migrate_data_dir(delete_originals: bool = True) -> dict:
+    """
+    papers の pdf_path / text_path / summary_path がファイルパスのものを blob に移し、参照に書き換える。
+    PDFはそのまま、テキストと要約JSONは圧縮して保存する。ジョブの payload のパスも書き換える。
+    """
+    init_db()
+    conn = get_connection()
+    rows = conn.execute(f"SELECT id, {', '.join(PATH_COLUMNS)} FROM papers").fetchall()
+    migrated, missing = {}, 0
+    for paper_id, *paths in rows:
+        updates = {}
+        for column, path in zip(PATH_COLUMNS, paths):
+            if not path or is_ref(path):
+                continue
+            ref = migrated.get(path) or _migrate_file(path, column != "pdf_path", delete_originals)
+            if ref is None:
+                missing += 1
+                logger.warning("%s の %s が見つかりません: %s", paper_id, column, path)
+                continue
+            migrated[path] = updates[column] = ref
+        if updates:
+            update_paper_status(paper_id, **updates)
+
+    jobs = 0
+    if _jobs_table_exists(conn):
+        with transaction() as tx:
+            for job_id, payload in tx.execute("SELECT id, payload FROM jobs").fetchall():
+                data = json.loads(payload or "{}")
+                changed = False
+                for column in ("pdf_path", "text_path"):
+                    if data.get(column) in migrated:
+                        data[column] = migrated[data[column]]
+                        changed = True
+                if changed:
+                    tx.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(data, ensure_ascii=False), job_id))
+                    jobs += 1
+
+    leftovers = [
+        os.path.join(root, name)
+        for directory in LEGACY_DIRS if os.path.isdir(directory)
+        for root, _, files in os.walk(directory)
+        for name in files
+    ]
+    if leftovers:
+        logger.info("どの論文からも参照されていないファイルが %d 件残っています（%s など）。",
+                    len(leftovers), leftovers[0])
+    return {"files": len(migrated), "missing": missing, "jobs": jobs, "unreferenced": len(leftovers)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="blob 保存領域の移行・掃除を行います。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="旧形式のファイルを blob へ移す")
+    migrate.add_argument("--keep", action="store_true", help="移した元のファイルを残す")
+    gc = subparsers.add_parser("gc", help="参照されていない blob を消す")
+    gc.add_argument("--dry-run", action="store_true", help="消さずに件数だけ表示する")
+    gc.add_argument("--grace", type=float, default=GC_GRACE_SECONDS, help="これより新しい blob は消さない（秒）")
+    subparsers.add_parser("stats", help="blob の件数と合計サイズを表示する")
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.command == "migrate":
+        stats = migrate_data_dir(delete_originals=not args.keep)
+        logger.info("%d件のファイルを移しました（見つからないもの %d件、ジョブ %d件を更新）。",
+                    stats["files"], stats["missing"], stats["jobs"])
+    elif args.command == "gc":
+        init_db()
+        stats = collect_garbage(args.dry_run, args.grace)
+        logger.info("%s%d件・%.1fMBを削除しました。", "（dry-run）" if args.dry_run else "",
+                    stats["removed"], stats["bytes"] / 1024 / 1024)
+    else:
+        stats = store_stats()
+        logger.info("blob: %d件・%.1fMB", stats["blobs"], stats["bytes"] / 1024 / 1024)
+
+
+if __name__ == "__main__":
+    main()
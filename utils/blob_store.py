@@ -0,0 +1,288 @@
+# utils/blob_store.py
+# PDF・本文テキスト・要約JSONを内容の SHA-256 で管理する保存領域
+#   参照（ref）は "blob:sha256:<64桁の16進>" の文字列で、DB の pdf_path / text_path / summary_path に入れる。
+#   実体は data/store/objects/ab/cd/<sha256>[.zst|.gz] に置き、同じ内容は1つだけ保存する。
+#   テキストとJSONは圧縮して保存する（zstandard があれば zstd、なければ gzip）。PDFはそのまま保存する。
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import uuid
+
+try:
+    import zstandard
+except ImportError:  # zstandard がなければ gzip で圧縮する
+    zstandard = None
+
+STORE_DIR = os.path.join("data", "store")
+OBJECTS_DIR = os.path.join(STORE_DIR, "objects")
+TMP_DIR = os.path.join(STORE_DIR, "tmp")
+REF_PREFIX = "blob:sha256:"
+REF_PATTERN = re.compile(r"blob:sha256:([0-9a-f]{64})")
+CHUNK_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+# 拡張子 → 圧縮形式（"" は無圧縮）
+SUFFIXES = {"": None, ".zst": "zst", ".gz": "gz"}
+
+
+def is_ref(value) -> bool:
+    return isinstance(value, str) and REF_PATTERN.fullmatch(value) is not None
+
+
+def digest_of(ref: str) -> str:
+    match = REF_PATTERN.fullmatch(ref or "")
+    if match is None:
+        raise ValueError(f"blobの参照ではありません: {ref}")
+    return match.group(1)
+
+
+def _object_base(digest: str) -> str:
+    return os.path.join(OBJECTS_DIR, digest[:2], digest[2:4], digest)
+
+
+def _find(digest: str) -> tuple | None:
+    """保存されている実体の (パス, 圧縮形式) を返す。"""
+    base = _object_base(digest)
+    for suffix, codec in SUFFIXES.items():
+        if os.path.exists(base + suffix):
+            return base + suffix, codec
+    return None
+
+
+def _reuse(digest: str) -> bool:
+    """
+    同じ内容の blob が既にあれば更新時刻を今にして True を返す。
+    （blob_maintenance の gc は新しい blob を消さないので、参照を DB に書く前に消されないようにする）
+    """
+    found = _find(digest)
+    if found is None:
+        return False
+    try:
+        os.utime(found[0])
+    except FileNotFoundError:
+        return False  # 調べた直後に gc で消された。書いたものを保存し直す
+    return True
+
+
+def exists(ref: str) -> bool:
+    return is_ref(ref) and _find(digest_of(ref)) is not None
+
+
+# --- 書き込み ---
+
+class BlobWriter:
+    """
+    ストリーミングで書き込み、close() したときに内容のハッシュの場所へ保存する。
+    同じ内容が既にあれば書いたものは捨てる。close() の戻り値（と self.ref）が参照になる。
+    """
+
+    def __init__(self, compress: bool = True):
+        os.makedirs(TMP_DIR, exist_ok=True)
+        self.codec = ("zst" if zstandard is not None else "gz") if compress else None
+        self.suffix = {None: "", "zst": ".zst", "gz": ".gz"}[self.codec]
+        self.tmp_path = os.path.join(TMP_DIR, uuid.uuid4().hex + self.suffix)
+        self._raw = open(self.tmp_path, "wb")
+        if self.codec == "zst":
+            self._stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self._raw, closefd=False)
+        elif self.codec == "gz":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+        else:
+            self._stream = self._raw
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.ref = None
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+        self._stream.write(data)
+        return len(data)
+
+    def _close_streams(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+
+    def close(self) -> str:
+        if self.ref is not None:
+            return self.ref
+        self._close_streams()
+        digest = self._hash.hexdigest()
+        if _reuse(digest):
+            os.remove(self.tmp_path)
+        else:
+            final_path = _object_base(digest) + self.suffix
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(self.tmp_path, final_path)
+        self.ref = REF_PREFIX + digest
+        return self.ref
+
+    def abort(self):
+        self._close_streams()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def open_writer(compress: bool = True) -> BlobWriter:
+    return BlobWriter(compress)
+
+
+def put_bytes(data: bytes, compress: bool = False) -> str:
+    with BlobWriter(compress) as writer:
+        writer.write(data)
+    return writer.ref
+
+
+def put_text(text: str) -> str:
+    """テキストを圧縮して保存し、参照を返す。"""
+    return put_bytes(text.encode("utf-8"), compress=True)
+
+
+def put_json(obj) -> str:
+    """JSONを圧縮して保存し、参照を返す。"""
+    return put_bytes(json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8"), compress=True)
+
+
+def put_file(path: str, compress: bool = False, move: bool = False) -> str:
+    """
+    ファイルを保存して参照を返す。move=True なら元のファイルは無くなる。
+    無圧縮で move する場合はコピーせずに移動する。
+    """
+    if compress or not move:
+        with BlobWriter(compress) as writer, open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                writer.write(chunk)
+        if move:
+            os.remove(path)
+        return writer.ref
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    if _reuse(digest):
+        os.remove(path)
+    else:
+        final_path = _object_base(digest)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        shutil.move(path, final_path)
+    return REF_PREFIX + digest
+
+
+# --- 読み込み ---
+
+def open_blob(ref: str):
+    """blobを読み込み用に開く（圧縮されていれば展開しながら読むバイナリストリーム）。"""
+    found = _find(digest_of(ref))
+    if found is None:
+        raise FileNotFoundError(f"blobが見つかりません: {ref}")
+    path, codec = found
+    if codec == "zst":
+        if zstandard is None:
+            raise RuntimeError("zstd で圧縮されたblobを読むには zstandard が必要です")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    if codec == "gz":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_bytes(ref: str) -> bytes:
+    with open_blob(ref) as f:
+        return f.read()
+
+
+def read_text(ref: str) -> str:
+    return read_bytes(ref).decode("utf-8")
+
+
+def read_json(ref: str):
+    return json.loads(read_bytes(ref))
+
+
+def open_text(ref: str):
+    """テキストのblobを1行ずつ読めるテキストストリームとして開く。"""
+    return io.TextIOWrapper(open_blob(ref), encoding="utf-8")
+
+
+def blob_path(ref: str) -> str:
+    """無圧縮のblob（PDFなど）のファイルパスを返す。PyMuPDF などパスで開くライブラリ用。"""
+    found = _find(digest_of(ref))
+    if found is None:
+        raise FileNotFoundError(f"blobが見つかりません: {ref}")
+    path, codec = found
+    if codec is not None:
+        raise ValueError(f"圧縮されたblobはパスで開けません: {ref}")
+    return path
+
+
+# --- 旧形式（ファイルパス）との互換 ---
+
+def local_path(value: str) -> str:
+    """参照ならblobのパス、そうでなければ（移行前の）ファイルパスをそのまま返す。"""
+    return blob_path(value) if is_ref(value) else value
+
+
+def artifact_exists(value) -> bool:
+    """参照または移行前のファイルパスの実体があるか。"""
+    if is_ref(value):
+        return exists(value)
+    return bool(value) and os.path.isfile(value)
+
+
+def sha256_of(value: str) -> str:
+    """参照または移行前のファイルパスの内容の SHA-256（参照なら計算しない）。"""
+    if is_ref(value):
+        return digest_of(value)
+    h = hashlib.sha256()
+    with open(value, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_text_artifact(value: str) -> str:
+    """参照でも移行前のファイルパスでも本文テキストを読む。"""
+    if is_ref(value):
+        return read_text(value)
+    with open(value, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+# --- 管理用 ---
+
+def iter_blobs():
+    """保存されている blob を (sha256, パス, サイズ, 更新時刻) で列挙する。"""
+    if not os.path.isdir(OBJECTS_DIR):
+        return
+    for root, _, files in os.walk(OBJECTS_DIR):
+        for name in files:
+            digest = name.split(".", 1)[0]
+            if len(digest) != 64:
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            yield digest, path, stat.st_size, stat.st_mtime
+
+
+def store_stats() -> dict:
+    count, size = 0, 0
+    for _, _, blob_size, _ in iter_blobs():
+        count += 1
+        size += blob_size
+    return {"blobs": count, "bytes": size}
@@ -0,0 +1,409 @@
+# utils/croma_manager.py
+# 保存済み論文の埋め込みベクトルをローカルに保持し、類似論文・重複候補を探す（オフラインで動作）
+# 要約を保存するモジュール（pipeline など）が import して保存時の索引更新を登録する。
+# numpy は読み込みに時間がかかるので、ベクトルを扱う関数の中で読み込む（登録だけなら読み込まない）。
+
+import argparse
+import logging
+import os
+import json
+import zlib
+import math
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックなし（同じストアに書くプロセスは1つにする）
+    fcntl = None
+
+from utils.db_manager import init_db, add_summary_listener, fetch_paper, fetch_papers_page, count_papers
+from utils.metrics import configure_logging
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DIR = os.path.join("data", "vectors")
+DEFAULT_DIM = 512
+INITIAL_CAPACITY = 1024
+SEARCH_BLOCK = 65536  # 総当たり検索で一度に内積を取る行数
+IVF_MIN_VECTORS = 20000  # これ以上の件数になったら粗い量子化(IVF)で候補を絞る
+IVF_NPROBE = 8  # 検索時に調べるクラスタ数
+
+SUMMARY_FIELDS = ["背景", "目的", "新規性", "方法", "結果", "考察", "懸念点", "結論", "今後の展望"]
+
+
+class HashingEmbedder:
+    """
+    文字n-gramを特徴量ハッシュで固定次元に落とす埋め込み。
+    外部モデルを使わず決定的に動くので、日本語・英語どちらの文章にも使える。
+    embed(texts) が (件数, dim) の正規化済み float32 配列を返せば、他の埋め込みにも差し替えられる。
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = DEFAULT_DIM, ngram_range=(2, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def embed(self, texts) -> "np.ndarray":
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            text = " ".join(text.lower().split())
+            counts = {}
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                for j in range(len(text) - n + 1):
+                    h = zlib.crc32(text[j:j + n].encode("utf-8"))
+                    counts[h] = counts.get(h, 0) + 1
+            for h, count in counts.items():
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[i, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class VectorStore:
+    """
+    論文IDとベクトルを memmap した NumPy 配列で保持するストア。
+    件数が IVF_MIN_VECTORS を超えると k-means の重心で候補を絞ってから内積を取る。
+    """
+
+    def __init__(self, name: str, embedder=None):
+        self.dir = os.path.join(VECTOR_DIR, name)
+        self.embedder = embedder or HashingEmbedder()
+        self.dim = self.embedder.dim
+        self.lock = threading.RLock()
+        self._file_lock_depth = 0
+        self._file_lock_fd = None
+        self._meta_stat = None
+        self._load()
+
+    # --- 保存・読み込み ---
+
+    def _path(self, filename):
+        return os.path.join(self.dir, filename)
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        ワーカーと画面のプロセスが同じストアに書くので、読み直し〜追加〜保存の間はロックファイルを flock で押さえる。
+        同じプロセス内では入れ子にできる（build_ivf を add の中から呼ぶため）。
+        """
+        with self.lock:
+            if self._file_lock_depth == 0 and fcntl is not None:
+                self._file_lock_fd = os.open(self._path("lock"), os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._file_lock_fd, fcntl.LOCK_EX)
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+                if self._file_lock_depth == 0 and self._file_lock_fd is not None:
+                    fcntl.flock(self._file_lock_fd, fcntl.LOCK_UN)
+                    os.close(self._file_lock_fd)
+                    self._file_lock_fd = None
+
+    def _meta_signature(self, meta_path):
+        # os.replace で保存するたびに別のファイルになるので、更新時刻が同じでも inode で変更が分かる
+        stat = os.stat(meta_path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self):
+        import numpy as np
+        os.makedirs(self.dir, exist_ok=True)
+        meta_path = self._path("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim or meta["embedder"] != self.embedder.name:
+                raise ValueError(f"{self.dir} は別の埋め込み({meta['embedder']}, dim={meta['dim']})で作成されています")
+            self._meta_stat = self._meta_signature(meta_path)
+        else:
+            meta = {"dim": self.dim, "embedder": self.embedder.name, "capacity": INITIAL_CAPACITY,
+                    "ids": [], "ivf_count": 0}
+        self.ids = meta["ids"]
+        self.capacity = meta["capacity"]
+        self.ivf_count = meta["ivf_count"]
+        self.rows = {paper_id: i for i, paper_id in enumerate(self.ids)}
+
+        self.vectors = self._open_memmap("vectors.f32", np.float32, (self.capacity, self.dim))
+        self.assign = self._open_memmap("assign.i32", np.int32, (self.capacity,))
+        centroids_path = self._path("centroids.npy")
+        self.centroids = np.load(centroids_path) if self.ivf_count and os.path.exists(centroids_path) else None
+
+    def _open_memmap(self, filename, dtype, shape):
+        import numpy as np
+        path = self._path(filename)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _save_meta(self):
+        self.vectors.flush()
+        self.assign.flush()
+        meta_path = self._path("meta.json")
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "embedder": self.embedder.name, "capacity": self.capacity,
+                       "ids": self.ids, "ivf_count": self.ivf_count}, f)
+        os.replace(tmp_path, meta_path)
+        self._meta_stat = self._meta_signature(meta_path)
+
+    def _reload_if_changed(self):
+        """別プロセスが追加した分を取り込む。"""
+        meta_path = self._path("meta.json")
+        if os.path.exists(meta_path) and self._meta_signature(meta_path) != self._meta_stat:
+            self._load()
+
+    def _grow(self, needed: int):
+        import numpy as np
+        if needed <= self.capacity:
+            return
+        while self.capacity < needed:
+            self.capacity *= 2
+        del self.vectors, self.assign
+        self.vectors = self._open_memmap("vectors.f32", np.float32, (self.capacity, self.dim))
+        self.assign = self._open_memmap("assign.i32", np.int32, (self.capacity,))
+
+    # --- 追加 ---
+
+    def add(self, items):
+        """(paper_id, text) のリストを埋め込んで追加する。既にあるIDは上書きする。"""
+        import numpy as np
+        items = list(items)
+        if not items:
+            return
+        vectors = self.embedder.embed([text for _, text in items])
+        with self._file_lock():
+            # 別プロセスが追加した行を読み直してから行番号を決める（同じ行に上書きしないため）
+            self._reload_if_changed()
+            self._grow(len(self.ids) + len(items))
+            for (paper_id, _), vector in zip(items, vectors):
+                row = self.rows.get(paper_id)
+                if row is None:
+                    row = len(self.ids)
+                    self.ids.append(paper_id)
+                    self.rows[paper_id] = row
+                self.vectors[row] = vector
+                if self.centroids is not None:
+                    self.assign[row] = int(np.argmax(self.centroids @ vector))
+
+            count = len(self.ids)
+            # IVF は件数が閾値を超えたとき、その後は前回構築時の4倍になるたびに作り直す
+            if count >= IVF_MIN_VECTORS and (self.ivf_count == 0 or count >= 4 * self.ivf_count):
+                self.build_ivf()
+            else:
+                self._save_meta()
+
+    # --- IVF ---
+
+    def build_ivf(self, n_lists: int = None, iterations: int = 10, sample_size: int = 50000):
+        """球面 k-means で重心を求め、全ベクトルをクラスタに割り当てる。"""
+        import numpy as np
+        with self._file_lock():
+            self._reload_if_changed()
+            count = len(self.ids)
+            if count == 0:
+                return
+            n_lists = n_lists or max(1, int(math.sqrt(count)))
+            rng = np.random.default_rng(0)
+            sample = np.asarray(self.vectors[rng.choice(count, size=min(count, sample_size), replace=False)])
+            centroids = sample[rng.choice(len(sample), size=min(n_lists, len(sample)), replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for k in range(len(centroids)):
+                    members = sample[labels == k]
+                    if len(members):
+                        c = members.sum(axis=0)
+                        centroids[k] = c / (np.linalg.norm(c) or 1.0)
+
+            for start in range(0, count, SEARCH_BLOCK):
+                block = np.asarray(self.vectors[start:min(start + SEARCH_BLOCK, count)])
+                self.assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            np.save(self._path("centroids.npy"), centroids)
+            self.centroids = centroids
+            self.ivf_count = count
+            self._save_meta()
+
+    # --- 検索 ---
+
+    def search(self, query_vectors: "np.ndarray", k: int = 5, exclude=None, nprobe: int = IVF_NPROBE):
+        """
+        クエリベクトル（複数可）ごとに (paper_id, cos類似度) の上位k件を返す。
+        """
+        import numpy as np
+        exclude = set(exclude or [])
+        query_vectors = np.atleast_2d(query_vectors).astype(np.float32)
+        top_k = k + len(exclude)
+        with self.lock:
+            self._reload_if_changed()
+            count = len(self.ids)
+            if count == 0:
+                return [[] for _ in query_vectors]
+
+            if self.centroids is not None and count >= IVF_MIN_VECTORS:
+                candidates = []
+                for query in query_vectors:
+                    probes = np.argsort(-(self.centroids @ query))[:nprobe]
+                    rows = np.nonzero(np.isin(self.assign[:count], probes))[0]
+                    candidates.append((np.asarray(self.vectors[rows]) @ query, rows))
+            else:
+                # 全クエリをまとめてブロックごとに内積を取り、メモリ使用量を抑える
+                parts = [([], []) for _ in query_vectors]
+                for start in range(0, count, SEARCH_BLOCK):
+                    block_scores = np.asarray(self.vectors[start:min(start + SEARCH_BLOCK, count)]) @ query_vectors.T
+                    n = min(top_k, len(block_scores))
+                    best = np.argpartition(-block_scores, n - 1, axis=0)[:n]
+                    for q, (scores, rows) in enumerate(parts):
+                        scores.append(block_scores[best[:, q], q])
+                        rows.append(best[:, q] + start)
+                candidates = [(np.concatenate(scores), np.concatenate(rows)) for scores, rows in parts]
+
+            results = []
+            for scores, rows in candidates:
+                n = min(top_k, len(scores))
+                if n == 0:
+                    results.append([])
+                    continue
+                best = np.argpartition(-scores, n - 1)[:n]
+                best = best[np.argsort(-scores[best])]
+                hits = [(self.ids[rows[i]], float(scores[i])) for i in best if self.ids[rows[i]] not in exclude]
+                results.append(hits[:k])
+            return results
+
+    def vector_of(self, paper_id: str):
+        import numpy as np
+        with self.lock:
+            self._reload_if_changed()
+            row = self.rows.get(paper_id)
+            return None if row is None else np.array(self.vectors[row])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_embedder = None
+
+
+def set_embedder(embedder):
+    """埋め込みを差し替える（dim と name と embed(texts) を持つオブジェクト）。"""
+    global _embedder
+    with _stores_lock:
+        _embedder = embedder
+        _stores.clear()
+
+
+def get_store(name: str) -> VectorStore:
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = VectorStore(name, _embedder)
+            _stores[name] = store
+        return store
+
+
+def summary_text(title: str, summary: dict) -> str:
+    """要約10項目とタイトルから埋め込み用の文章を作る。"""
+    parts = [title or ""] + [summary.get(field, "") for field in SUMMARY_FIELDS]
+    parts += summary.get("キーワード", [])
+    return "\n".join(p for p in parts if p)
+
+
+def _row_to_summary(paper: dict) -> dict:
+    keywords = paper.get("keywords") or "[]"
+    return {
+        "背景": paper.get("background") or "",
+        "目的": paper.get("purpose") or "",
+        "新規性": paper.get("novelty") or "",
+        "方法": paper.get("method") or "",
+        "結果": paper.get("results") or "",
+        "考察": paper.get("discussion") or "",
+        "懸念点": paper.get("concerns") or "",
+        "結論": paper.get("conclusion") or "",
+        "今後の展望": paper.get("future_work") or "",
+        "キーワード": json.loads(keywords) if keywords.startswith("[") else [],
+    }
+
+
+def add_paper(paper_id: str, title: str, summary: dict):
+    """1件の論文を要約ストアとタイトルストアに追加する。"""
+    get_store("summaries").add([(paper_id, summary_text(title, summary))])
+    if title:
+        get_store("titles").add([(paper_id, title)])
+
+
+def rebuild_from_db(batch_size: int = 1000) -> int:
+    """DBの要約済み論文をすべて索引に取り込み、取り込んだ件数を返す（初回や埋め込み変更時用）。"""
+    columns = ["id", "title", "background", "purpose", "novelty", "method", "results",
+               "discussion", "concerns", "conclusion", "future_work", "keywords"]
+    cursor = None
+    added = 0
+    while True:
+        papers, cursor = fetch_papers_page(limit=batch_size, after=cursor, summarized=True, columns=columns,
+                                           by_rowid=True)
+        get_store("summaries").add([(p["id"], summary_text(p["title"], _row_to_summary(p))) for p in papers])
+        get_store("titles").add([(p["id"], p["title"]) for p in papers if p["title"]])
+        added += len(papers)
+        if cursor is None:
+            return added
+
+
+def related_papers(paper_id: str, k: int = 5):
+    """指定した論文に要約の内容が近い論文を (paper_id, 類似度) のリストで返す。"""
+    store = get_store("summaries")
+    vector = store.vector_of(paper_id)
+    if vector is None:
+        paper = fetch_paper(paper_id)
+        if paper is None:
+            return []
+        vector = store.embedder.embed([summary_text(paper["title"], _row_to_summary(paper))])[0]
+    return store.search(vector, k=k, exclude=[paper_id])[0]
+
+
+def find_near_duplicates(titles, threshold: float = 0.9, exclude_ids=None):
+    """
+    検索結果のタイトル（複数可）ごとに、保存済み論文のうちタイトルがほぼ同じものを返す。
+    exclude_ids には各タイトル自身のIDを渡す（自分自身を重複とみなさないため）。
+    """
+    store = get_store("titles")
+    exclude_ids = exclude_ids or [None] * len(titles)
+    vectors = store.embedder.embed(list(titles))
+    results = []
+    for vector, paper_id in zip(vectors, exclude_ids):
+        hits = store.search(vector, k=3, exclude=[paper_id] if paper_id else None)[0]
+        results.append([(hit_id, score) for hit_id, score in hits if score >= threshold])
+    return results
+
+
+def _on_summary_saved(paper_id, summary):
+    title = summary.get("タイトル")
+    if title is None:
+        paper = fetch_paper(paper_id)
+        title = paper["title"] if paper else ""
+    add_paper(paper_id, title, summary)
+
+
+add_summary_listener(_on_summary_saved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="類似論文・重複候補の検索に使うベクトル索引を管理します。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="要約済みの論文をすべて索引に取り込む（索引ができる前に要約した論文用）")
+    rebuild.add_argument("--batch-size", type=int, default=1000, help="1回に読む論文の数")
+    subparsers.add_parser("stats", help="索引の件数と、DBの要約済みの論文数を表示する")
+    args = parser.parse_args()
+    configure_logging()
+    init_db()
+
+    if args.command == "rebuild":
+        added = rebuild_from_db(args.batch_size)
+        logger.info("%d件の論文を索引に取り込みました。", added)
+    else:
+        logger.info("索引: 要約 %d件・タイトル %d件（DBの要約済み %d件）",
+                    len(get_store("summaries").ids), len(get_store("titles").ids), count_papers(summarized=True))
+
+
+if __name__ == "__main__":
+    main()
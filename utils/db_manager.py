@@ -1,92 +1,510 @@
 import sqlite3
 import os
+import json
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
+from utils.metrics import timed
+from utils.blob_store import read_text_artifact, artifact_exists, sha256_of
+
+logger = logging.getLogger(__name__)
+
 DB_PATH = os.path.join("data", "paper_db.sqlite")
 
+# スレッドごとに1本の接続を使い回す
+_local = threading.local()
+
+# update_summary_to_db の後に呼ばれる関数（ベクトル索引の更新など）
+_summary_listeners = []
+
+# fetch_paper 用の小さな行キャッシュ（書き込み時に該当IDを破棄する）
+ROW_CACHE_SIZE = 256
+ROW_CACHE_TTL = 30  # 秒。別プロセスからの更新もこの時間で反映される
+_row_cache = OrderedDict()
+_row_cache_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    現在のスレッド用のSQLite接続を返す（なければ作成）。
+    WALモード・synchronous=NORMAL で開き、書き込み同士の競合はbusy_timeoutで待つ。
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and (_local.path != DB_PATH or _local.pid != os.getpid()):
+        # DBの切り替えやfork後の子プロセスでは親の接続を使わない
+        conn = None
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        _local.conn = conn
+        _local.path = DB_PATH
+        _local.pid = os.getpid()
+        _local.depth = 0
+        _local.pending = []  # コミット後に呼ぶ関数（after_commit）
+    return conn
+
+
+def close_connection():
+    """現在のスレッドの接続を閉じる。"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """
+    まとめてコミットする単位（unit of work）。
+    with の中で呼ばれた更新関数はすべて1つのトランザクションでコミットされ、
+    例外が起きた場合はまとめてロールバックされる。入れ子にしても外側でのみコミットする。
+    """
+    conn = get_connection()
+    depth = _local.depth
+    if depth == 0:
+        conn.execute("BEGIN IMMEDIATE")
+    _local.depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth = depth
+        if depth == 0:
+            _local.pending = []
+            conn.rollback()
+        raise
+    _local.depth = depth
+    if depth == 0:
+        pending, _local.pending = _local.pending, []
+        conn.commit()
+        for fn in pending:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning("コミット後の処理に失敗しました: %s", e)
+
+
+def after_commit(fn):
+    """
+    fn() を現在のトランザクションがコミットされた後に呼ぶ（トランザクションの外なら今すぐ呼ぶ）。
+    ロールバックされた場合は呼ばない。時間のかかる後処理で書き込みロックを持ち続けないために使う。
+    """
+    if getattr(_local, "conn", None) is not None and _local.pid == os.getpid() and _local.depth > 0:
+        _local.pending.append(fn)
+    else:
+        fn()
+
+
 #データベースがないときに自動的に作成する
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS papers (
-            id TEXT PRIMARY KEY,
-            title TEXT,
-            authors TEXT,
-            year TEXT,
-            source TEXT,
-            query TEXT,
-            searched_at TEXT,
-            pdf_path TEXT,
-            text_path TEXT,
-            summary_path TEXT,
-            downloaded INTEGER,
-            summarized INTEGER,
-            url TEXT,
-            pdf_url TEXT,
-            background TEXT,
-            purpose TEXT,
-            novelty TEXT,
-            method TEXT,
-            results TEXT,
-            discussion TEXT,
-            concerns TEXT,
-            conclusion TEXT,
-            future_work TEXT,
-            keywords TEXT
-        )
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS papers (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                authors TEXT,
+                year TEXT,
+                source TEXT,
+                query TEXT,
+                searched_at TEXT,
+                pdf_path TEXT,
+                text_path TEXT,
+                summary_path TEXT,
+                downloaded INTEGER,
+                summarized INTEGER,
+                url TEXT,
+                pdf_url TEXT,
+                background TEXT,
+                purpose TEXT,
+                novelty TEXT,
+                method TEXT,
+                results TEXT,
+                discussion TEXT,
+                concerns TEXT,
+                conclusion TEXT,
+                future_work TEXT,
+                keywords TEXT,
+                pdf_sha256 TEXT,
+                text_sha256 TEXT,
+                text_pdf_sha256 TEXT,
+                summary_text_sha256 TEXT,
+                summary_version INTEGER,
+                text_tokens INTEGER,
+                summary_input_tokens INTEGER
+            )
+        ''')
+        _add_hash_columns(conn)
+        _add_columns(conn, TOKEN_COLUMNS)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_searched_at ON papers(searched_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_source ON papers(source, searched_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_summarized ON papers(summarized, searched_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_year ON papers(year, searched_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_query ON papers(query, id)")
+        _init_fts(conn)
+        _init_terms(conn)
+
+
+PAPER_COLUMNS = [
+    "id", "title", "authors", "year", "source", "query", "searched_at",
+    "pdf_path", "text_path", "summary_path", "downloaded", "summarized",
+    "url", "pdf_url",
+    "background", "purpose", "novelty", "method", "results",
+    "discussion", "concerns", "conclusion", "future_work", "keywords",
+    "pdf_sha256", "text_sha256", "text_pdf_sha256", "summary_text_sha256", "summary_version",
+    "text_tokens", "summary_input_tokens",
+]
+
+# 処理の状態を判断するためのハッシュと版
+#   pdf_sha256 / text_sha256     保存しているPDF・本文テキストのSHA-256
+#   text_pdf_sha256              本文テキストを抽出したときのPDFのSHA-256
+#   summary_text_sha256          要約したときの本文テキストのSHA-256
+#   summary_version              要約したときのプロンプトの版（summarizer.PROMPT_VERSION）
+HASH_COLUMNS = {
+    "pdf_sha256": "TEXT",
+    "text_sha256": "TEXT",
+    "text_pdf_sha256": "TEXT",
+    "summary_text_sha256": "TEXT",
+    "summary_version": "INTEGER",
+}
+# ハッシュの列を追加する前に作った要約のプロンプトの版
+LEGACY_SUMMARY_VERSION = 1
+
+# 要約の入力を減らした効果の記録（text_sections.reduce_text を参照）
+#   text_tokens           本文テキスト全体のトークン数
+#   summary_input_tokens  参考文献などを除き予算内に収めて、要約に渡したトークン数
+TOKEN_COLUMNS = {
+    "text_tokens": "INTEGER",
+    "summary_input_tokens": "INTEGER",
+}
+
+# 空の値とみなすもの（この値では既存の値を上書きしない）
+_EMPTY_VALUES = {"downloaded": "0", "summarized": "0", "keywords": "'[]'"}
+
+
+def _merge_expr(column: str) -> str:
+    expr = f"nullif(excluded.{column}, '')"
+    if column in _EMPTY_VALUES:
+        expr = f"nullif({expr}, {_EMPTY_VALUES[column]})"
+    return f"{column} = coalesce({expr}, papers.{column})"
+
+
+# 既存の行には空でない値だけを書き込む（検索結果の再登録で処理済みの状態や要約を消さないため）
+# rowid は変えない（全文検索インデックスが rowid で対応付くため）
+INSERT_PAPER_SQL = f'''
+    INSERT INTO papers ({", ".join(PAPER_COLUMNS)})
+    VALUES ({", ".join(":" + c for c in PAPER_COLUMNS)})
+    ON CONFLICT(id) DO UPDATE SET
+        {", ".join(_merge_expr(c) for c in PAPER_COLUMNS[1:])}
+'''
+
+SUMMARY_COLUMNS = [
+    "background", "purpose", "novelty", "method", "results",
+    "discussion", "concerns", "conclusion", "future_work", "keywords",
+]
+_FTS_SUMMARY_EXPR = " || ' ' || ".join(f"coalesce(new.{c}, '')" for c in SUMMARY_COLUMNS)
+
+
+def _init_fts(conn):
+    """
+    タイトル・著者・要約10項目・本文の全文検索インデックス(FTS5)を作成する。
+    日本語にも効くよう trigram トークナイザを使う（古いSQLiteでは unicode61）。
+    メタデータと要約はトリガーで、本文は update_paper_status(text_path=...) で同期する。
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'papers_fts'"
+    ).fetchone()
+    if exists:
+        return
+
+    try:
+        conn.execute("CREATE VIRTUAL TABLE papers_fts USING fts5(title, authors, summary, body, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        conn.execute("CREATE VIRTUAL TABLE papers_fts USING fts5(title, authors, summary, body)")
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS papers_fts_insert AFTER INSERT ON papers BEGIN
+            INSERT INTO papers_fts (rowid, title, authors, summary, body)
+            VALUES (new.rowid, new.title, new.authors, {_FTS_SUMMARY_EXPR}, '');
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS papers_fts_update
+        AFTER UPDATE OF title, authors, {", ".join(SUMMARY_COLUMNS)} ON papers BEGIN
+            UPDATE papers_fts SET title = new.title, authors = new.authors, summary = {_FTS_SUMMARY_EXPR}
+            WHERE rowid = new.rowid;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS papers_fts_delete AFTER DELETE ON papers BEGIN
+            DELETE FROM papers_fts WHERE rowid = old.rowid;
+        END
     ''')
-    conn.commit()
-    conn.close()
+
+    # 既存の論文をインデックスへ取り込む
+    conn.execute(f'''
+        INSERT INTO papers_fts (rowid, title, authors, summary, body)
+        SELECT rowid, title, authors, {_FTS_SUMMARY_EXPR.replace("new.", "")}, '' FROM papers
+    ''')
+    for rowid, text_path in conn.execute(
+        "SELECT rowid, text_path FROM papers WHERE coalesce(text_path, '') != ''"
+    ).fetchall():
+        _index_body(conn, rowid, text_path)
+
+
+def _add_hash_columns(conn):
+    """
+    古いDBにハッシュの列を追加する。
+    追加する前に処理済みの論文は、今ある成果物から作ったものとして記録する（作り直しの対象にしない）。
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(papers)")}
+    missing = [c for c in HASH_COLUMNS if c not in existing]
+    if not missing:
+        return
+    for column in missing:
+        conn.execute(f"ALTER TABLE papers ADD COLUMN {column} {HASH_COLUMNS[column]}")
+
+    rows = conn.execute("SELECT id, pdf_path, text_path, summarized FROM papers").fetchall()
+    for paper_id, pdf_path, text_path, summarized in rows:
+        pdf_sha256 = sha256_of(pdf_path) if artifact_exists(pdf_path) else None
+        text_sha256 = sha256_of(text_path) if artifact_exists(text_path) else None
+        done = bool(summarized) and text_sha256 is not None
+        conn.execute('''
+            UPDATE papers SET pdf_sha256 = ?, text_sha256 = ?, text_pdf_sha256 = ?,
+                summary_text_sha256 = ?, summary_version = ?
+            WHERE id = ?
+        ''', (
+            pdf_sha256, text_sha256, pdf_sha256 if text_sha256 else None,
+            text_sha256 if done else None, LEGACY_SUMMARY_VERSION if done else None, paper_id,
+        ))
+    logger.info("papers に %s の列を追加しました。", ", ".join(missing))
+
+
+def _add_columns(conn, columns: dict):
+    """古いDBに列を追加する（値は次に処理したときに入る）。"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(papers)")}
+    missing = [c for c in columns if c not in existing]
+    for column in missing:
+        conn.execute(f"ALTER TABLE papers ADD COLUMN {column} {columns[column]}")
+    if missing:
+        logger.info("papers に %s の列を追加しました。", ", ".join(missing))
+
+
+# キーワード・著者を正規化したテーブル（種類 → (語のテーブル, 論文との対応表, 対応表の語IDの列)）
+#   keywords / authors              語ごとに1行。paper_count はその語を持つ論文の数
+#   paper_keywords / paper_authors  論文と語の対応
+#   keyword_pairs                   同じ論文に付いた2つのキーワード（keyword_a < keyword_b）の論文数
+# paper_count と keyword_pairs は対応表のトリガーで増減させる（集計し直さない）
+TERM_TABLES = {
+    "keyword": ("keywords", "paper_keywords", "keyword_id"),
+    "author": ("authors", "paper_authors", "author_id"),
+}
+
+
+def _init_terms(conn):
+    """キーワード・著者のテーブルとトリガーを作り、初回は既存の論文から取り込む。"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'keyword_pairs'"
+    ).fetchone()
+    if exists:
+        return
+
+    for table, link, key in TERM_TABLES.values():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                normalized TEXT UNIQUE,
+                paper_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_count ON {table}(paper_count)")
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {link} (
+                paper_id TEXT,
+                {key} INTEGER,
+                PRIMARY KEY (paper_id, {key})
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{link}_term ON {link}({key}, paper_id)")
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {link}_insert AFTER INSERT ON {link} BEGIN
+                UPDATE {table} SET paper_count = paper_count + 1 WHERE id = new.{key};
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {link}_delete AFTER DELETE ON {link} BEGIN
+                UPDATE {table} SET paper_count = paper_count - 1 WHERE id = old.{key};
+            END
+        ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS keyword_pairs (
+            keyword_a INTEGER,
+            keyword_b INTEGER,
+            paper_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (keyword_a, keyword_b)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_keyword_pairs_b ON keyword_pairs(keyword_b, keyword_a)")
+    # 追加したキーワードと、同じ論文の他のキーワードとの組を数える
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS keyword_pairs_insert AFTER INSERT ON paper_keywords BEGIN
+            INSERT INTO keyword_pairs (keyword_a, keyword_b, paper_count)
+            SELECT min(new.keyword_id, keyword_id), max(new.keyword_id, keyword_id), 1
+            FROM paper_keywords
+            WHERE paper_id = new.paper_id AND keyword_id != new.keyword_id
+            ON CONFLICT(keyword_a, keyword_b) DO UPDATE SET paper_count = paper_count + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS keyword_pairs_delete AFTER DELETE ON paper_keywords BEGIN
+            UPDATE keyword_pairs SET paper_count = paper_count - 1
+            WHERE (keyword_a, keyword_b) IN (
+                SELECT min(old.keyword_id, keyword_id), max(old.keyword_id, keyword_id)
+                FROM paper_keywords
+                WHERE paper_id = old.paper_id AND keyword_id != old.keyword_id
+            );
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS papers_terms_delete AFTER DELETE ON papers BEGIN
+            DELETE FROM paper_keywords WHERE paper_id = old.id;
+            DELETE FROM paper_authors WHERE paper_id = old.id;
+        END
+    ''')
+
+    # 既存の論文を取り込む
+    rows = conn.execute(
+        "SELECT id, authors, keywords FROM papers WHERE coalesce(authors, '') != '' OR coalesce(keywords, '') != ''"
+    ).fetchall()
+    for paper_id, authors, keywords in rows:
+        _sync_paper_terms(conn, {"id": paper_id, "authors": authors, "keywords": keywords})
+    if rows:
+        logger.info("%d件の論文のキーワード・著者をテーブルに取り込みました。", len(rows))
+
+
+def normalize_term(name: str) -> str:
+    """キーワード・著者の表記ゆれ（全角半角・大文字小文字・空白）をそろえた比較用の値。"""
+    return " ".join(unicodedata.normalize("NFKC", str(name)).casefold().split())
+
+
+def split_authors(authors: str) -> list:
+    """カンマ区切りの著者の文字列をリストにする。"""
+    return [a.strip() for a in (authors or "").split(",") if a.strip()]
+
+
+def parse_keywords(keywords) -> list:
+    """papers.keywords（JSONの文字列）をリストにする。"""
+    if isinstance(keywords, list):
+        return keywords
+    try:
+        value = json.loads(keywords or "[]")
+    except ValueError:
+        return []
+    return value if isinstance(value, list) else []
+
+
+def _set_paper_terms(conn, kind: str, paper_id: str, names):
+    """論文に付いたキーワード・著者を names に合わせる（差分だけ追加・削除する）。"""
+    table, link, key = TERM_TABLES[kind]
+    terms = {}
+    for name in names:
+        normalized = normalize_term(name)
+        if normalized and normalized not in terms:
+            terms[normalized] = " ".join(str(name).split())
+
+    ids = set()
+    if terms:
+        conn.executemany(
+            f"INSERT INTO {table} (name, normalized) VALUES (?, ?) ON CONFLICT(normalized) DO NOTHING",
+            [(name, normalized) for normalized, name in terms.items()],
+        )
+        placeholders = ", ".join("?" for _ in terms)
+        ids = {row[0] for row in conn.execute(
+            f"SELECT id FROM {table} WHERE normalized IN ({placeholders})", list(terms)
+        )}
+    current = {row[0] for row in conn.execute(f"SELECT {key} FROM {link} WHERE paper_id = ?", (paper_id,))}
+    if current - ids:
+        conn.executemany(f"DELETE FROM {link} WHERE paper_id = ? AND {key} = ?",
+                         [(paper_id, i) for i in current - ids])
+    if ids - current:
+        conn.executemany(f"INSERT INTO {link} (paper_id, {key}) VALUES (?, ?)",
+                         [(paper_id, i) for i in ids - current])
+
+
+def _sync_paper_terms(conn, paper_dict: dict):
+    """登録する論文の著者・キーワードを対応表へ反映する（空の値では既存の対応を消さない）。"""
+    if paper_dict.get("authors"):
+        _set_paper_terms(conn, "author", paper_dict["id"], split_authors(paper_dict["authors"]))
+    keywords = parse_keywords(paper_dict.get("keywords"))
+    if keywords:
+        _set_paper_terms(conn, "keyword", paper_dict["id"], keywords)
+
+
+def _read_text_file(text_path: str) -> str:
+    try:
+        return read_text_artifact(text_path)
+    except (OSError, ValueError, RuntimeError):
+        return ""
+
+
+def _index_body(conn, rowid, text_path):
+    conn.execute("UPDATE papers_fts SET body = ? WHERE rowid = ?", (_read_text_file(text_path), rowid))
+
+
+def _paper_params(paper_dict: dict) -> dict:
+    """登録用の値を作る（渡されなかった列は None = 既存の値を残す）。"""
+    return {c: paper_dict.get(c) for c in PAPER_COLUMNS}
+
 
 # データベースの初期化
 def insert_or_update_paper(paper_dict):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT OR REPLACE INTO papers (
-            id, title, authors, year, source, query, searched_at,
-            pdf_path, text_path, summary_path, downloaded, summarized,
-            url, pdf_url,
-            background, purpose, novelty, method, results,
-            discussion, concerns, conclusion, future_work, keywords
-        ) VALUES (
-            :id, :title, :authors, :year, :source, :query, :searched_at,
-            :pdf_path, :text_path, :summary_path, :downloaded, :summarized,
-            :url, :pdf_url,
-            :background, :purpose, :novelty, :method, :results,
-            :discussion, :concerns, :conclusion, :future_work, :keywords
-        )
-    ''', paper_dict)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(INSERT_PAPER_SQL, _paper_params(paper_dict))
+        _sync_paper_terms(conn, paper_dict)
+    _invalidate_rows([paper_dict["id"]])
+
+
+# 複数の論文をまとめて登録（1トランザクション）
+def insert_or_update_papers(paper_dicts):
+    paper_dicts = list(paper_dicts)
+    with transaction() as conn:
+        conn.executemany(INSERT_PAPER_SQL, [_paper_params(p) for p in paper_dicts])
+        for p in paper_dicts:
+            _sync_paper_terms(conn, p)
+    _invalidate_rows([p["id"] for p in paper_dicts])
+
 
 # 更新論文のステータス
-def update_paper_status(paper_id, pdf_path=None, text_path=None, summary_path=None, downloaded=None, summarized=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    updates = []
-    params = {}
-
-    if pdf_path is not None:
-        updates.append("pdf_path = :pdf_path")
-        params["pdf_path"] = pdf_path
-    if text_path is not None:
-        updates.append("text_path = :text_path")
-        params["text_path"] = text_path
-    if summary_path is not None:
-        updates.append("summary_path = :summary_path")
-        params["summary_path"] = summary_path
-    if downloaded is not None:
-        updates.append("downloaded = :downloaded")
-        params["downloaded"] = downloaded
-    if summarized is not None:
-        updates.append("summarized = :summarized")
-        params["summarized"] = summarized
+def update_paper_status(paper_id, pdf_path=None, text_path=None, summary_path=None, downloaded=None, summarized=None,
+                        pdf_sha256=None, text_sha256=None, text_pdf_sha256=None,
+                        summary_text_sha256=None, summary_version=None,
+                        text_tokens=None, summary_input_tokens=None):
+    values = {
+        "pdf_path": pdf_path,
+        "text_path": text_path,
+        "summary_path": summary_path,
+        "downloaded": downloaded,
+        "summarized": summarized,
+        "pdf_sha256": pdf_sha256,
+        "text_sha256": text_sha256,
+        "text_pdf_sha256": text_pdf_sha256,
+        "summary_text_sha256": summary_text_sha256,
+        "summary_version": summary_version,
+        "text_tokens": text_tokens,
+        "summary_input_tokens": summary_input_tokens,
+    }
+    params = {c: v for c, v in values.items() if v is not None}
+    updates = [f"{c} = :{c}" for c in params]
 
     if not updates:
-        conn.close()
         return
 
     params["id"] = paper_id
@@ -95,53 +513,267 @@ def update_paper_status(paper_id, pdf_path=None, text_path=None, summary_path=No
         SET {", ".join(updates)}
         WHERE id = :id
     '''
-    c.execute(sql, params)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(sql, params)
+        if text_path:
+            row = conn.execute("SELECT rowid FROM papers WHERE id = ?", (paper_id,)).fetchone()
+            if row:
+                _index_body(conn, row[0], text_path)
+    _invalidate_rows([paper_id])
 
 
 # 要約をファイルに保存
 def update_summary_to_db(paper_id, summary):
-    import json
-    keywords_json = json.dumps(summary.get("キーワード", []), ensure_ascii=False)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE papers SET
-            background = :background,
-            purpose = :purpose,
-            novelty = :novelty,
-            method = :method,
-            results = :results,
-            discussion = :discussion,
-            concerns = :concerns,
-            conclusion = :conclusion,
-            future_work = :future_work,
-            keywords = :keywords
-        WHERE id = :id
-    ''', {
-        "background": summary.get("背景", ""),
-        "purpose": summary.get("目的", ""),
-        "novelty": summary.get("新規性", ""),
-        "method": summary.get("方法", ""),
-        "results": summary.get("結果", ""),
-        "discussion": summary.get("考察", ""),
-        "concerns": summary.get("懸念点", ""),
-        "conclusion": summary.get("結論", ""),
-        "future_work": summary.get("今後の展望", ""),
-        "keywords": keywords_json,
-        "id": paper_id
-    })
-    conn.commit()
-    conn.close()
+    keywords = summary.get("キーワード", [])
+    keywords_json = json.dumps(keywords, ensure_ascii=False)
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE papers SET
+                background = :background,
+                purpose = :purpose,
+                novelty = :novelty,
+                method = :method,
+                results = :results,
+                discussion = :discussion,
+                concerns = :concerns,
+                conclusion = :conclusion,
+                future_work = :future_work,
+                keywords = :keywords
+            WHERE id = :id
+        ''', {
+            "background": summary.get("背景", ""),
+            "purpose": summary.get("目的", ""),
+            "novelty": summary.get("新規性", ""),
+            "method": summary.get("方法", ""),
+            "results": summary.get("結果", ""),
+            "discussion": summary.get("考察", ""),
+            "concerns": summary.get("懸念点", ""),
+            "conclusion": summary.get("結論", ""),
+            "future_work": summary.get("今後の展望", ""),
+            "keywords": keywords_json,
+            "id": paper_id
+        })
+        # 要約し直した場合は古いキーワードを外す
+        _set_paper_terms(conn, "keyword", paper_id, keywords if isinstance(keywords, list) else [])
+    _invalidate_rows([paper_id])
+    # 呼び出し側のトランザクション（pipeline.store_summary など）の中でも、埋め込みの計算はコミットの後に行う
+    after_commit(lambda: _notify_summary_saved(paper_id, summary))
+
+
+def _notify_summary_saved(paper_id, summary):
+    for listener in _summary_listeners:
+        try:
+            listener(paper_id, summary)
+        except Exception as e:
+            logger.warning("要約保存後の処理に失敗しました: %s", e)
+
+
+def add_summary_listener(listener):
+    """update_summary_to_db(paper_id, summary) の後（トランザクションの中ならコミット後）に呼ぶ関数を登録する。"""
+    if listener not in _summary_listeners:
+        _summary_listeners.append(listener)
 
 def fetch_all_papers():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT * FROM papers ORDER BY searched_at DESC")
     rows = c.fetchall()
     columns = [desc[0] for desc in c.description]
-    conn.close()
     # dictのリストで返す
     papers = [dict(zip(columns, row)) for row in rows]
     return papers
+
+
+# 一覧表示で使う列（要約の長い列は含めない）
+LIST_COLUMNS = ["id", "title", "authors", "year", "source", "downloaded", "summarized", "searched_at"]
+
+
+def _filter_clause(source=None, year=None, summarized=None, keyword=None, author=None):
+    conditions, params = [], []
+    if source is not None:
+        conditions.append("source = ?")
+        params.append(source)
+    if year is not None:
+        conditions.append("year = ?")
+        params.append(str(year))
+    if summarized is not None:
+        conditions.append("coalesce(summarized, 0) = ?" if not summarized else "summarized = ?")
+        params.append(int(summarized))
+    for kind, name in (("keyword", keyword), ("author", author)):
+        if name is not None:
+            table, link, key = TERM_TABLES[kind]
+            conditions.append(
+                f"id IN (SELECT paper_id FROM {link} WHERE {key} = (SELECT id FROM {table} WHERE normalized = ?))"
+            )
+            params.append(normalize_term(name))
+    return conditions, params
+
+
+def fetch_papers_page(limit: int = 50, after=None, source=None, year=None, summarized=None,
+                      keyword=None, author=None, columns=None, by_rowid: bool = False):
+    """
+    searched_at の新しい順に1ページ分の論文を返す（キーセット方式）。
+    after には前ページの戻り値の next_cursor を渡す。
+    戻り値は (dictのリスト, next_cursor)。次ページがなければ next_cursor は None。
+    by_rowid=True なら登録の新しい順（rowid の降順）にする。searched_at は再検索の upsert で変わるため、
+    全件をたどる途中に更新があると飛ばしたり重複したりする。全件をたどる処理（エクスポートなど）ではこちらを使う。
+    """
+    columns = list(columns or LIST_COLUMNS)
+    unknown = set(columns) - set(PAPER_COLUMNS)
+    if unknown:
+        raise ValueError(f"不明な列です: {sorted(unknown)}")
+    keys = ("rowid",) if by_rowid else ("searched_at", "id")
+    select_columns = columns + [c for c in keys if c not in columns]
+
+    conditions, params = _filter_clause(source, year, summarized, keyword, author)
+    if after is not None:
+        conditions.append(f"({', '.join(keys)}) < ({', '.join('?' * len(keys))})")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    c = get_connection().cursor()
+    c.execute(f'''
+        SELECT {", ".join(select_columns)} FROM papers
+        {where}
+        ORDER BY {", ".join(f"{k} DESC" for k in keys)}
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = [dict(zip(select_columns, row)) for row in c.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = tuple(rows[-1][k] for k in keys)
+    return [{k: row[k] for k in columns} for row in rows], next_cursor
+
+
+def count_papers(source=None, year=None, summarized=None, keyword=None, author=None) -> int:
+    conditions, params = _filter_clause(source, year, summarized, keyword, author)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return get_connection().execute(f"SELECT COUNT(*) FROM papers {where}", params).fetchone()[0]
+
+
+def fetch_distinct_values(column: str) -> list:
+    """フィルタの選択肢用に、列の値の一覧を返す（source・year など）。"""
+    if column not in PAPER_COLUMNS:
+        raise ValueError(f"不明な列です: {column}")
+    rows = get_connection().execute(
+        f"SELECT DISTINCT {column} FROM papers WHERE coalesce({column}, '') != '' ORDER BY {column}"
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def top_terms(kind: str, limit: int = 20, query: str = None) -> list:
+    """
+    論文数の多いキーワード・著者を [(名前, 論文数), ...] で返す（kind は "keyword" / "author"）。
+    query を指定すると、その検索語で見つかった論文の中で数える。
+    """
+    table, link, key = TERM_TABLES[kind]
+    conn = get_connection()
+    if query is None:
+        rows = conn.execute(
+            f"SELECT name, paper_count FROM {table} WHERE paper_count > 0 ORDER BY paper_count DESC LIMIT ?",
+            (limit,),
+        )
+    else:
+        rows = conn.execute(f'''
+            SELECT t.name, COUNT(*) AS n FROM papers p
+            JOIN {link} l ON l.paper_id = p.id
+            JOIN {table} t ON t.id = l.{key}
+            WHERE p.query = ?
+            GROUP BY t.id ORDER BY n DESC LIMIT ?
+        ''', (query, limit))
+    return [tuple(row) for row in rows.fetchall()]
+
+
+def related_keywords(keyword: str, limit: int = 10) -> list:
+    """keyword と同じ論文に付いていることの多いキーワードを [(名前, 論文数), ...] で返す。"""
+    rows = get_connection().execute('''
+        WITH target AS (SELECT id FROM keywords WHERE normalized = ?)
+        SELECT k.name, pairs.paper_count FROM (
+            SELECT keyword_b AS other, paper_count FROM keyword_pairs WHERE keyword_a = (SELECT id FROM target)
+            UNION ALL
+            SELECT keyword_a AS other, paper_count FROM keyword_pairs WHERE keyword_b = (SELECT id FROM target)
+        ) pairs
+        JOIN keywords k ON k.id = pairs.other
+        WHERE pairs.paper_count > 0
+        ORDER BY pairs.paper_count DESC LIMIT ?
+    ''', (normalize_term(keyword), limit))
+    return [tuple(row) for row in rows.fetchall()]
+
+
+def fetch_paper(paper_id: str) -> dict | None:
+    """IDで論文1件を取得する。最近取得した行はキャッシュから返す。"""
+    now = time.time()
+    with _row_cache_lock:
+        cached = _row_cache.get(paper_id)
+        if cached is not None and now - cached[0] < ROW_CACHE_TTL:
+            _row_cache.move_to_end(paper_id)
+            return dict(cached[1])
+
+    c = get_connection().cursor()
+    c.execute("SELECT * FROM papers WHERE id = ?", (paper_id,))
+    row = c.fetchone()
+    if row is None:
+        return None
+    paper = dict(zip([desc[0] for desc in c.description], row))
+
+    with _row_cache_lock:
+        _row_cache[paper_id] = (now, paper)
+        _row_cache.move_to_end(paper_id)
+        while len(_row_cache) > ROW_CACHE_SIZE:
+            _row_cache.popitem(last=False)
+    return dict(paper)
+
+
+def _invalidate_rows(paper_ids):
+    with _row_cache_lock:
+        for paper_id in paper_ids:
+            _row_cache.pop(paper_id, None)
+
+
+def _fts_query(query: str) -> str:
+    """入力文字列をFTS5のフレーズ検索（AND）に変換する。"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+@timed("db_search")
+def search_papers(query: str, limit: int = 20, offset: int = 0):
+    """
+    保存済み論文を全文検索し、関連度順に dict のリストで返す。
+    各要素には id, title, authors, year, source, snippet を含む。
+    """
+    terms = query.split()
+    if not terms:
+        return []
+
+    c = get_connection().cursor()
+    if all(len(t) >= 3 for t in terms):
+        c.execute('''
+            SELECT p.id, p.title, p.authors, p.year, p.source,
+                   snippet(papers_fts, -1, '**', '**', '…', 24) AS snippet
+            FROM papers_fts
+            JOIN papers p ON p.rowid = papers_fts.rowid
+            WHERE papers_fts MATCH ?
+            ORDER BY bm25(papers_fts, 10.0, 3.0, 2.0, 1.0)
+            LIMIT ? OFFSET ?
+        ''', (_fts_query(query), limit, offset))
+    else:
+        # trigram は2文字以下の語に MATCH できないので LIKE で探す
+        conditions = " AND ".join(
+            "(title LIKE ? OR summary LIKE ? OR body LIKE ?)" for _ in terms
+        )
+        params = [f"%{t}%" for t in terms for _ in range(3)]
+        c.execute(f'''
+            SELECT p.id, p.title, p.authors, p.year, p.source,
+                   substr(t.content, max(instr(t.content, ?) - 40, 1), 120) AS snippet
+            FROM (
+                SELECT rowid, title || ' ' || summary || ' ' || body AS content
+                FROM papers_fts WHERE {conditions}
+                ORDER BY rowid DESC
+                LIMIT ? OFFSET ?
+            ) t
+            JOIN papers p ON p.rowid = t.rowid
+        ''', (terms[0], *params, limit, offset))
+
+    columns = [desc[0] for desc in c.description]
+    return [dict(zip(columns, row)) for row in c.fetchall()]
@@ -0,0 +1,226 @@
+# utils/exporter.py
+# 保存済みの論文を Parquet / JSONL / CSV に書き出す
+#   python -m utils.exporter papers.parquet
+#   python -m utils.exporter papers.jsonl --summarized --text
+#   python -m utils.exporter papers.csv --source arXiv --columns id,title,year,keywords
+#   python -m utils.exporter papers.jsonl --keyword "transformer"
+# papers テーブルをキーセット方式で少しずつ読み、読んだ分から書き出すため、件数が増えてもメモリ使用量は一定。
+
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+
+from utils.db_manager import init_db, fetch_papers_page, count_papers, PAPER_COLUMNS
+from utils.blob_store import read_text_artifact
+from utils.metrics import configure_logging, timed
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["parquet", "jsonl", "csv"]
+CHUNK_SIZE = 1000  # 1回に読む行数
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_ROWS = 10000  # Parquet の行グループの大きさ（この行数ずつまとめて書く）
+# 既定で書き出す列（保存先のパスやハッシュなどの内部の列は含めない）
+EXPORT_COLUMNS = [
+    "id", "title", "authors", "year", "source", "query", "searched_at", "url", "pdf_url",
+    "downloaded", "summarized", "summary_version",
+    "background", "purpose", "novelty", "method", "results",
+    "discussion", "concerns", "conclusion", "future_work", "keywords",
+]
+INTEGER_COLUMNS = {"downloaded", "summarized", "summary_version", "text_tokens", "summary_input_tokens"}
+TEXT_COLUMN = "text"
+
+
+def format_of(path: str) -> str:
+    """ファイル名の拡張子から形式を決める。"""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    fmt = {"pq": "parquet", "ndjson": "jsonl"}.get(ext, ext)
+    if fmt not in FORMATS:
+        raise ValueError(f"対応していない形式です: {path}（{', '.join(FORMATS)}）")
+    return fmt
+
+
+def iter_paper_chunks(columns=None, include_text: bool = False, chunk_size: int = CHUNK_SIZE, **filters):
+    """
+    条件に合う論文を登録の新しい順（rowid の降順）に chunk_size 件ずつ dict のリストで返す。
+    書き出し中に再検索で searched_at が更新されても、行を飛ばしたり2回書いたりしないよう変わらないキーでたどる。
+    filters は fetch_papers_page の絞り込み（source / year / summarized / keyword / author）。
+    """
+    columns = list(columns or EXPORT_COLUMNS)
+    read_columns = columns + ["text_path"] if include_text and "text_path" not in columns else columns
+    cursor = None
+    while True:
+        rows, cursor = fetch_papers_page(limit=chunk_size, after=cursor, columns=read_columns, by_rowid=True, **filters)
+        if include_text:
+            for row in rows:
+                text_path = row["text_path"] if "text_path" in columns else row.pop("text_path")
+                row[TEXT_COLUMN] = _read_text(text_path)
+        if rows:
+            yield rows
+        if cursor is None:
+            return
+
+
+def _read_text(text_path) -> str | None:
+    if not text_path:
+        return None
+    try:
+        return read_text_artifact(text_path)
+    except (OSError, ValueError, RuntimeError):
+        return None
+
+
+def _import_pyarrow():
+    """pyarrow は読み込みに時間がかかるので Parquet を書くときだけ読み込む（使わなければ不要）。"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet の書き出しには pyarrow が必要です（pip install pyarrow）")
+    return pyarrow, pyarrow.parquet
+
+
+def _parquet_schema(pa, columns):
+    return pa.schema([
+        (c, pa.int64() if c in INTEGER_COLUMNS else pa.string()) for c in columns
+    ])
+
+
+def _to_int(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_str(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def _write_parquet(f, chunks, columns, compression):
+    pa, pq = _import_pyarrow()
+    schema = _parquet_schema(pa, columns)
+
+    def to_table(rows):
+        arrays = [
+            pa.array([_to_int(row[c]) if c in INTEGER_COLUMNS else _to_str(row[c]) for row in rows],
+                     type=schema.field(c).type)
+            for c in columns
+        ]
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    compression = None if compression in (None, "none") else compression
+    with pq.ParquetWriter(f, schema, compression=compression) as writer:
+        buffered = []
+        for rows in chunks:
+            buffered.extend(rows)
+            if len(buffered) >= PARQUET_ROW_GROUP_ROWS:
+                writer.write_table(to_table(buffered))
+                buffered = []
+        if buffered:
+            writer.write_table(to_table(buffered))
+
+
+def _write_jsonl(f, chunks):
+    out = io.TextIOWrapper(f, encoding="utf-8", newline="\n", write_through=True)
+    for rows in chunks:
+        out.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+    out.detach()
+
+
+def _write_csv(f, chunks, columns):
+    # Excel で文字化けしないよう BOM 付きの UTF-8 で書く
+    out = io.TextIOWrapper(f, encoding="utf-8-sig", newline="", write_through=True)
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+    for rows in chunks:
+        writer.writerows(rows)
+    out.detach()
+
+
+def export_papers(f, fmt: str, columns=None, include_text: bool = False,
+                  compression: str = PARQUET_COMPRESSION, chunk_size: int = CHUNK_SIZE, **filters) -> int:
+    """
+    論文をバイナリのファイルオブジェクト f に書き出し、書き出した件数を返す。
+    columns で列を選び（既定は EXPORT_COLUMNS）、include_text=True なら抽出した本文も "text" 列に含める。
+    filters で絞り込む（iter_paper_chunks を参照）。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"対応していない形式です: {fmt}")
+    columns = list(columns or EXPORT_COLUMNS)
+    unknown = set(columns) - set(PAPER_COLUMNS)
+    if unknown:
+        raise ValueError(f"不明な列です: {sorted(unknown)}")
+    output_columns = columns + [TEXT_COLUMN] if include_text else columns
+
+    count = 0
+
+    def counted(chunks):
+        nonlocal count
+        for rows in chunks:
+            count += len(rows)
+            yield rows
+
+    chunks = counted(iter_paper_chunks(columns, include_text, chunk_size, **filters))
+    with timed("export", format=fmt):
+        if fmt == "parquet":
+            _write_parquet(f, chunks, output_columns, compression)
+        elif fmt == "jsonl":
+            _write_jsonl(f, chunks)
+        else:
+            _write_csv(f, chunks, output_columns)
+    return count
+
+
+def export_to_file(path: str, fmt: str = None, **options) -> int:
+    """論文をファイルに書き出す（一時ファイルに書いてから置き換える）。書き出した件数を返す。"""
+    fmt = fmt or format_of(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            count = export_papers(f, fmt, **options)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みの論文を Parquet / JSONL / CSV に書き出します。")
+    parser.add_argument("output", help="出力先のファイル（拡張子 .parquet / .jsonl / .csv で形式を決める）")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="出力形式（拡張子より優先）")
+    parser.add_argument("--columns", default=None, help="書き出す列（カンマ区切り。省略時は書誌情報と要約の列）")
+    parser.add_argument("--text", action="store_true", help="抽出した本文も含める")
+    parser.add_argument("--source", default=None, help="ソースで絞り込む")
+    parser.add_argument("--year", default=None, help="年で絞り込む")
+    parser.add_argument("--keyword", default=None, help="キーワードで絞り込む")
+    parser.add_argument("--author", default=None, help="著者で絞り込む")
+    summarized = parser.add_mutually_exclusive_group()
+    summarized.add_argument("--summarized", dest="summarized", action="store_true", default=None, help="要約済みのみ")
+    summarized.add_argument("--not-summarized", dest="summarized", action="store_false", help="未要約のみ")
+    parser.add_argument("--compression", default=PARQUET_COMPRESSION, help="Parquet の圧縮形式（zstd / snappy / gzip / none）")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="1回に読む行数")
+    args = parser.parse_args()
+    configure_logging()
+
+    init_db()
+    filters = {
+        "source": args.source, "year": args.year, "summarized": args.summarized,
+        "keyword": args.keyword, "author": args.author,
+    }
+    total = count_papers(**filters)
+    count = export_to_file(
+        args.output, args.format,
+        columns=args.columns.split(",") if args.columns else None,
+        include_text=args.text, compression=args.compression, chunk_size=args.chunk_size, **filters,
+    )
+    logger.info("%d/%d件を %s に書き出しました。", count, total, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# utils/job_queue.py
+# 論文の処理ジョブを paper_db.sqlite のテーブルで管理するキュー（リース・リトライ付き）
+
+import json
+import time
+
+from utils.db_manager import get_connection, transaction
+
+# ジョブの状態
+PENDING = "pending"
+DOWNLOADING = "downloading"
+EXTRACTED = "extracted"
+SUMMARIZED = "summarized"
+FAILED = "failed"
+ACTIVE_STATES = (PENDING, DOWNLOADING, EXTRACTED)
+
+DEFAULT_LEASE_SECONDS = 15 * 60  # この時間内に更新がなければ別のワーカーが引き継ぐ
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30  # 失敗したジョブは 30秒, 60秒, ... 待ってから再実行
+
+_tables_ready = False
+
+
+def init_queue():
+    global _tables_ready
+    if _tables_ready:
+        return
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                paper_id TEXT UNIQUE,
+                payload TEXT,
+                state TEXT,
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER,
+                lease_owner TEXT,
+                lease_until REAL,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, lease_until)")
+    _tables_ready = True
+
+
+def _row_to_job(cursor, row) -> dict:
+    job = dict(zip([desc[0] for desc in cursor.description], row))
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+
+def enqueue_papers(papers, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+    """
+    論文（"id" 付きの dict）をキューに追加する。追加した件数を返す。
+    処理中のものはそのまま、処理済み・失敗したものは入れ直す（ワーカーは DB の状態から古くなったステージだけを
+    処理するので、PDF・本文・プロンプトの版が変わっていなければすぐに処理済みに戻る）。
+    """
+    init_queue()
+    now = time.time()
+    added = 0
+    with transaction() as conn:
+        for paper in papers:
+            cursor = conn.execute('''
+                INSERT INTO jobs (paper_id, payload, state, attempts, max_attempts, created_at, updated_at)
+                VALUES (?, ?, ?, 0, ?, ?, ?)
+                ON CONFLICT(paper_id) DO UPDATE SET
+                    payload = excluded.payload, state = excluded.state, attempts = 0,
+                    lease_owner = NULL, lease_until = NULL, error = NULL, updated_at = excluded.updated_at
+                WHERE jobs.state IN (?, ?)
+            ''', (paper["id"], json.dumps({"paper": paper}, ensure_ascii=False), PENDING, max_attempts, now, now,
+                  SUMMARIZED, FAILED))
+            added += cursor.rowcount
+    return added
+
+
+def claim_job(worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> dict | None:
+    """
+    実行できるジョブを1件取り出してリースを取る。なければ None。
+    リースが切れたジョブ（ワーカーが落ちたもの）は記録済みの状態から再開される。
+    """
+    init_queue()
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute(f'''
+            UPDATE jobs SET lease_owner = ?, lease_until = ?, updated_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE state IN ({", ".join("?" * len(ACTIVE_STATES))})
+                  AND (lease_until IS NULL OR lease_until < ?)
+                ORDER BY id
+                LIMIT 1
+            )
+            RETURNING *
+        ''', (worker_id, now + lease_seconds, now, *ACTIVE_STATES, now))
+        row = cursor.fetchone()
+        return _row_to_job(cursor, row) if row else None
+
+
+def update_job(job_id: int, state: str, payload: dict = None, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+    """ステージが進んだことを記録し、リースを延長する。"""
+    now = time.time()
+    lease_until = None if state in (SUMMARIZED, FAILED) else now + lease_seconds
+    with transaction() as conn:
+        if payload is None:
+            conn.execute(
+                "UPDATE jobs SET state = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                (state, lease_until, now, job_id),
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET state = ?, payload = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                (state, json.dumps(payload, ensure_ascii=False), lease_until, now, job_id),
+            )
+
+
+def renew_lease(job_id: int, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+    """
+    処理中のジョブのリースを延長する（ステージの途中でリースが切れて別のワーカーに取られないように）。
+    既に別のワーカーに引き継がれた・完了した場合は何もせず False を返す。
+    """
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute(f'''
+            UPDATE jobs SET lease_until = ?, updated_at = ?
+            WHERE id = ? AND lease_owner = ? AND state IN ({", ".join("?" * len(ACTIVE_STATES))})
+        ''', (now + lease_seconds, now, job_id, worker_id, *ACTIVE_STATES))
+        return cursor.rowcount > 0
+
+
+def fail_job(job_id: int, error: str):
+    """
+    失敗を記録する。試行回数が上限に達したら failed、そうでなければ
+    状態はそのままにして、待ち時間の後に再実行されるようにする。
+    """
+    now = time.time()
+    with transaction() as conn:
+        attempts, max_attempts = conn.execute(
+            "SELECT attempts + 1, max_attempts FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if attempts >= max_attempts:
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                (FAILED, attempts, error, now, job_id),
+            )
+        else:
+            retry_at = now + RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+            conn.execute(
+                "UPDATE jobs SET attempts = ?, error = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                (attempts, error, retry_at, now, job_id),
+            )
+
+
+def job_counts() -> dict:
+    """状態ごとのジョブ数を返す。"""
+    init_queue()
+    rows = get_connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+    counts = {state: 0 for state in (*ACTIVE_STATES, SUMMARIZED, FAILED)}
+    counts.update(dict(rows))
+    return counts
+
+
+def fetch_recent_jobs(limit: int = 50) -> list:
+    """更新が新しい順にジョブを返す（進捗表示用）。"""
+    init_queue()
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT id, paper_id, state, attempts, error, updated_at FROM jobs
+        ORDER BY updated_at DESC LIMIT ?
+    ''', (limit,))
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,106 @@
+# utils/json_stream.py
+# LLMからストリーミングで届くJSONオブジェクトを少しずつ読み、値が確定した項目から順に取り出す
+#   parser = ObjectStreamParser()
+#   for delta in stream:
+#       for key, value in parser.feed(delta):
+#           ...
+#   parser.close()  # オブジェクトが閉じていなければ例外
+
+import json
+
+# 状態
+_BEFORE = "before"        # "{" の前（```json などの前置きは読み飛ばす）
+_KEY = "key"              # キーの文字列（または "}"）を待っている
+_IN_KEY = "in_key"        # キーの文字列の中
+_COLON = "colon"          # ":" を待っている
+_VALUE = "value"          # 値の中（"," か "}" で終わる）
+_DONE = "done"            # "}" まで読んだ
+
+
+class ObjectStreamParser:
+    """トップレベルのJSONオブジェクトを、届いた分だけ読み進める。入れ子の値はまとめて1つの値として返す。"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._state = _BEFORE
+        self._start = 0       # 読んでいるキー・値の先頭位置
+        self._key = None
+        self._depth = 0       # 値の中の [] {} の深さ
+        self._in_string = False
+        self._escaped = False
+        self.result = {}
+
+    @property
+    def done(self) -> bool:
+        return self._state == _DONE
+
+    def _error(self, message: str):
+        raise json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def feed(self, text: str) -> list:
+        """文字列の続きを読み、新しく値が確定した (キー, 値) のリストを返す。"""
+        self._buffer += text
+        fields = []
+        buffer = self._buffer
+        while self._pos < len(buffer):
+            ch = buffer[self._pos]
+            state = self._state
+            if state == _BEFORE:
+                if ch == "{":
+                    self._state = _KEY
+            elif state == _KEY:
+                if ch == '"':
+                    self._state, self._start = _IN_KEY, self._pos
+                elif ch == "}" and not self.result:
+                    self._state = _DONE
+                elif not ch.isspace():
+                    self._error("キーの位置に文字列がありません")
+            elif state == _IN_KEY:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._key = json.loads(buffer[self._start:self._pos + 1])
+                    self._state = _COLON
+            elif state == _COLON:
+                if ch == ":":
+                    self._state, self._start = _VALUE, self._pos + 1
+                    self._depth, self._in_string = 0, False
+                elif not ch.isspace():
+                    self._error("キーの後に ':' がありません")
+            elif state == _VALUE:
+                if self._in_string:
+                    if self._escaped:
+                        self._escaped = False
+                    elif ch == "\\":
+                        self._escaped = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in "[{":
+                    self._depth += 1
+                elif ch in "]}" and self._depth > 0:
+                    self._depth -= 1
+                elif ch in ",}" and self._depth == 0:
+                    raw = buffer[self._start:self._pos]
+                    try:
+                        value = json.loads(raw)
+                    except json.JSONDecodeError:
+                        self._error(f"{self._key} の値がJSONとして読めません: {raw.strip()[:50]}")
+                    self.result[self._key] = value
+                    fields.append((self._key, value))
+                    self._state = _KEY if ch == "," else _DONE
+            elif state == _DONE:
+                if not ch.isspace() and ch != "`":
+                    self._error("オブジェクトの後に余分な文字があります")
+            self._pos += 1
+        return fields
+
+    def close(self) -> dict:
+        """最後まで読んだことを確かめ、読み取ったオブジェクトを返す。"""
+        if not self.done:
+            self._error("JSONオブジェクトが途中で終わっています")
+        return self.result
@@ -0,0 +1,257 @@
+# utils/metrics.py
+# 処理時間・件数・トークン数などを記録する軽量な計測
+#   with timed("download"): ...        # download_seconds のヒストグラムに記録
+#   @timed("extract")                  # 関数にも付けられる
+#   incr("prompt_tokens", usage.prompt_tokens)
+# 記録はメモリにためておき、data/metrics.sqlite の metrics テーブルへまとめて書き込む。
+#   python -m utils.metrics --format prom > data/metrics.prom
+
+import argparse
+import atexit
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = os.path.join("data", "metrics.sqlite")
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+FLUSH_EVERY = 200  # これだけたまったら書き込む
+FLUSH_INTERVAL = 5.0  # 秒。前回の書き込みからこれだけ経っていても書き込む
+RETENTION_SECONDS = 7 * 24 * 3600  # これより古い記録は削除する
+QUANTILES = (0.5, 0.95)
+PROM_PREFIX = "paper_summary_"
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+_lock = threading.Lock()
+_buffer = []
+_pid = os.getpid()
+_last_flush = time.monotonic()
+_last_cleanup = 0.0
+_conn = None
+
+
+def configure_logging(level: str = None):
+    """ログの出力レベルを設定する（既定は環境変数 LOG_LEVEL、なければ INFO）。"""
+    logging.basicConfig(
+        level=(level or os.getenv("LOG_LEVEL", "INFO")).upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(METRICS_PATH), exist_ok=True)
+        _conn = sqlite3.connect(METRICS_PATH, timeout=30, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics (
+                ts REAL,
+                name TEXT,
+                kind TEXT,
+                labels TEXT,
+                value REAL
+            )
+        ''')
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics(ts)")
+    return _conn
+
+
+def _check_pid():
+    """fork した子プロセスでは親の未書き込み分と接続を引き継がない。"""
+    global _pid, _conn
+    if os.getpid() != _pid:
+        _pid = os.getpid()
+        _buffer.clear()
+        _conn = None
+
+
+def _record(kind: str, name: str, value: float, labels: dict):
+    if not ENABLED:
+        return
+    with _lock:
+        _check_pid()
+        _buffer.append((time.time(), name, kind, json.dumps(labels, sort_keys=True) if labels else "", float(value)))
+        due = len(_buffer) >= FLUSH_EVERY or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+def incr(name: str, value: float = 1, **labels):
+    """カウンタを value だけ増やす。"""
+    _record(COUNTER, name, value, labels)
+
+
+def observe(name: str, value: float, **labels):
+    """ヒストグラムに値を1つ記録する（p50/p95 の集計対象）。"""
+    _record(HISTOGRAM, name, value, labels)
+
+
+class timed:
+    """
+    処理時間（秒）を "<name>_seconds" に記録する。例外が出たら "<name>_errors" も数える。
+    with 文でもデコレータでも使える。経過時間は elapsed に入る。
+    """
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        observe(f"{self.name}_seconds", self.elapsed, **self.labels)
+        if exc_type is not None:
+            incr(f"{self.name}_errors", **self.labels)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(self.name, **self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def flush():
+    """ためている記録を SQLite に書き込む。計測の失敗で本来の処理は止めない。"""
+    global _last_flush, _last_cleanup
+    with _lock:
+        _check_pid()
+        rows = list(_buffer)
+        _buffer.clear()
+        _last_flush = time.monotonic()
+        if not rows:
+            return
+        try:
+            conn = _connect()
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO metrics (ts, name, kind, labels, value) VALUES (?, ?, ?, ?, ?)", rows)
+            if time.time() - _last_cleanup > 3600:
+                conn.execute("DELETE FROM metrics WHERE ts < ?", (time.time() - RETENTION_SECONDS,))
+                _last_cleanup = time.time()
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if _conn is not None and _conn.in_transaction:
+                _conn.execute("ROLLBACK")
+            logger.warning("計測データの保存に失敗しました: %s", e)
+
+
+atexit.register(flush)
+
+
+# --- 集計・出力 ---
+
+def _quantile(sorted_values: list, q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize_metrics(since: float = None) -> dict:
+    """
+    since（UNIX時刻）以降の記録を集計する。
+    戻り値は {"counters": [{name, labels, value}], "histograms": [{name, labels, count, sum, p50, p95}]}。
+    """
+    flush()
+    since = since or 0.0
+    with _lock:
+        conn = _connect()
+        counter_rows = conn.execute('''
+            SELECT name, labels, SUM(value) FROM metrics
+            WHERE kind = ? AND ts >= ? GROUP BY name, labels ORDER BY name, labels
+        ''', (COUNTER, since)).fetchall()
+        histogram_rows = conn.execute('''
+            SELECT name, labels, value FROM metrics
+            WHERE kind = ? AND ts >= ? ORDER BY name, labels, value
+        ''', (HISTOGRAM, since)).fetchall()
+
+    counters = [
+        {"name": name, "labels": json.loads(labels) if labels else {}, "value": value}
+        for name, labels, value in counter_rows
+    ]
+
+    groups = {}
+    for name, labels, value in histogram_rows:
+        groups.setdefault((name, labels), []).append(value)
+    histograms = []
+    for (name, labels), values in groups.items():
+        item = {"name": name, "labels": json.loads(labels) if labels else {}, "count": len(values), "sum": sum(values)}
+        for q in QUANTILES:
+            item[f"p{int(q * 100)}"] = _quantile(values, q)
+        histograms.append(item)
+    return {"counters": counters, "histograms": histograms}
+
+
+def _prom_escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_labels(labels: dict, extra: dict = None) -> str:
+    labels = {**labels, **(extra or {})}
+    if not labels:
+        return ""
+    escaped = (f'{k}="{_prom_escape(v)}"' for k, v in sorted(labels.items()))
+    return "{" + ",".join(escaped) + "}"
+
+
+def to_prometheus(summary: dict) -> str:
+    """集計結果を Prometheus のテキスト形式にする（ヒストグラムは summary 型）。"""
+    lines, typed = [], set()
+    for item in summary["counters"]:
+        name = f"{PROM_PREFIX}{item['name']}_total"
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_prom_labels(item['labels'])} {item['value']}")
+    for item in summary["histograms"]:
+        name = f"{PROM_PREFIX}{item['name']}"
+        if name not in typed:
+            lines.append(f"# TYPE {name} summary")
+            typed.add(name)
+        for q in QUANTILES:
+            lines.append(f"{name}{_prom_labels(item['labels'], {'quantile': q})} {item[f'p{int(q * 100)}']}")
+        lines.append(f"{name}_sum{_prom_labels(item['labels'])} {item['sum']}")
+        lines.append(f"{name}_count{_prom_labels(item['labels'])} {item['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path: str, fmt: str = "prom", since: float = None) -> str:
+    """集計結果をファイルに書き出す（node_exporter の textfile collector などで読める）。"""
+    summary = summarize_metrics(since)
+    text = to_prometheus(summary) if fmt == "prom" else json.dumps(summary, ensure_ascii=False, indent=2)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録した計測値を集計して出力します。")
+    parser.add_argument("--format", choices=["prom", "json"], default="prom", help="出力形式")
+    parser.add_argument("--since", type=float, default=None, help="この秒数前以降の記録だけ集計する")
+    parser.add_argument("--output", default=None, help="出力先のファイル（省略時は標準出力）")
+    args = parser.parse_args()
+
+    since = time.time() - args.since if args.since else None
+    if args.output:
+        write_metrics_file(args.output, args.format, since)
+        return
+    summary = summarize_metrics(since)
+    print(to_prometheus(summary) if args.format == "prom" else json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
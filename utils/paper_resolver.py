@@ -0,0 +1,256 @@
+# utils/paper_resolver.py
+# 検索ソースごとに異なる論文IDを正規化し、同じ論文を1件にまとめる
+
+import re
+import zlib
+import hashlib
+import unicodedata
+
+from utils.db_manager import get_connection, transaction
+
+# MinHash の設定（NUM_BANDS × ROWS_PER_BAND 個のハッシュを使う）
+NUM_BANDS = 8
+ROWS_PER_BAND = 4
+SHINGLE_SIZE = 4  # 正規化したタイトルの文字4-gram（日本語のタイトルにも使える）
+TITLE_SIMILARITY = 0.8  # これ以上のJaccard係数なら同じ論文とみなす
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_SEEDS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % _MERSENNE_PRIME or 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % _MERSENNE_PRIME)
+    for i in range(NUM_BANDS * ROWS_PER_BAND)
+]
+
+_ARXIV_NEW = re.compile(r"(\d{4}\.\d{4,5})(v\d+)?", re.IGNORECASE)
+_ARXIV_OLD = re.compile(r"([a-z\-]+(?:\.[A-Z]{2})?/\d{7})(v\d+)?", re.IGNORECASE)
+
+_tables_ready = False
+
+
+def normalize_arxiv_id(value: str) -> str | None:
+    """arXivのURLやIDからバージョンを除いたIDを取り出す（例: 2101.00001v2 → 2101.00001）。"""
+    if not value:
+        return None
+    value = value.strip()
+    value = re.sub(r"^(?:https?://)?(?:export\.)?arxiv\.org/(?:abs|pdf)/", "", value, flags=re.IGNORECASE)
+    value = re.sub(r"^arxiv:", "", value, flags=re.IGNORECASE)
+    value = re.sub(r"\.pdf$", "", value, flags=re.IGNORECASE)
+    match = _ARXIV_NEW.fullmatch(value) or _ARXIV_OLD.fullmatch(value)
+    return match.group(1).lower() if match else None
+
+
+def normalize_doi(value: str) -> str | None:
+    """DOIを小文字にして doi.org のURLや "doi:" を取り除く。"""
+    if not value:
+        return None
+    value = value.strip().lower()
+    value = re.sub(r"^(?:https?://)?(?:dx\.)?doi\.org/", "", value)
+    value = re.sub(r"^doi:\s*", "", value)
+    return value if value.startswith("10.") else None
+
+
+def normalize_title(title: str) -> str:
+    """全角/半角・大文字/小文字・記号の違いを無視したタイトルにする。"""
+    title = unicodedata.normalize("NFKC", title or "").lower()
+    title = re.sub(r"[^\w\s]", " ", title)
+    return " ".join(title.split())
+
+
+def paper_keys(paper: dict) -> list:
+    """論文の識別キーを優先度順に返す（arxiv: / doi: / s2:）。"""
+    keys = []
+    arxiv_id = normalize_arxiv_id(paper.get("arxiv_id") or "")
+    if arxiv_id is None and paper.get("source") == "arXiv":
+        arxiv_id = normalize_arxiv_id(paper.get("url", ""))
+    if arxiv_id is None:
+        arxiv_id = normalize_arxiv_id(paper.get("pdf_url", "") or "")
+    if arxiv_id:
+        keys.append(f"arxiv:{arxiv_id}")
+    doi = normalize_doi(paper.get("doi") or "")
+    if doi:
+        keys.append(f"doi:{doi}")
+    if paper.get("s2_id"):
+        keys.append(f"s2:{paper['s2_id']}")
+    return keys
+
+
+def canonical_id(paper: dict) -> str:
+    """論文の正規化ID。どのIDも取れない場合はURLのハッシュを使う。"""
+    keys = paper_keys(paper)
+    if keys:
+        return keys[0]
+    url = paper.get("url") or paper.get("pdf_url") or paper.get("title", "")
+    return "url:" + hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+
+# --- タイトルの MinHash ---
+
+def _shingles(normalized: str) -> set:
+    text = normalized.replace(" ", "")
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _band_buckets(shingles: set) -> list:
+    """MinHash 署名をバンドごとにまとめた (band, bucket) のリストを返す。"""
+    if not shingles:
+        return []
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+    signature = [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _SEEDS]
+    return [
+        (band, hashlib.md5(repr(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]).encode()).hexdigest()[:16])
+        for band in range(NUM_BANDS)
+    ]
+
+
+# --- SQLite に保存する索引 ---
+
+def _ensure_tables():
+    global _tables_ready
+    if _tables_ready:
+        return
+    with transaction() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS paper_keys (key TEXT PRIMARY KEY, paper_id TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS paper_titles (paper_id TEXT PRIMARY KEY, normalized TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_paper_titles_normalized ON paper_titles(normalized)")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS title_minhash (
+                band INTEGER,
+                bucket TEXT,
+                paper_id TEXT,
+                PRIMARY KEY (band, bucket, paper_id)
+            )
+        ''')
+        empty = conn.execute("SELECT 1 FROM paper_titles LIMIT 1").fetchone() is None
+        has_papers = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'papers'"
+        ).fetchone() is not None
+        if empty and has_papers:
+            # 既存の論文を索引へ取り込む（初回のみ）
+            rows = conn.execute("SELECT id, title, url, pdf_url, source FROM papers").fetchall()
+            for paper_id, title, url, pdf_url, source in rows:
+                _register(conn, paper_id, {"title": title, "url": url or "", "pdf_url": pdf_url or "", "source": source})
+    _tables_ready = True
+
+
+def _register(conn, paper_id: str, paper: dict):
+    conn.executemany(
+        "INSERT OR IGNORE INTO paper_keys (key, paper_id) VALUES (?, ?)",
+        [(key, paper_id) for key in paper_keys(paper)],
+    )
+    normalized = normalize_title(paper.get("title", ""))
+    if not normalized:
+        return
+    conn.execute("INSERT OR REPLACE INTO paper_titles (paper_id, normalized) VALUES (?, ?)", (paper_id, normalized))
+    conn.executemany(
+        "INSERT OR IGNORE INTO title_minhash (band, bucket, paper_id) VALUES (?, ?, ?)",
+        [(band, bucket, paper_id) for band, bucket in _band_buckets(_shingles(normalized))],
+    )
+
+
+def register_papers(papers):
+    """DBに保存した論文のキーとタイトル署名を索引に登録する（papers の各要素は "id" を持つこと）。"""
+    _ensure_tables()
+    with transaction() as conn:
+        for paper in papers:
+            _register(conn, paper["id"], paper)
+
+
+def find_existing_id(paper: dict, threshold: float = TITLE_SIMILARITY) -> str | None:
+    """保存済みの論文のうち、キーが一致するかタイトルがほぼ同じもののIDを返す。"""
+    _ensure_tables()
+    conn = get_connection()
+    keys = paper_keys(paper)
+    if keys:
+        row = conn.execute(
+            f"SELECT paper_id FROM paper_keys WHERE key IN ({', '.join('?' * len(keys))})", keys
+        ).fetchone()
+        if row:
+            return row[0]
+
+    normalized = normalize_title(paper.get("title", ""))
+    if not normalized:
+        return None
+    row = conn.execute("SELECT paper_id FROM paper_titles WHERE normalized = ?", (normalized,)).fetchone()
+    if row:
+        return row[0]
+
+    shingles = _shingles(normalized)
+    buckets = _band_buckets(shingles)
+    if not buckets:
+        return None
+    where = " OR ".join("(m.band = ? AND m.bucket = ?)" for _ in buckets)
+    candidates = conn.execute(f'''
+        SELECT DISTINCT t.paper_id, t.normalized FROM title_minhash m
+        JOIN paper_titles t ON t.paper_id = m.paper_id
+        WHERE {where}
+    ''', [v for bucket in buckets for v in bucket]).fetchall()
+    best = max(candidates, key=lambda c: _jaccard(shingles, _shingles(c[1])), default=None)
+    if best and _jaccard(shingles, _shingles(best[1])) >= threshold:
+        return best[0]
+    return None
+
+
+def _merge(group: list) -> dict:
+    """同じ論文の検索結果をまとめる。PDFは arXiv のものを優先する。"""
+    group = sorted(group, key=lambda p: p.get("source") != "arXiv")
+    merged = dict(group[0])
+    for other in group[1:]:
+        for field, value in other.items():
+            if value and not merged.get(field):
+                merged[field] = value
+    merged["sources"] = sorted({p.get("source", "") for p in group})
+    return merged
+
+
+def dedupe_papers(papers, threshold: float = TITLE_SIMILARITY) -> list:
+    """
+    複数ソースの検索結果から同じ論文をまとめ、各論文に "id"（正規化ID）を付けて返す。
+    識別子（arXiv ID・DOI・Semantic Scholar ID）が一致するか、タイトルがほぼ同じものを同じ論文とみなす。
+    既にDBにある論文はそのIDを引き継ぐ。
+    """
+    papers = list(papers)
+    parent = list(range(len(papers)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[find(i)] = find(j)
+
+    seen_keys, seen_buckets = {}, {}
+    shingles = [_shingles(normalize_title(p.get("title", ""))) for p in papers]
+    for i, paper in enumerate(papers):
+        for key in paper_keys(paper):
+            if key in seen_keys:
+                union(i, seen_keys[key])
+            seen_keys[key] = i
+        for bucket in _band_buckets(shingles[i]):
+            for j in seen_buckets.get(bucket, []):
+                if find(i) != find(j) and _jaccard(shingles[i], shingles[j]) >= threshold:
+                    union(i, j)
+            seen_buckets.setdefault(bucket, []).append(i)
+
+    groups = {}
+    for i, paper in enumerate(papers):
+        groups.setdefault(find(i), []).append(paper)
+
+    merged_papers = []
+    for group in groups.values():
+        merged = _merge(group)
+        existing = None
+        for paper in group:
+            existing = find_existing_id(paper, threshold)
+            if existing:
+                break
+        merged["id"] = existing or canonical_id(merged)
+        merged_papers.append(merged)
+    return merged_papers
@@ -0,0 +1,47 @@
+# utils/paper_search.py
+# arXiv と Semantic Scholar を同時に検索し、結果をキャッシュする
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.arxiv_search import search_arxiv
+from utils.semantic_scholar_search import search_semantic_scholar
+from utils.search_cache import get_cached_results, put_cached_results
+from utils.metrics import incr, timed
+
+SOURCES = {
+    "arXiv": lambda keyword, limit, offset: search_arxiv(keyword, max_results=limit, offset=offset),
+    "SemanticScholar": lambda keyword, limit, offset: search_semantic_scholar(keyword, limit=limit, offset=offset),
+}
+
+
+def _search_with_cache(source: str, keyword: str, limit: int, offset: int) -> list:
+    cached = get_cached_results(source, keyword, limit, offset)
+    if cached is not None:
+        incr("search_cache_hits", source=source)
+        return cached
+    with timed("search", source=source):
+        papers = SOURCES[source](keyword, limit, offset)
+    incr("search_results", len(papers), source=source)
+    put_cached_results(source, keyword, limit, offset, papers)
+    return papers
+
+
+def search_all_sources(keyword: str, limit: int = 10, offset: int = 0):
+    """
+    全ソースを並列に検索する。
+    戻り値は (ソース名→論文リスト の辞書, ソース名→例外 の辞書)。
+    失敗したソースは空リストになり、例外は2つ目の辞書に入る（キャッシュはしない）。
+    """
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+        futures = {
+            source: pool.submit(_search_with_cache, source, keyword, limit, offset)
+            for source in SOURCES
+        }
+        for source, future in futures.items():
+            try:
+                results[source] = future.result()
+            except Exception as e:
+                results[source] = []
+                errors[source] = e
+    return results, errors
@@ -1,8 +1,38 @@
 # utils/pdf_downloader.py
 
 import os
+import json
+import contextlib
+import hashlib
+import logging
+import threading
 import requests
 import re
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+from utils.rate_limiter import request
+from utils.metrics import incr, observe, timed
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+TIMEOUT = (10, 60)  # (接続タイムアウト, チャンク間の読み込みタイムアウト) 秒
+CHUNK_SIZE = 64 * 1024
+MAX_PDF_BYTES = 100 * 1024 * 1024  # 1ファイルあたりの上限（100MB）
+POOL_MAXSIZE = 8  # ホストごとに保持するkeep-alive接続数
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class DownloadTooLargeError(Exception):
+    """PDFのサイズが上限を超えた場合の例外"""
+
+
+class DownloadCancelledError(Exception):
+    """ダウンロードを途中で取り消した場合の例外（.part は続きから再開できるように残す）"""
+
 
 def sanitize_filename(filename: str) -> str:
     """
@@ -11,11 +41,131 @@ def sanitize_filename(filename: str) -> str:
     """
     return re.sub(r'[\\/*?:"<>|]', "_", filename)
 
-def download_pdf(pdf_url: str, save_dir: str, filename: str = None) -> str | None:
+
+def get_session(url: str) -> requests.Session:
+    """
+    URLのホストごとに共有する keep-alive 付きの requests.Session を返す。
+    """
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(HEADERS)
+            _sessions[host] = session
+        return session
+
+
+def file_sha256(path: str) -> str:
+    """ファイルのSHA-256をチャンク単位で計算する。"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _meta_path(save_path: str) -> str:
+    return save_path + ".meta.json"
+
+
+def _load_meta(save_path: str) -> dict:
+    try:
+        with open(_meta_path(save_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_meta(save_path: str, meta: dict):
+    with open(_meta_path(save_path), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def _stream_to_part(session, pdf_url, part_path, meta, max_bytes, cancel=None):
+    """
+    part_path にPDFをストリーミングで書き込む。
+    途中まで残っている場合は Range で続きから取得する。cancel が立ったらチャンクの区切りでやめる。
+    戻り値は (status_code, sha256, etag)。304 の場合は sha256 が None。
+    """
+    headers = {}
+    if meta.get("etag") and meta.get("complete"):
+        headers["If-None-Match"] = meta["etag"]
+
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if resume_from:
+        headers["Range"] = f"bytes={resume_from}-"
+        if meta.get("part_etag"):
+            headers["If-Range"] = meta["part_etag"]
+
+    with request("GET", pdf_url, session=session, headers=headers, timeout=TIMEOUT, stream=True) as r:
+        if r.status_code == 304:
+            return 304, None, meta.get("etag")
+        if r.status_code == 206 and resume_from and r.headers.get("Content-Range", "").startswith(f"bytes {resume_from}-"):
+            return _write_part(r, part_path, resume_from, max_bytes, cancel, pdf_url)
+        if r.status_code == 200:
+            # 全体を返してきた（Range 非対応・If-Range の不一致）ので最初から書き直す
+            return _write_part(r, part_path, 0, max_bytes, cancel, pdf_url)
+        if r.status_code not in (206, 416) or not resume_from:
+            # 部分的な応答などを全体として保存すると壊れたPDFになるので、200 以外は受け取らない
+            r.raise_for_status()
+            raise requests.exceptions.HTTPError(f"想定外の応答です（HTTP {r.status_code}）: {pdf_url}", response=r)
+
+    # 416、または続きと違う範囲の 206: 途中ファイルが壊れている・サーバー側で変わったので
+    # .part を捨てて Range なしで最初から取り直す（今の接続を返してから）
+    for path in (part_path, _meta_path(part_path)):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+    return _stream_to_part(session, pdf_url, part_path, {}, max_bytes, cancel)
+
+
+def _write_part(r, part_path, resume_from, max_bytes, cancel, pdf_url):
+    """
+    レスポンス r の本体を part_path に書き込み、(status_code, sha256, etag) を返す。
+    resume_from が 0 でなければ r は part_path の続きの 206、0 なら全体の 200。
+    """
+    etag = r.headers.get("ETag")
+    h = hashlib.sha256()
+    if resume_from:
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+        mode, written = "ab", resume_from
+    else:
+        mode, written = "wb", 0
+
+    length = r.headers.get("Content-Length")
+    if length is not None and written + int(length) > max_bytes:
+        raise DownloadTooLargeError(f"PDFのサイズが上限({max_bytes} bytes)を超えています")
+
+    if etag:
+        _save_meta(part_path, {"part_etag": etag})
+
+    with open(part_path, mode) as f:
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelledError(pdf_url)
+            written += len(chunk)
+            if written > max_bytes:
+                raise DownloadTooLargeError(f"PDFのサイズが上限({max_bytes} bytes)を超えています")
+            h.update(chunk)
+            f.write(chunk)
+
+    return r.status_code, h.hexdigest(), etag
+
+
+def download_pdf(pdf_url: str, save_dir: str, filename: str = None,
+                 max_bytes: int = MAX_PDF_BYTES, expected_sha256: str = None,
+                 cancel: threading.Event = None) -> str | None:
     """
     PDFを指定フォルダに保存し、保存したパスを返す。
     filenameが指定されなければURLの末尾から取得。
-    失敗した場合は None を返す。
+    一時ファイル(.part)へチャンク単位で書き込み、完了後に保存先へリネームする。
+    既存ファイルのハッシュまたはETagが一致する場合はダウンロードを省略する。
+    失敗した場合は None を返す。cancel が立った場合は DownloadCancelledError を送出する。
     """
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
@@ -29,19 +179,48 @@ def download_pdf(pdf_url: str, save_dir: str, filename: str = None) -> str | Non
         filename += ".pdf"
 
     save_path = os.path.join(save_dir, filename)
+    part_path = save_path + ".part"
 
-    try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        r = requests.get(pdf_url, headers=headers, timeout=10)
-        r.raise_for_status()
+    meta = {}
+    if os.path.exists(save_path):
+        meta = _load_meta(save_path)
+        existing_sha256 = file_sha256(save_path)
+        if expected_sha256 and existing_sha256 == expected_sha256:
+            return save_path
+        if meta.get("sha256") != existing_sha256:
+            # 中身が記録と食い違う場合は ETag を信用しない
+            meta = {}
+    if meta.get("url") != pdf_url:
+        meta = {}
+    meta.update(_load_meta(part_path))
 
-        with open(save_path, "wb") as f:
-            f.write(r.content)
+    try:
+        with timed("download") as timer:
+            status, sha256, etag = _stream_to_part(get_session(pdf_url), pdf_url, part_path, meta, max_bytes, cancel)
+        if status == 304:
+            incr("download_not_modified")
+            return save_path
+        size = os.path.getsize(part_path)
+        observe("download_bytes", size)
+        observe("download_bytes_per_sec", size / max(timer.elapsed, 1e-6))
 
+        os.replace(part_path, save_path)
+        if os.path.exists(_meta_path(part_path)):
+            os.remove(_meta_path(part_path))
+        _save_meta(save_path, {"url": pdf_url, "etag": etag, "sha256": sha256, "complete": True})
         return save_path
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ PDFのダウンロードに失敗しました: {e}")
-        print("🔍 手動でPDFをダウンロードしてアップロードしてください。URLによる取得がブロックされています。")
+    except DownloadTooLargeError as e:
+        for path in (part_path, _meta_path(part_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        incr("download_failures", reason="too_large")
+        logger.error("PDFのダウンロードを中止しました: %s", e)
         return None
 
+    except requests.exceptions.RequestException as e:
+        # .part は次回の再開用に残しておく
+        incr("download_failures", reason="http")
+        logger.error("PDFのダウンロードに失敗しました: %s", e)
+        logger.info("手動でPDFをダウンロードしてアップロードしてください。URLによる取得がブロックされています。")
+        return None
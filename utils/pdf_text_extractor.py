@@ -1,35 +1,148 @@
 # utils/pdf_text_extractor.py
 
-import fitz  # PyMuPDF
 import re
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_text_from_pdf(file_path: str) -> str:
+from utils.metrics import observe, timed
+from utils.text_sections import split_sections, format_sections
+
+# 使うライブラリの優先順（"auto" のとき、開けなかったら次を試す）
+BACKENDS = ["pymupdf", "pdfplumber", "pypdf2"]
+# このページ数以上のPDFはページ範囲に分けて複数プロセスで抽出する
+PARALLEL_MIN_PAGES = 40
+
+# 改行・空白の連続、引用番号 [12]、対象外の文字を1回の置換でまとめて処理する
+# （単独の半角スペースはそのままでよいのでマッチさせず、置換の呼び出し回数を減らす）
+# 対象外の文字から空白は除く（全角スペースなどを消すと前後の語がつながる。空白は最初の選択肢で1つにまとめる）
+_CLEAN_PATTERN = re.compile(r"(\s{2,}|[^\S ])|\[\d+\]|[^\s\x00-\x7Fぁ-んァ-ン一-龥。、．，：；！？「」『』（）【】]+")
+
+
+def _open_pymupdf(file_path):
+    import fitz  # PyMuPDF
+    doc = fitz.open(file_path)
+    return len(doc), (lambda i: doc[i].get_text()), doc.close
+
+
+def _open_pdfplumber(file_path):
+    import pdfplumber
+    pdf = pdfplumber.open(file_path)
+    return len(pdf.pages), (lambda i: pdf.pages[i].extract_text() or ""), pdf.close
+
+
+def _open_pypdf2(file_path):
+    from PyPDF2 import PdfReader
+    f = open(file_path, "rb")
+    reader = PdfReader(f)
+    return len(reader.pages), (lambda i: reader.pages[i].extract_text() or ""), f.close
+
+
+_OPENERS = {
+    "pymupdf": _open_pymupdf,
+    "pdfplumber": _open_pdfplumber,
+    "pypdf2": _open_pypdf2,
+}
+
+
+def _open_pdf(file_path: str, backend: str = "auto"):
     """
-    指定されたPDFファイルから本文を抽出し、整形したテキストを返す。
+    PDFを開き (使ったバックエンド名, ページ数, ページ取得関数, close関数) を返す。
+    backend="auto" のときは BACKENDS の順に試し、最初に開けたものを使う。
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"指定されたPDFが存在しません: {file_path}")
 
+    names = BACKENDS if backend == "auto" else [backend]
+    errors = []
+    for name in names:
+        try:
+            page_count, get_page, close = _OPENERS[name](file_path)
+            return name, page_count, get_page, close
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    raise RuntimeError(f"PDF読み取りエラー: {' / '.join(errors)}")
+
+
+def page_count(file_path: str, backend: str = "auto") -> int:
+    _, count, _, close = _open_pdf(file_path, backend)
+    close()
+    return count
+
+
+def iter_pages(file_path: str, start: int = 0, end: int = None, backend: str = "auto"):
+    """
+    PDFのページテキスト（未整形）を1ページずつ返すジェネレータ。
+    途中でやめればそれ以降のページは読まない。
+    """
+    name, count, get_page, close = _open_pdf(file_path, backend)
     try:
-        with fitz.open(file_path) as doc:
-            raw_text = "\n".join(page.get_text() for page in doc)
-    except Exception as e:
-        raise RuntimeError(f"PDF読み取りエラー: {e}")
+        for i in range(start, count if end is None else min(end, count)):
+            try:
+                yield get_page(i)
+            except Exception as e:
+                raise RuntimeError(f"PDF読み取りエラー({name}, {i + 1}ページ目): {e}")
+    finally:
+        close()
+
+
+def _extract_range(file_path: str, start: int, end: int, backend: str) -> list:
+    """ページ範囲のテキストを抽出する（プロセスプールで実行）。"""
+    return list(iter_pages(file_path, start, end, backend))
+
+
+def extract_raw_pages(file_path: str, max_pages: int = None, max_chars: int = None,
+                      backend: str = "auto", workers: int = None) -> list:
+    """
+    PDFのページテキスト（未整形）のリストを返す。
+    max_pages / max_chars を指定するとそこで読み込みを打ち切る。
+    ページ数が多い場合はページ範囲に分けて workers 個のプロセスで並列に抽出する。
+    """
+    name, count, _, close = _open_pdf(file_path, backend)
+    close()
+    if max_pages is not None:
+        count = min(count, max_pages)
 
-    return clean_pdf_text(raw_text)
+    workers = workers or os.cpu_count() or 1
+    with timed("extract", backend=name) as timer:
+        if max_chars is None and workers > 1 and count >= PARALLEL_MIN_PAGES:
+            step = -(-count // workers)
+            ranges = [(start, min(start + step, count)) for start in range(0, count, step)]
+            with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = [pool.submit(_extract_range, file_path, start, end, name) for start, end in ranges]
+                pages = [page for future in futures for page in future.result()]
+        else:
+            pages, total = [], 0
+            for page in iter_pages(file_path, 0, count, name):
+                pages.append(page)
+                total += len(page)
+                if max_chars is not None and total >= max_chars:
+                    break
+    if pages:
+        observe("extract_ms_per_page", timer.elapsed * 1000 / len(pages), backend=name)
+    return pages
+
+
+def extract_text_from_pdf(file_path: str, max_pages: int = None, max_chars: int = None,
+                          backend: str = "auto", workers: int = None) -> str:
+    """
+    指定されたPDFファイルから本文を抽出し、整形したテキストを返す。
+    改行を消す前に節の見出しを見つけ、節ごとに「見出し\n本文」を空行で区切って返す（text_sections を参照）。
+    """
+    pages = extract_raw_pages(file_path, max_pages=max_pages, max_chars=max_chars,
+                              backend=backend, workers=workers)
+    text = format_sections(split_sections("\n".join(pages)), clean_pdf_text)
+    return text[:max_chars] if max_chars is not None else text
+
+
+def _clean_replace(match) -> str:
+    return " " if match.lastindex else ""
 
 
 def clean_pdf_text(text: str) -> str:
     """
     PDF抽出後のテキストを整形する（改行削除、記号除去など）。
     """
-    text = text.replace("\n", " ")
-    text = re.sub(r"\s+", " ", text)
-    text = re.sub(r"\[\d+\]", "", text)
-    text = re.sub(r"[^\x00-\x7Fぁ-んァ-ン一-龥。、．，：；！？「」『』（）【】]", "", text)
-
-    return text.strip()
+    return _CLEAN_PATTERN.sub(_clean_replace, text).strip()
 
 
 def save_text_to_file(text: str, output_path: str):
@@ -0,0 +1,269 @@
+# utils/pipeline.py
+
+import hashlib
+import json
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from utils.pdf_downloader import download_pdf, MAX_PDF_BYTES
+from utils.pdf_text_extractor import extract_text_from_pdf
+from utils.summarizer import summarize_text, preload, PROMPT_VERSION
+from utils.db_manager import update_paper_status, update_summary_to_db, transaction, fetch_paper
+from utils.blob_store import (
+    STORE_DIR, digest_of, put_file, put_text, put_json, local_path, artifact_exists, read_text_artifact,
+)
+from utils.paper_resolver import canonical_id
+from utils.text_sections import reduce_text
+from utils.metrics import timed, flush, incr, observe
+import utils.croma_manager  # noqa: F401  要約の保存時にベクトル索引も更新する（どの画面・プロセスから保存しても）
+
+# ダウンロード途中のPDFの置き場所（完了したら blob へ移す）
+DOWNLOAD_DIR = os.path.join(STORE_DIR, "downloads")
+
+# 各ステージの同時実行数（ダウンロードとLLMはI/O待ち、抽出はCPU処理）
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_EXTRACT_WORKERS = None  # None の場合は CPU コア数
+DEFAULT_SUMMARIZE_WORKERS = 4
+
+STAGES = ["download", "extract", "summarize"]
+# DBから読み込む処理の状態（db_manager.HASH_COLUMNS の説明を参照）
+STATE_COLUMNS = [
+    "pdf_path", "text_path", "summary_path", "summarized",
+    "pdf_sha256", "text_sha256", "text_pdf_sha256", "summary_text_sha256", "summary_version",
+]
+
+
+def paper_id_of(paper: dict) -> str:
+    """検索結果の論文からDB上のIDを求める（dedupe_papers 済みならその "id"）。"""
+    return paper.get("id") or canonical_id(paper)
+
+
+def new_result(paper: dict) -> dict:
+    """ステージ間で受け渡す処理結果の辞書を作る。"""
+    result = {
+        "paper": paper,
+        "paper_id": paper_id_of(paper),
+        "summary": None,
+        "stage": "download",
+        "skipped": False,
+        "error": None,
+    }
+    result.update({c: None for c in STATE_COLUMNS})
+    return result
+
+
+def load_state(result: dict) -> dict:
+    """DBに記録されている処理の状態を result に読み込む（result 側で設定済みの値は残す）。"""
+    stored = fetch_paper(result["paper_id"]) or {}
+    for column in STATE_COLUMNS:
+        if result.get(column) in (None, "") and stored.get(column) not in (None, ""):
+            result[column] = stored[column]
+    return result
+
+
+def stale_stage(result: dict) -> str | None:
+    """
+    最初にやり直す必要があるステージを返す（すべて最新なら None）。
+      download   PDFがない
+      extract    本文テキストがない・今のPDFから抽出したものではない
+      summarize  未要約・今の本文から作った要約ではない・プロンプトの版が古い
+    """
+    if not artifact_exists(result["pdf_path"]):
+        return "download"
+    if not artifact_exists(result["text_path"]) or not result["pdf_sha256"] \
+            or result["text_pdf_sha256"] != result["pdf_sha256"]:
+        return "extract"
+    if not result["summarized"] or not result["text_sha256"] \
+            or result["summary_text_sha256"] != result["text_sha256"] \
+            or (result["summary_version"] or 0) < PROMPT_VERSION:
+        return "summarize"
+    return None
+
+
+@timed("stage_download")
+def download_stage(result: dict, cancel=None, max_bytes: int = MAX_PDF_BYTES) -> dict:
+    """
+    PDFを取得して blob に保存し、DBのステータスを更新する（スレッドで実行）。
+    cancel（threading.Event）が立つと DownloadCancelledError で途中でやめる（download_pdf を参照）。
+    """
+    paper = result["paper"]
+    # 論文とURLから決まるファイル名にして、中断した .part から再開できるようにする
+    key = f"{result['paper_id']}\n{paper['pdf_url']}"
+    filename = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pdf"
+    pdf_path = download_pdf(pdf_url=paper["pdf_url"], save_dir=DOWNLOAD_DIR, filename=filename,
+                            max_bytes=max_bytes, cancel=cancel)
+
+    if pdf_path is None or not os.path.exists(pdf_path):
+        raise RuntimeError("PDFのダウンロードに失敗しました")
+
+    pdf_ref = put_file(pdf_path, move=True)
+    # 本体を移したので ETag の記録も不要（取得済みかどうかは blob と pdf_sha256 で stale_stage が判断し、
+    # blob があればこの段階自体を呼ばない。download_pdf の ETag・expected_sha256 での省略は単体で使うとき用）
+    if os.path.exists(pdf_path + ".meta.json"):
+        os.remove(pdf_path + ".meta.json")
+
+    update_paper_status(result["paper_id"], pdf_path=pdf_ref, downloaded=1, pdf_sha256=digest_of(pdf_ref))
+    result["pdf_path"] = pdf_ref
+    result["pdf_sha256"] = digest_of(pdf_ref)
+    return result
+
+
+def extract_stage(pdf_ref: str, workers: int | None = 1) -> tuple:
+    """
+    PDFからテキストを抽出して blob に保存し、(テキストの参照, テキスト) を返す（プロセスプールで実行）。
+    論文単位で既に並列化しているので、既定では1本のPDFの中ではプロセスを増やさない。
+    """
+    with timed("stage_extract"):
+        text = extract_text_from_pdf(local_path(pdf_ref), workers=workers)
+        text_ref = put_text(text)
+    flush()  # プールのプロセスは終了時に書き込まないのでここで書き込む
+    return text_ref, text
+
+
+def store_text(result: dict, text_ref: str) -> dict:
+    """抽出した本文テキストの参照と、抽出元のPDFのハッシュをDBへ記録する。"""
+    result["text_path"] = text_ref
+    result["text_sha256"] = digest_of(text_ref)
+    result["text_pdf_sha256"] = result["pdf_sha256"]
+    update_paper_status(result["paper_id"], text_path=text_ref, text_sha256=result["text_sha256"],
+                        text_pdf_sha256=result["text_pdf_sha256"])
+    return result
+
+
+@timed("stage_summarize")
+def summarize_stage(result: dict, text: str = None, on_field=None) -> dict:
+    """
+    抽出済みテキストを要約してDBへ保存する（スレッドで実行）。text がなければ保存済みの本文を読む。
+    on_field を渡すと要約の項目が確定するごとに呼ぶ（summarize_text を参照）。
+    """
+    if text is None:
+        text = read_text_artifact(result["text_path"])
+    return store_summary(result, summarize_text(summary_input(result["paper_id"], text), on_field=on_field))
+
+
+def summary_input(paper_id: str, text: str) -> str:
+    """
+    本文から要約に渡す部分（参考文献などを除き SUMMARY_TOKEN_BUDGET に収めたもの）を返し、
+    元のトークン数と渡すトークン数をDBとメトリクスに記録する。
+    """
+    reduced, stats = reduce_text(text)
+    update_paper_status(paper_id, text_tokens=stats["text_tokens"], summary_input_tokens=stats["input_tokens"])
+    incr("summary_tokens_saved", stats["text_tokens"] - stats["input_tokens"])
+    observe("summary_input_tokens", stats["input_tokens"])
+    return reduced
+
+
+def store_summary(result: dict, summary: dict) -> dict:
+    """要約に論文情報を付けて blob とDBへ保存する。"""
+    paper = result["paper"]
+    paper_id = result["paper_id"]
+
+    summary["タイトル"] = paper["title"]
+    summary["ソース"] = paper["source"]
+    summary["年"] = paper["year"]
+
+    summary_path = put_json(summary)
+    # 要約・要約済みフラグ・要約元の本文のハッシュはまとめてコミットする
+    with transaction():
+        update_summary_to_db(paper_id, summary)
+        update_paper_status(paper_id, summary_path=summary_path, summarized=1,
+                            summary_text_sha256=result["text_sha256"], summary_version=PROMPT_VERSION)
+
+    result["summary"] = summary
+    result["summary_path"] = summary_path
+    result["summarized"] = 1
+    result["summary_text_sha256"] = result["text_sha256"]
+    result["summary_version"] = PROMPT_VERSION
+    return result
+
+
+def load_summary(result: dict) -> dict | None:
+    """保存済みの要約を読む（最新で処理を省いた論文の表示用）。"""
+    try:
+        return json.loads(read_text_artifact(result["summary_path"]))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def run_pipeline(papers, download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+                 extract_workers: int | None = DEFAULT_EXTRACT_WORKERS,
+                 summarize_workers: int = DEFAULT_SUMMARIZE_WORKERS):
+    """
+    論文リストを「ダウンロード → 抽出 → 要約」の3段で並列処理し、
+    1件終わるごとに結果の辞書を yield する（完了順）。
+    DBの状態とハッシュから論文ごとに古くなったステージだけを実行し、すべて最新の論文は "skipped" を立てて返す。
+    失敗した論文は "error" と失敗した "stage" を設定して返し、他の論文の処理は続ける。
+    """
+    papers = list(papers)
+    if not papers:
+        return
+
+    preload()  # 抽出のプロセスを fork する前に読み込んでおく
+    done = queue.Queue()
+    download_pool = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="download")
+    extract_pool = ProcessPoolExecutor(max_workers=extract_workers)
+    summarize_pool = ThreadPoolExecutor(max_workers=summarize_workers, thread_name_prefix="summarize")
+
+    def fail(result, e):
+        result["error"] = str(e)
+        done.put(result)
+
+    def advance(result, ran=None, text=None):
+        """次に必要なステージを投入する。ran は直前に実行したステージ。"""
+        try:
+            stage = stale_stage(result)
+            if stage is not None and ran is not None and STAGES.index(stage) <= STAGES.index(ran):
+                raise RuntimeError(f"{ran} の結果がDBに記録されていません")
+            if stage is None:
+                if ran is None:
+                    result["skipped"] = True
+                    result["summary"] = load_summary(result)
+                    incr("pipeline_skipped")
+                done.put(result)
+                return
+
+            result["stage"] = stage
+            if stage == "download":
+                download_pool.submit(download_stage, result).add_done_callback(
+                    lambda f: on_stage_done(result, f, "download"))
+            elif stage == "extract":
+                extract_pool.submit(extract_stage, result["pdf_path"]).add_done_callback(
+                    lambda f: on_extracted(result, f))
+            else:
+                summarize_pool.submit(summarize_stage, result, text).add_done_callback(
+                    lambda f: on_stage_done(result, f, "summarize"))
+        except Exception as e:
+            fail(result, e)
+
+    def on_stage_done(result, future, stage):
+        try:
+            future.result()
+        except Exception as e:
+            return fail(result, e)
+        advance(result, stage)
+
+    def on_extracted(result, future):
+        try:
+            text_ref, text = future.result()
+            store_text(result, text_ref)
+        except Exception as e:
+            return fail(result, e)
+        advance(result, "extract", text)
+
+    try:
+        for paper in papers:
+            result = new_result(paper)
+            try:
+                load_state(result)
+            except Exception as e:
+                fail(result, e)
+                continue
+            advance(result)
+
+        for _ in range(len(papers)):
+            yield done.get()
+    finally:
+        # 途中で中断された場合も待たずに後続を打ち切る
+        for pool in (download_pool, extract_pool, summarize_pool):
+            pool.shutdown(wait=False, cancel_futures=True)
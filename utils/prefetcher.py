@@ -0,0 +1,198 @@
+# utils/prefetcher.py
+# 検索結果を表示した時点で、一括要約のボタンを押す前からPDFのダウンロード（と本文の抽出）をバックグラウンドで進めておく
+#   Streamlit は操作のたびにスクリプトを実行し直すため、先読みの状態はこのモジュール（プロセス内で共有）に持つ。
+#   同じ検索結果で何度呼んでも1回だけ投入し、検索結果が変わったら前の先読みを取り消す（セッションごと）。
+#   PREFETCH_IDLE_SECONDS の間呼ばれなかったセッション（タブを閉じたなど）の先読みは取り消して忘れる。
+#   先読みで取得してまだ要約していないPDFは、合計 PREFETCH_DISK_BUDGET_MB までにする。
+#   一括要約では claim() で対象の先読みを引き取ってから処理する（同じ .part に2つのスレッドで書き込まないため）。
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from utils.blob_store import local_path
+from utils.db_manager import fetch_paper
+from utils.pdf_downloader import DownloadCancelledError, MAX_PDF_BYTES
+from utils.pipeline import (
+    new_result, load_state, stale_stage, download_stage, extract_stage, store_text, paper_id_of,
+)
+from utils.metrics import incr
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH", "1") == "1"  # 画面で先読みを有効にしておくか（既定）
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))  # 同時に先読みする論文の数
+PREFETCH_EXTRACT = os.getenv("PREFETCH_EXTRACT", "1") == "1"  # ダウンロードに続けて本文も抽出しておくか
+PREFETCH_DISK_BUDGET_MB = int(os.getenv("PREFETCH_DISK_BUDGET_MB", "500"))
+PREFETCH_IDLE_SECONDS = int(os.getenv("PREFETCH_IDLE_SECONDS", "1800"))
+
+# 状態
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"      # ディスクの予算を使い切った
+CANCELLED = "cancelled"  # 検索結果が変わった・一括要約に引き取られた
+
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+_generations = {}  # セッション → 今の先読み {"key", "cancel": Event, "futures": {論文ID: Future}, "states": {論文ID: 状態}, "touched"}
+_speculative = {}  # 論文ID → 先読みで取得したPDFのバイト数（要約されるまで予算に数える）
+_paper_locks = {}  # 論文ID → 先読みの処理中に持つロック
+_claimed = {}      # 一括要約が処理中の論文ID → 引き取っている一括要約の数（セッションをまたいで数える。先読みしない）
+_lock = threading.Lock()
+
+
+def _paper_lock(paper_id: str) -> threading.Lock:
+    with _lock:
+        return _paper_locks.setdefault(paper_id, threading.Lock())
+
+
+def _budget_left() -> int:
+    """先読みに使えるディスクの残り（バイト）。要約済みになった論文のPDFはもう数えない。"""
+    with _lock:
+        paper_ids = list(_speculative)
+    for paper_id in paper_ids:
+        stored = fetch_paper(paper_id)
+        if stored is None or stored.get("summarized"):
+            with _lock:
+                _speculative.pop(paper_id, None)
+    with _lock:
+        return PREFETCH_DISK_BUDGET_MB * 1024 * 1024 - sum(_speculative.values())
+
+
+def _prefetch(paper: dict, generation: dict):
+    """1件の論文について、古くなっていればダウンロード（と抽出）を行う（スレッドで実行）。"""
+    paper_id = paper_id_of(paper)
+    cancel = generation["cancel"]
+
+    def set_state(state):
+        with _lock:
+            generation["states"][paper_id] = state
+
+    with _paper_lock(paper_id):
+        with _lock:
+            claimed = paper_id in _claimed
+        if cancel.is_set() or claimed:
+            return set_state(CANCELLED)
+        set_state(RUNNING)
+        try:
+            result = load_state(new_result(paper))
+            stage = stale_stage(result)
+            if stage == "download":
+                budget = _budget_left()
+                if budget <= 0:
+                    incr("prefetch_skipped", reason="budget")
+                    return set_state(SKIPPED)
+                # 予算の残りより大きいPDFは途中でやめる（一括要約では上限なしで取り直す）
+                download_stage(result, cancel=cancel, max_bytes=min(MAX_PDF_BYTES, budget))
+                with _lock:
+                    _speculative[paper_id] = os.path.getsize(local_path(result["pdf_path"]))
+                stage = stale_stage(result)
+            if stage == "extract" and PREFETCH_EXTRACT and not cancel.is_set():
+                # 抽出は一括要約の処理と CPU を取り合わないよう1プロセスで行う
+                text_ref, _ = extract_stage(result["pdf_path"], workers=1)
+                store_text(result, text_ref)
+        except DownloadCancelledError:
+            incr("prefetch_cancelled")
+            return set_state(CANCELLED)
+        except Exception as e:
+            logger.info("%s の先読みに失敗しました（一括要約のときに取り直します）: %s", paper.get("title"), e)
+            incr("prefetch_failures")
+            return set_state(FAILED)
+        incr("prefetch_done")
+        set_state(DONE)  # claim() がロックを取れた時点で状態が確定しているように、ロックの中で設定する
+
+
+def _cancel(generation: dict):
+    generation["cancel"].set()
+    for paper_id, future in generation["futures"].items():
+        if future.cancel():
+            generation["states"][paper_id] = CANCELLED
+
+
+def _prune_idle(now: float, keep: str):
+    """しばらく呼ばれていないセッションの先読みを取り消して忘れる（_lock の中で呼ぶ）。"""
+    for owner, generation in list(_generations.items()):
+        if owner != keep and now - generation["touched"] > PREFETCH_IDLE_SECONDS:
+            _cancel(generation)
+            del _generations[owner]
+
+
+def prefetch(papers, owner: str = "default"):
+    """
+    papers のPDFの先読みを始める。owner（セッション）ごとに、前回と同じ論文の並びなら何もしない。
+    並びが変わったら前回の先読みを取り消す（ダウンロード中のものは .part を残して止める）。
+    """
+    papers = [paper for paper in papers if paper.get("pdf_url")]
+    key = tuple(paper_id_of(paper) for paper in papers)
+    now = time.monotonic()
+    with _lock:
+        _prune_idle(now, keep=owner)
+        previous = _generations.get(owner)
+        if previous is not None and previous["key"] == key:
+            previous["touched"] = now
+            return
+        generation = {"key": key, "cancel": threading.Event(), "futures": {},
+                      "states": {paper_id: PENDING for paper_id in key}, "touched": now}
+        _generations[owner] = generation
+        if previous is not None:
+            _cancel(previous)
+        for paper in papers:
+            generation["futures"][paper_id_of(paper)] = _executor.submit(_prefetch, paper, generation)
+
+
+def cancel_prefetch(owner: str = "default"):
+    """owner の先読みをすべて取り消す。"""
+    with _lock:
+        generation = _generations.pop(owner, None)
+        if generation is not None:
+            _cancel(generation)
+
+
+def prefetch_status(owner: str = "default") -> dict:
+    """owner の先読みの状態ごとの件数を返す（先読みしていなければ空）。"""
+    with _lock:
+        generation = _generations.get(owner)
+        if generation is not None:
+            generation["touched"] = time.monotonic()
+        states = list(generation["states"].values()) if generation else []
+    return {state: states.count(state) for state in (PENDING, RUNNING, DONE, FAILED, SKIPPED, CANCELLED)
+            if state in states}
+
+
+@contextmanager
+def claim(papers, owner: str = "default"):
+    """
+    一括要約の前に papers の先読みを引き取る。まだ始まっていない先読みは取り消し、処理中のものは終わるまで待つ。
+    with の中では papers を先読みしない。with の値は先読みが済んでいた件数。
+    """
+    paper_ids = [paper_id_of(paper) for paper in papers]
+    with _lock:
+        for paper_id in paper_ids:
+            _claimed[paper_id] = _claimed.get(paper_id, 0) + 1
+        generation = _generations.get(owner)
+        if generation is not None:
+            for paper_id in paper_ids:
+                future = generation["futures"].get(paper_id)
+                if future is not None and future.cancel():
+                    generation["states"][paper_id] = CANCELLED
+    for paper_id in paper_ids:
+        with _paper_lock(paper_id):
+            pass
+    with _lock:
+        states = dict(generation["states"]) if generation else {}
+    hits = sum(states.get(paper_id) == DONE for paper_id in paper_ids)
+    if hits:
+        incr("prefetch_hits", hits)
+    try:
+        yield hits
+    finally:
+        with _lock:
+            # 別のセッションが同じ論文を引き取っていれば、その一括要約が終わるまで先読みしない
+            for paper_id in paper_ids:
+                _claimed[paper_id] -= 1
+                if not _claimed[paper_id]:
+                    del _claimed[paper_id]
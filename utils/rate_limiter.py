@@ -0,0 +1,317 @@
+# utils/rate_limiter.py
+# 外部API（arXiv・Semantic Scholar・PDF配布元・OpenAI）への呼び出しをホストごとに制御する
+#   - トークンバケットで1秒あたりのリクエスト数を制限
+#   - 429 を受けたら同時実行数を半分に、成功が続けば少しずつ戻す（AIMD）
+#   - 429 / 5xx / 接続エラーは Retry-After または指数バックオフ＋ジッターで再試行
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+from utils.metrics import incr
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # 秒。1, 2, 4, 8, ... にジッターをかける
+BACKOFF_MAX = 60.0
+
+# ホストごとの (1秒あたりのリクエスト数, バースト数, 最大同時実行数)
+HOST_LIMITS = {
+    "export.arxiv.org": (1 / 3, 1, 1),  # arXiv API は3秒に1回まで
+    "api.semanticscholar.org": (1.0, 1, 2),  # APIキーなしは1秒に1回程度
+    "api.openai.com": (5.0, 5, 8),
+}
+DEFAULT_LIMIT = (5.0, 5, 4)
+# asyncio から枠・トークンを待つためのスレッド（既定の executor は httpx の名前解決などでも使うので分ける）
+ASYNC_WAIT_THREADS = 8
+
+
+class RetryableError(Exception):
+    """再試行してよいエラー。retry_after があればその秒数だけ待つ。"""
+
+    def __init__(self, message, retry_after=None, throttled=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンが1つ取れるまで待つ。"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def block_for(self, seconds: float):
+        """Retry-After などで指定された時間、このホストへの送信を止める。"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrency:
+    """429 で同時実行数を半分にし、成功するたびに少しずつ増やす（上限 max_limit）。"""
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, throttled: bool = False):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class _Slot:
+    """slot() で取った同時実行枠。release_on_close で、with を抜けた後も応答の本体を閉じるまで持ち続けられる。"""
+
+    def __init__(self, concurrency: AdaptiveConcurrency):
+        self.concurrency = concurrency
+        self.handed_off = False
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self, throttled: bool = False):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.concurrency.release(throttled)
+
+    def release_on_close(self, response):
+        """response.close() が呼ばれたとき（閉じずに捨てられた場合は回収されたとき）に枠を返す。"""
+        close = response.close
+
+        def close_and_release(*args, **kwargs):
+            try:
+                return close(*args, **kwargs)
+            finally:
+                self.release()
+
+        response.close = close_and_release
+        weakref.finalize(response, self.release)
+        self.handed_off = True
+
+
+def _clamped(retry_after: float) -> float:
+    """Retry-After が極端に長くても BACKOFF_MAX 秒までしか待たない。"""
+    return min(retry_after, BACKOFF_MAX)
+
+
+class HostLimiter:
+    def __init__(self, rate: float, burst: float, max_concurrency: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+
+    def _acquire(self):
+        """同時実行枠を取り、続けてトークンを取る（トークンの待ちで失敗したら枠を返す）。"""
+        self.concurrency.acquire()
+        try:
+            self.bucket.acquire()
+        except BaseException:
+            self.concurrency.release()
+            raise
+
+    @contextmanager
+    def slot(self):
+        """
+        同時実行枠とトークンを取ってから処理を実行する。
+        with の値の release_on_close(response) を呼ぶと、枠は with を抜けても response を閉じるまで返さない。
+        """
+        self._acquire()
+        slot = _Slot(self.concurrency)
+        throttled = False
+        try:
+            yield slot
+        except RetryableError as e:
+            throttled = e.throttled
+            if e.retry_after:
+                self.bucket.block_for(_clamped(e.retry_after))
+            raise
+        finally:
+            if not slot.handed_off:
+                slot.release(throttled)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """
+        slot() の asyncio 版。枠とトークンの待ちは専用のスレッドで行い、イベントループを止めない。
+        （既定の executor で待つと、待ちのスレッドで埋まったときに枠を持っている側の通信が進まず止まる）
+        """
+        future = asyncio.get_running_loop().run_in_executor(_async_wait_pool(), self._acquire)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 待っている間に取り消されたら、あとで取れた枠を返す
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or self.concurrency.release())
+            raise
+        throttled = False
+        try:
+            yield
+        except RetryableError as e:
+            throttled = e.throttled
+            if e.retry_after:
+                self.bucket.block_for(_clamped(e.retry_after))
+            raise
+        finally:
+            self.concurrency.release(throttled)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_wait_pool = None
+
+
+def _async_wait_pool() -> ThreadPoolExecutor:
+    global _wait_pool
+    with _limiters_lock:
+        if _wait_pool is None:
+            _wait_pool = ThreadPoolExecutor(max_workers=ASYNC_WAIT_THREADS, thread_name_prefix="limiter-wait")
+        return _wait_pool
+
+
+def get_limiter(host: str) -> HostLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = HostLimiter(*HOST_LIMITS.get(host, DEFAULT_LIMIT))
+            _limiters[host] = limiter
+        return limiter
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc
+
+
+def parse_retry_after(value) -> float | None:
+    """Retry-After ヘッダー（秒数またはHTTP日付）を秒数にする。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """指数バックオフ（フルジッター）の待ち時間。"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def call_with_retry(host: str, fn, max_retries: int = MAX_RETRIES, hold_until_closed: bool = False):
+    """
+    ホストの制限の中で fn() を呼ぶ。fn が RetryableError を投げたら待ってから再試行する。
+    再試行しても失敗した場合は最後の例外をそのまま投げる。
+    hold_until_closed なら、fn() の戻り値（ストリーミングの応答）を閉じるまで同時実行枠を返さない。
+    """
+    limiter = get_limiter(host)
+    for attempt in range(max_retries + 1):
+        try:
+            with limiter.slot() as slot:
+                result = fn()
+                if hold_until_closed:
+                    slot.release_on_close(result)
+                return result
+        except RetryableError as e:
+            incr("api_retries", host=host)
+            if e.throttled:
+                incr("api_throttled", host=host)
+            if attempt == max_retries:
+                raise
+            time.sleep(_clamped(e.retry_after) if e.retry_after is not None else backoff_delay(attempt))
+
+
+async def acall_with_retry(host: str, afn, max_retries: int = MAX_RETRIES):
+    """call_with_retry の asyncio 版。await afn() を同じホストの制限（同期の呼び出しと共有）の中で行う。"""
+    limiter = get_limiter(host)
+    for attempt in range(max_retries + 1):
+        try:
+            async with limiter.aslot():
+                return await afn()
+        except RetryableError as e:
+            incr("api_retries", host=host)
+            if e.throttled:
+                incr("api_throttled", host=host)
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(_clamped(e.retry_after) if e.retry_after is not None else backoff_delay(attempt))
+
+
+def request(method: str, url: str, session: requests.Session = None, max_retries: int = MAX_RETRIES, **kwargs):
+    """
+    requests でのHTTP呼び出しをホストの制限・再試行つきで行う。
+    再試行しきれなかった 429 / 5xx はそのレスポンスを返す（呼び出し側で raise_for_status できる）。
+    stream=True のときは、本体を読み終えてレスポンスを閉じるまで同時実行枠を持ち続ける（with で使う）。
+    """
+    session = session or requests
+    last_response = None
+
+    def send():
+        nonlocal last_response
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            last_response = None
+            raise RetryableError(str(e))
+        if response.status_code in RETRY_STATUS:
+            last_response = response
+            response.close()
+            raise RetryableError(
+                f"HTTP {response.status_code}",
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                throttled=response.status_code == 429,
+            )
+        return response
+
+    try:
+        return call_with_retry(host_of(url), send, max_retries, hold_until_closed=bool(kwargs.get("stream")))
+    except RetryableError:
+        if last_response is not None:
+            return last_response
+        raise requests.exceptions.ConnectionError(f"{url} への接続に失敗しました")
+
+
+def endpoint(env_name: str, default: str) -> str:
+    """APIのエンドポイント。環境変数で差し替えられる（ローカルのテスト用サーバーなど）。"""
+    return os.getenv(env_name, default)
@@ -0,0 +1,110 @@
+# utils/search_cache.py
+# 検索APIの結果を (ソース, キーワード, 件数, オフセット) ごとに一定時間保存するキャッシュ
+
+import sqlite3
+import os
+import json
+import threading
+import time
+
+CACHE_PATH = os.path.join("data", "search_cache.sqlite")
+TTL_SECONDS = 60 * 60  # 1時間で期限切れ
+MAX_ENTRIES = 1000  # これを超えたら最終利用が古いものから削除
+TOUCH_INTERVAL = 60  # 最終利用の時刻はこの秒数より古くなったときだけ書き直す（ヒットのたびに書き込まない）
+
+# スレッドごとに1本の接続を使い回す（db_manager.get_connection と同じ）
+_local = threading.local()
+_ready_paths = set()  # テーブルを作成済みのキャッシュファイル
+_ready_lock = threading.Lock()
+
+
+def _create_tables(conn):
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS search_cache (
+                source TEXT,
+                keyword TEXT,
+                lim INTEGER,
+                offset INTEGER,
+                results TEXT,
+                created_at REAL,
+                last_used REAL,
+                PRIMARY KEY (source, keyword, lim, offset)
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_last_used ON search_cache(last_used)")
+
+
+def _connect() -> sqlite3.Connection:
+    """現在のスレッド用の接続を返す（なければ作成。テーブルの作成はファイルごとに1回）。"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and (_local.path != CACHE_PATH or _local.pid != os.getpid()):
+        # キャッシュファイルの切り替えや fork 後の子プロセスでは親の接続を使わない
+        conn = None
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _ready_lock:
+            if CACHE_PATH not in _ready_paths:
+                _create_tables(conn)
+                _ready_paths.add(CACHE_PATH)
+        _local.conn = conn
+        _local.path = CACHE_PATH
+        _local.pid = os.getpid()
+    return conn
+
+
+def get_cached_results(source: str, keyword: str, limit: int, offset: int = 0, ttl: int = TTL_SECONDS):
+    """期限内のキャッシュがあれば論文リストを返す。なければ None。"""
+    now = time.time()
+    key = (source, keyword.strip().lower(), limit, offset)
+    conn = _connect()
+    row = conn.execute('''
+        SELECT results, created_at, last_used FROM search_cache
+        WHERE source = ? AND keyword = ? AND lim = ? AND offset = ?
+    ''', key).fetchone()
+    if row is None:
+        return None
+    if now - row[1] > ttl:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''
+                DELETE FROM search_cache
+                WHERE source = ? AND keyword = ? AND lim = ? AND offset = ?
+            ''', key)
+        return None
+    if now - row[2] > TOUCH_INTERVAL:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''
+                UPDATE search_cache SET last_used = ?
+                WHERE source = ? AND keyword = ? AND lim = ? AND offset = ?
+            ''', (now, *key))
+    return json.loads(row[0])
+
+
+def put_cached_results(source: str, keyword: str, limit: int, offset: int, papers: list):
+    """検索結果を保存し、件数の上限を超えた分を古い順に削除する。"""
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()  # 書き込みロックを取ってから時刻を決める（待つ間に他の保存より古くならないように）
+        conn.execute('''
+            INSERT OR REPLACE INTO search_cache (source, keyword, lim, offset, results, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (source, keyword.strip().lower(), limit, offset, json.dumps(papers, ensure_ascii=False), now, now))
+        conn.execute('''
+            DELETE FROM search_cache WHERE rowid IN (
+                SELECT rowid FROM search_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        ''', (MAX_ENTRIES,))
+
+
+def clear_search_cache():
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM search_cache")
@@ -1,21 +1,25 @@
 # semantic scholarでキーワードに対する論文検索を行う
-import requests
+from utils.rate_limiter import request, endpoint
+from utils.pdf_downloader import get_session
 
-def search_semantic_scholar(keyword: str, limit: int = 10):
-    url = "https://api.semanticscholar.org/graph/v1/paper/search"# Semantic ScholarのAPIエンドポイント
+def search_semantic_scholar(keyword: str, limit: int = 10, offset: int = 0):
+    url = endpoint("SEMANTIC_SCHOLAR_API_URL", "https://api.semanticscholar.org/graph/v1/paper/search")# Semantic ScholarのAPIエンドポイント
     params = {
         "query": keyword,
+        "offset": offset,
         "limit": limit,
-        "fields": "title,authors,year,venue,url,openAccessPdf,abstract"
+        "fields": "paperId,externalIds,title,authors,year,venue,url,openAccessPdf,abstract"
     }
 
-    response = requests.get(url, params=params)
+    # 429 は Retry-After に従って再試行し、それでも駄目なら HTTPError を投げる
+    response = request("GET", url, session=get_session(url), params=params, timeout=30)
     response.raise_for_status()
     results = response.json().get("data", [])
     papers = []
 
     for paper in results:
-        pdf_url = paper.get("openAccessPdf", {}).get("url", "")
+        pdf_url = (paper.get("openAccessPdf") or {}).get("url", "")
+        external_ids = paper.get("externalIds") or {}
         if pdf_url:
             papers.append({
                 "source": "SemanticScholar",
@@ -25,6 +29,9 @@ def search_semantic_scholar(keyword: str, limit: int = 10):
                 "venue": paper.get("venue", "不明"),
                 "url": paper.get("url", ""),
                 "pdf_url": pdf_url,
+                "arxiv_id": external_ids.get("ArXiv", ""),
+                "doi": external_ids.get("DOI", ""),
+                "s2_id": paper.get("paperId", ""),
                 "summary": paper.get("abstract", "")
             })
 
@@ -1,31 +1,71 @@
 # utils/summarizer.py
+# openai・jsonschema・tiktoken は読み込みに時間がかかるため、最初に使うときに読み込む
 
-import openai
+import asyncio
+import functools
 import json
 import os
 import re
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from dotenv import load_dotenv
-from jsonschema import validate, ValidationError
 
-load_dotenv()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from utils.summary_cache import make_key, get_cached_summary, put_cached_summary
+from utils.metrics import incr, observe, timed
+from utils.json_stream import ObjectStreamParser
+from utils.rate_limiter import call_with_retry, acall_with_retry, host_of, parse_retry_after, RetryableError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+@functools.cache
+def _load_env():
+    """.env を読み込む（プロセスで1回。import のたびにファイルを探さないよう、APIを使うときに呼ぶ）。"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def openai_host() -> str:
+    """OpenAI API のホスト名（rate_limiter の制限の単位）。OPENAI_BASE_URL は .env でも指定できる。"""
+    _load_env()
+    return host_of(os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL)
+
+
+def get_client():
+    """OpenAI クライアントを返す（プロセスで1つ。最初の呼び出しで作る）。"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import openai
+                _load_env()
+                # 再試行は rate_limiter 側で行う（Retry-After・バックオフ・同時実行数の調整）
+                _client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _client
+
+
+MODEL = "gpt-4o"
+TEMPERATURE = 0.3
+# プロンプト・モデルを変えたら上げる（古い版の要約は作り直しの対象になる）
+PROMPT_VERSION = 1
 
 # --- JSONスキーマをファイルから読み込む ---
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.json")
 with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
-    JSON_SCHEMA = json.load(f)
+    _schema_source = f.read()
+    JSON_SCHEMA = json.loads(_schema_source)
+# スキーマの内容が変わればキャッシュも別物として扱う
+SCHEMA_VERSION = hashlib.sha256(_schema_source.encode("utf-8")).hexdigest()[:16]
 
-
-def summarize_text(text: str) -> dict:
-    """
-    論文本文テキストをGPT-4に渡して、要約（10項目）を辞書形式で返す。
-    schema.json で検証。
-    """
-    def clean_json_response(raw_response: str) -> str:
-        return re.sub(r"^```json|```$", "", raw_response.strip())
-
-    prompt = f"""
+PROMPT_TEMPLATE = """
 以下の論文本文を読み、次の10項目ごとに簡潔にまとめてください。
 
 1. 背景
@@ -59,41 +99,417 @@ def summarize_text(text: str) -> dict:
 必ずJSON形式のみを返してください。説明文や前置きは一切不要です。
 """
 
+
+# 長い論文を分割して要約するときのプロンプト
+MAP_PROMPT_TEMPLATE = """
+以下は論文本文の一部（{index}/{total}）です。
+この部分に書かれている内容のうち、背景・目的・新規性・方法・結果・考察・懸念点・結論・今後の展望・キーワードに関係するものを、日本語の箇条書きで簡潔に抜き出してください。
+該当する内容がない項目は省略してください。
+
+{text}
+"""
+REDUCE_PROMPT_TEMPLATE = PROMPT_TEMPLATE.replace(
+    "以下の論文本文を読み、", "以下は長い論文を分割して読んだメモです。メモ全体を踏まえて論文全体について、"
+).replace("以下が論文本文です：", "以下が分割ごとのメモです：")
+
+# プロンプトがこのトークン数を超える場合は分割要約（map-reduce）に切り替える
+MAX_PROMPT_TOKENS = int(os.getenv("SUMMARY_MAX_PROMPT_TOKENS", "60000"))
+# 分割要約での1チャンクあたりのトークン数と、同時に投げるリクエスト数
+CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+# summarize_texts で同時に処理する本文の数（sync はスレッド数、async は同時リクエスト数）
+BULK_CONCURRENCY = int(os.getenv("SUMMARY_BULK_CONCURRENCY", "8"))
+BACKENDS = ["sync", "async", "batch"]
+# ストリーミングで要約するとき、形式の誤りで打ち切った場合を含めて何回まで要求するか
+STREAM_ATTEMPTS = int(os.getenv("SUMMARY_STREAM_ATTEMPTS", "3"))
+
+
+@functools.cache
+def _get_encoding():
     try:
-        print("\n=== 💬 GPTへのプロンプト送信内容 ===\n")
-        print(prompt[:1000] + " ...（以下省略）")
-        print("\n=== 🔄 要約開始 ===")
+        import tiktoken
+        return tiktoken.encoding_for_model(MODEL)
+    except Exception:  # tiktoken がない・モデル未対応の場合は概算する
+        return None
+
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-        )
+@functools.cache
+def _get_validator():
+    """schema.json の検証器（スキーマの検査と生成は1回だけ行う）。"""
+    from jsonschema.validators import validator_for
+    validator_class = validator_for(JSON_SCHEMA)
+    validator_class.check_schema(JSON_SCHEMA)
+    return validator_class(JSON_SCHEMA)
 
-        message = response.choices[0].message.content
 
-        print("\n=== 📥 GPTからの応答 ===\n")
-        print(message)
+def preload():
+    """
+    要約で使うモジュール（openai・jsonschema）を読み込み、クライアントと検証器を作っておく。
+    スレッドで読み込み中に別のスレッドがプロセスを fork すると子プロセスが止まることがあるため、
+    プロセスプールを使う処理の前に呼ぶ。
+    """
+    get_client()
+    _get_validator()
+
+
+# 分割に使う見出し（番号付き見出し・よく使われる章題）
+SECTION_PATTERN = re.compile(
+    r"(?=(?:\b\d{1,2}(?:\.\d{1,2})*\.?\s+)?\b(?:Abstract|Introduction|Related Work|Background|Preliminaries|"
+    r"Method(?:s|ology)?|Approach|Experiments?|Evaluation|Results|Discussion|Conclusions?|Limitations|"
+    r"Future Work|References|Appendix|Acknowledg(?:e)?ments)\b)"
+    r"|(?=(?:\d{1,2}\.?\s*)?(?:はじめに|序論|関連研究|提案手法|手法|実験|評価|結果|考察|結論|まとめ|おわりに|参考文献)\s)"
+)
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?。！？])\s*")
+
+
+def count_tokens(text: str) -> int:
+    """トークン数を数える。tiktoken がなければ英数字4文字≒1トークン、日本語1文字≒1トークンで概算する。"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def split_into_chunks(text: str, chunk_tokens: int = CHUNK_TOKENS) -> list:
+    """
+    本文を見出しの位置で区切り、chunk_tokens 以下のチャンクにまとめる。
+    1つの節が長すぎる場合は文単位、それでも長ければ文字数で区切る。
+    """
+    pieces = []
+    for section in SECTION_PATTERN.split(text):
+        if not section.strip():
+            continue
+        if count_tokens(section) <= chunk_tokens:
+            pieces.append(section)
+            continue
+        for sentence in SENTENCE_PATTERN.split(section):
+            if count_tokens(sentence) <= chunk_tokens:
+                pieces.append(sentence)
+            else:
+                step = max(1, len(sentence) * chunk_tokens // count_tokens(sentence))
+                pieces.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece) + 1  # 区切りの空白の分
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(" ".join(current).strip())
+            current, current_tokens = [], 0
+        current.append(piece.strip())
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current).strip())
+    return chunks
+
+
+def _as_retryable(e: Exception) -> Exception:
+    """レート制限・タイムアウト・サーバーエラーなら RetryableError に変換する。"""
+    import openai
+    if isinstance(e, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        response = getattr(e, "response", None)
+        retry_after = parse_retry_after(response.headers.get("retry-after")) if response is not None else None
+        return RetryableError(str(e), retry_after=retry_after, throttled=isinstance(e, openai.RateLimitError))
+    return e
+
 
-        cleaned = clean_json_response(message)
+def completion_params(prompt: str) -> dict:
+    """Chat Completions に渡すパラメータ（同期・非同期・Batch API で共通）。"""
+    return {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": TEMPERATURE,
+    }
 
+
+def call_openai(fn, stream: bool = False):
+    """
+    OpenAI API の呼び出し fn() を、ホストごとの制限と再試行つきで行う。
+    stream なら、返ったストリームを閉じるまで同時実行枠を持ち続ける（with で使う）。
+    """
+    import openai
+
+    def call():
         try:
-            summary_dict = json.loads(cleaned)
-            validate(instance=summary_dict, schema=JSON_SCHEMA)
-            return summary_dict
-        except json.JSONDecodeError as e:
-            print("❌ JSONのパースに失敗しました：")
-            print(cleaned)
-            raise e
-        except ValidationError as ve:
-            print("❌ スキーマ検証に失敗しました：")
-            print(f"原因: {ve.message}")
-            raise ve
+            return fn()
+        except openai.OpenAIError as e:
+            raise _as_retryable(e) from e
+    return call_with_retry(openai_host(), call, hold_until_closed=stream)
+
+
+def record_usage(usage):
+    """OpenAI の応答に含まれるトークン数を記録する。"""
+    if usage is None:
+        return
+    if isinstance(usage, dict):
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    else:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    incr("prompt_tokens", prompt_tokens or 0, model=MODEL)
+    incr("completion_tokens", completion_tokens or 0, model=MODEL)
+
+
+def _call_llm(prompt: str) -> str:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("GPTへのプロンプト送信内容:\n%s ...（以下省略）", prompt[:1000])
+
+    with timed("llm_call", model=MODEL):
+        response = call_openai(lambda: get_client().chat.completions.create(**completion_params(prompt)))
+    record_usage(response.usage)
+
+    message = response.choices[0].message.content
+    logger.debug("GPTからの応答:\n%s", message)
+    return message
+
+
+def parse_summary(message: str) -> dict:
+    def clean_json_response(raw_response: str) -> str:
+        return re.sub(r"^```json|```$", "", raw_response.strip())
+
+    cleaned = clean_json_response(message)
+    validator = _get_validator()
+    from jsonschema import ValidationError
+
+    try:
+        summary_dict = json.loads(cleaned)
+        validator.validate(summary_dict)
+        return summary_dict
+    except json.JSONDecodeError as e:
+        incr("summary_validation_failures", reason="json")
+        logger.error("JSONのパースに失敗しました: %s", e)
+        logger.debug("応答:\n%s", cleaned)
+        raise e
+    except ValidationError as ve:
+        incr("summary_validation_failures", reason="schema")
+        logger.error("スキーマ検証に失敗しました: %s", ve.message)
+        raise ve
+
+
+def _check_field(key: str, value):
+    """ストリーミングで届いた1項目をスキーマの該当部分で検証する（おかしければその場で打ち切るため）。"""
+    from jsonschema import ValidationError
+    properties = JSON_SCHEMA.get("properties", {})
+    if key not in properties:
+        raise ValidationError(f"スキーマにない項目です: {key}")
+    _get_validator().evolve(schema=properties[key]).validate(value)
+
+
+def _stream_llm(prompt: str, on_field) -> dict:
+    """
+    応答をストリーミングで受け取り、項目が1つ確定するごとに検証して on_field(項目名, 値) を呼ぶ。
+    JSONやスキーマに合わない部分が届いた時点で応答を閉じて例外を出す。
+    """
+    parser = ObjectStreamParser()
+    start = time.perf_counter()
+    first_field = True
+    with timed("llm_stream", model=MODEL):
+        stream = call_openai(lambda: get_client().chat.completions.create(
+            **completion_params(prompt), stream=True, stream_options={"include_usage": True},
+        ), stream=True)
+        with stream:
+            for chunk in stream:
+                record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                for key, value in parser.feed(chunk.choices[0].delta.content or ""):
+                    _check_field(key, value)
+                    if first_field:
+                        observe("llm_first_field_seconds", time.perf_counter() - start, model=MODEL)
+                        first_field = False
+                    on_field(key, value)
+    summary_dict = parser.close()
+    _get_validator().validate(summary_dict)  # 必須の項目がそろっているか
+    return summary_dict
+
+
+def _summarize_streaming(prompt: str, on_field) -> dict:
+    """ストリーミングで要約する。形式の誤りで打ち切った場合は STREAM_ATTEMPTS 回まで要求し直す。"""
+    import openai
+    from jsonschema import ValidationError
+    for attempt in range(1, STREAM_ATTEMPTS + 1):
+        try:
+            return _stream_llm(prompt, on_field)
+        except (json.JSONDecodeError, ValidationError) as e:
+            reason = "json" if isinstance(e, json.JSONDecodeError) else "schema"
+            incr("summary_validation_failures", reason=reason)
+            message = e.msg if reason == "json" else e.message
+        except openai.APIError as e:
+            # ストリームの途中で切れた場合（接続時のエラーは call_openai が再試行する）
+            incr("summary_stream_errors")
+            message = str(e)
+        if attempt == STREAM_ATTEMPTS:
+            raise RuntimeError(f"要約の形式が正しくありません: {message}")
+        logger.warning("要約の形式が正しくないため打ち切って再試行します（%d/%d）: %s", attempt, STREAM_ATTEMPTS, message)
+
+
+def _map_chunks(chunks: list, max_concurrency: int) -> list:
+    """各チャンクのメモを並列に作る（結果はチャンクの順番どおり）。"""
+    prompts = [
+        MAP_PROMPT_TEMPLATE.format(index=i + 1, total=len(chunks), text=chunk)
+        for i, chunk in enumerate(chunks)
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        return list(pool.map(_call_llm, prompts))
+
+
+def _summarize_map_reduce(text: str, chunk_tokens: int, max_prompt_tokens: int, max_concurrency: int,
+                          on_field=None) -> dict:
+    notes = _map_chunks(split_into_chunks(text, chunk_tokens), max_concurrency)
+    merged = "\n\n".join(notes)
+    # メモを合わせてもまだ長い場合は、メモをさらに分割してまとめ直す
+    for _ in range(3):
+        if count_tokens(REDUCE_PROMPT_TEMPLATE.format(text=merged)) <= max_prompt_tokens:
+            break
+        merged = "\n\n".join(_map_chunks(split_into_chunks(merged, chunk_tokens), max_concurrency))
+    reduce_prompt = REDUCE_PROMPT_TEMPLATE.format(text=merged)
+    if on_field is not None:
+        return _summarize_streaming(reduce_prompt, on_field)
+    return parse_summary(_call_llm(reduce_prompt))
+
+
+def summary_cache_key(text: str, mode: str = "single", chunk_tokens: int = None) -> str:
+    if mode == "map_reduce":
+        template = f"{MAP_PROMPT_TEMPLATE}{REDUCE_PROMPT_TEMPLATE}chunk={chunk_tokens or CHUNK_TOKENS}"
+    else:
+        template = PROMPT_TEMPLATE
+    return make_key(text, template, MODEL, TEMPERATURE, SCHEMA_VERSION)
+
+
+def cached_summary(cache_key: str) -> dict | None:
+    """キャッシュ済みでスキーマに合う要約があれば返す。"""
+    cached = get_cached_summary(cache_key)
+    if cached is None:
+        return None
+    if not _get_validator().is_valid(cached):
+        return None  # 壊れたエントリは取り直して上書きする
+    incr("summary_cache_hits")
+    logger.info("キャッシュ済みの要約を使用します")
+    return cached
+
+
+def summarize_text(text: str, use_cache: bool = True, mode: str = "auto",
+                   max_prompt_tokens: int = None, chunk_tokens: int = None,
+                   max_concurrency: int = None, on_field=None) -> dict:
+    """
+    論文本文テキストをGPT-4に渡して、要約（10項目）を辞書形式で返す。
+    schema.json で検証。
+    同じ本文・プロンプト・モデルで要約済みの場合はキャッシュから返す。
+    mode="auto" ではプロンプトが max_prompt_tokens を超えるときだけ、
+    本文をチャンクに分けて並列に要約し1つにまとめる（"single" / "map_reduce" で固定も可）。
+    on_field を渡すと応答をストリーミングで受け取り、項目（背景・目的…）が確定するごとに
+    on_field(項目名, 値) を呼ぶ（キャッシュから返す場合もすべての項目について呼ぶ）。
+    形式の誤りで打ち切って要求し直した場合は、同じ項目についてもう一度呼ぶ。
+    """
+    max_prompt_tokens = max_prompt_tokens or MAX_PROMPT_TOKENS
+    chunk_tokens = chunk_tokens or CHUNK_TOKENS
+    max_concurrency = max_concurrency or MAP_CONCURRENCY
+
+    prompt = PROMPT_TEMPLATE.format(text=text)
+    if mode == "auto":
+        mode = "map_reduce" if count_tokens(prompt) > max_prompt_tokens else "single"
+
+    cache_key = summary_cache_key(text, mode, chunk_tokens)
+    if use_cache:
+        cached = cached_summary(cache_key)
+        if cached is not None:
+            if on_field is not None:
+                for key, value in cached.items():
+                    on_field(key, value)
+            return cached
+
+    try:
+        if mode == "map_reduce":
+            summary_dict = _summarize_map_reduce(text, chunk_tokens, max_prompt_tokens, max_concurrency, on_field)
+        elif on_field is not None:
+            summary_dict = _summarize_streaming(prompt, on_field)
+        else:
+            summary_dict = parse_summary(_call_llm(prompt))
+        put_cached_summary(cache_key, summary_dict)
+        return summary_dict
 
     except Exception as e:
         raise RuntimeError(f"要約失敗: {e}")
 
 
+# --- 複数本文の一括要約 ---
+
+async def _acall_llm(aclient, prompt: str, semaphore: asyncio.Semaphore) -> str:
+    """
+    AsyncOpenAI で1件要約する。同期の呼び出しと同じホストの制限（トークンバケット・同時実行数の調整）の中で送り、
+    429・タイムアウトなどは rate_limiter 側で待ってから再試行する。
+    """
+    import openai
+
+    async def send():
+        try:
+            with timed("llm_call", model=MODEL):
+                return await aclient.chat.completions.create(**completion_params(prompt))
+        except openai.OpenAIError as e:
+            raise _as_retryable(e) from e
+
+    async with semaphore:
+        response = await acall_with_retry(openai_host(), send)
+    record_usage(response.usage)
+    return response.choices[0].message.content
+
+
+async def _summarize_async(texts: list, max_concurrency: int, use_cache: bool) -> list:
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def summarize_one(aclient, text):
+        prompt = PROMPT_TEMPLATE.format(text=text)
+        if count_tokens(prompt) > MAX_PROMPT_TOKENS:
+            # 長い論文は分割要約（同期版）をスレッドで実行する
+            return await asyncio.to_thread(summarize_text, text, use_cache)
+        cache_key = summary_cache_key(text)
+        if use_cache:
+            cached = cached_summary(cache_key)
+            if cached is not None:
+                return cached
+        try:
+            summary_dict = parse_summary(await _acall_llm(aclient, prompt, semaphore))
+        except Exception as e:
+            raise RuntimeError(f"要約失敗: {e}")
+        put_cached_summary(cache_key, summary_dict)
+        return summary_dict
+
+    import openai
+    _load_env()
+    async with openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0) as aclient:
+        return await asyncio.gather(*(summarize_one(aclient, text) for text in texts), return_exceptions=True)
+
+
+def summarize_texts(texts, backend: str = "sync", max_concurrency: int = None, use_cache: bool = True) -> list:
+    """
+    複数の本文をまとめて要約し、入力と同じ順番のリストで返す。
+    失敗した本文の位置には例外（RuntimeError）が入る。
+    backend="sync"  : スレッドで summarize_text を並列に呼ぶ（既定）
+    backend="async" : AsyncOpenAI で max_concurrency 件ずつ同時に投げる
+    backend="batch" : OpenAI Batch API に投入し、完了まで待つ（安いが最大24時間かかる）
+    """
+    texts = list(texts)
+    max_concurrency = max_concurrency or BULK_CONCURRENCY
+    if backend not in BACKENDS:
+        raise ValueError(f"不明なバックエンドです: {backend}")
+    if not texts:
+        return []
+
+    if backend == "async":
+        return asyncio.run(_summarize_async(texts, max_concurrency, use_cache))
+    if backend == "batch":
+        from utils.batch_summarizer import summarize_batch
+        return summarize_batch(texts, use_cache=use_cache)
+
+    def summarize_one(text):
+        try:
+            return summarize_text(text, use_cache)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        return list(pool.map(summarize_one, texts))
+
+
 def sanitize_filename(name: str) -> str:
     """ファイル名に使えない文字を除去"""
     return re.sub(r'[\\/*?:"<>|]', "_", name)
@@ -115,9 +531,9 @@ def save_summary_to_file(summary: dict, pdf_path: str) -> str:
     try:
         with open(summary_path, "w", encoding="utf-8") as f:
             json.dump(summary, f, ensure_ascii=False, indent=2)
-        print(f"✅ 要約結果を保存しました: {summary_path}")
+        logger.info("要約結果を保存しました: %s", summary_path)
         return str(summary_path)
     except Exception as e:
-        print(f"❌ 要約結果の保存に失敗しました: {e}")
+        logger.error("要約結果の保存に失敗しました: %s", e)
         raise e
 
@@ -0,0 +1,163 @@
+# utils/summary_cache.py
+# 要約結果をSQLiteに保存し、同じ本文・プロンプト・モデルでの再要約を省略するキャッシュ
+
+import sqlite3
+import os
+import json
+import hashlib
+import threading
+import time
+
+CACHE_PATH = os.path.join("data", "summary_cache.sqlite")
+MAX_CACHE_BYTES = 200 * 1024 * 1024  # これを超えたら最終利用が古いものから削除
+
+# スレッドごとに1本の接続を使い回す（db_manager.get_connection と同じ）
+_local = threading.local()
+_ready_paths = set()  # テーブルを作成済みのキャッシュファイル
+_ready_lock = threading.Lock()
+
+
+def _create_tables(conn):
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS summary_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_used REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_summary_cache_last_used ON summary_cache(last_used)")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS summary_cache_stats (
+                name TEXT PRIMARY KEY,
+                count INTEGER
+            )
+        ''')
+        # 合計サイズは "bytes" の行にトリガーで持つ（保存のたびに SUM(size) で全件を数えない）
+        conn.execute('''
+            INSERT OR IGNORE INTO summary_cache_stats (name, count)
+            SELECT 'bytes', COALESCE(SUM(size), 0) FROM summary_cache
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS summary_cache_size_ins AFTER INSERT ON summary_cache BEGIN
+                UPDATE summary_cache_stats SET count = count + new.size WHERE name = 'bytes';
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS summary_cache_size_del AFTER DELETE ON summary_cache BEGIN
+                UPDATE summary_cache_stats SET count = count - old.size WHERE name = 'bytes';
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS summary_cache_size_upd AFTER UPDATE OF size ON summary_cache BEGIN
+                UPDATE summary_cache_stats SET count = count + new.size - old.size WHERE name = 'bytes';
+            END
+        ''')
+
+
+def _connect() -> sqlite3.Connection:
+    """現在のスレッド用の接続を返す（なければ作成。テーブルの作成はファイルごとに1回）。"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and (_local.path != CACHE_PATH or _local.pid != os.getpid()):
+        # キャッシュファイルの切り替えや fork 後の子プロセスでは親の接続を使わない
+        conn = None
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _ready_lock:
+            if CACHE_PATH not in _ready_paths:
+                _create_tables(conn)
+                _ready_paths.add(CACHE_PATH)
+        _local.conn = conn
+        _local.path = CACHE_PATH
+        _local.pid = os.getpid()
+    return conn
+
+
+def make_key(text: str, prompt_template: str, model: str, temperature: float, schema_version: str) -> str:
+    """本文・プロンプト・モデル・温度・スキーマ版からキャッシュキー(SHA-256)を作る。"""
+    payload = json.dumps(
+        [text.strip(), prompt_template, model, temperature, schema_version],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _count(conn, name: str, n: int = 1):
+    conn.execute('''
+        INSERT INTO summary_cache_stats (name, count) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET count = count + excluded.count
+    ''', (name, n))
+
+
+def get_cached_summary(key: str) -> dict | None:
+    """キャッシュにあれば要約の辞書を返す。なければ None。"""
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM summary_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _count(conn, "misses")
+        else:
+            conn.execute("UPDATE summary_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            _count(conn, "hits")
+    return json.loads(row[0]) if row else None
+
+
+def put_cached_summary(key: str, summary: dict):
+    """要約をキャッシュへ保存し、容量を超えていれば古いものを削除する。"""
+    value = json.dumps(summary, ensure_ascii=False)
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # INSERT OR REPLACE では削除のトリガーが動かないので UPSERT で更新する
+        conn.execute('''
+            INSERT INTO summary_cache (key, value, size, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value, size = excluded.size,
+                created_at = excluded.created_at, last_used = excluded.last_used
+        ''', (key, value, len(value.encode("utf-8")), now, now))
+        _evict(conn)
+
+
+def _total_bytes(conn) -> int:
+    row = conn.execute("SELECT count FROM summary_cache_stats WHERE name = 'bytes'").fetchone()
+    return row[0] if row else 0
+
+
+def _evict(conn, max_bytes: int = None):
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    total = _total_bytes(conn)
+    if total <= max_bytes:
+        return
+
+    # 最終利用の索引を古い順にたどり、容量に収まるところまでで読むのをやめる
+    evicted = []
+    for key, size in conn.execute("SELECT key, size FROM summary_cache ORDER BY last_used ASC"):
+        if total <= max_bytes:
+            break
+        evicted.append((key,))
+        total -= size
+    conn.executemany("DELETE FROM summary_cache WHERE key = ?", evicted)
+    _count(conn, "evictions", len(evicted))
+
+
+def cache_stats() -> dict:
+    """ヒット数・ミス数・件数・合計サイズを返す。"""
+    conn = _connect()
+    counts = dict(conn.execute("SELECT name, count FROM summary_cache_stats").fetchall())
+    entries = conn.execute("SELECT COUNT(*) FROM summary_cache").fetchone()[0]
+    return {
+        "hits": counts.get("hits", 0),
+        "misses": counts.get("misses", 0),
+        "evictions": counts.get("evictions", 0),
+        "entries": entries,
+        "bytes": counts.get("bytes", 0),
+    }
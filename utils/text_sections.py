@@ -0,0 +1,199 @@
+# utils/text_sections.py
+# 論文本文の節（Abstract・Introduction・…・References）を見分け、要約に必要な節だけをトークン数の予算内に残す
+#   抽出時: split_sections(改行を残したテキスト) で見出しの行を見つけ、format_sections で
+#           「見出し\n本文」を空行で区切った形にして保存する（改行を消すと見出しと本文中の語を区別できないため）
+#   要約時: reduce_text(保存したテキスト) で参考文献・付録・謝辞・著者一覧を除き、
+#           優先度の高い節から SUMMARY_TOKEN_BUDGET トークンに収まるだけ残す
+
+import os
+import re
+
+# 要約の入力にするトークン数の上限（0 なら上限なし。不要な節を除くだけ）
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "12000"))
+# 予算の残りがこれより少なければ、節を途中で切ってまで入れない
+MIN_SECTION_TOKENS = 200
+# 1つの節が最初に使える予算の割合（長い節が予算を使い切らないように。余った分は後で優先順に配る）
+SECTION_MAX_SHARE = 0.4
+
+# 節の種類 → 見出しの語
+SECTION_KINDS = {
+    "abstract": r"Abstract|概要|要旨|あらまし",
+    "introduction": r"Introduction|はじめに|序論|まえがき",
+    "related": r"Related Works?|Background|Preliminaries|関連研究",
+    "method": r"Methods?|Methodology|Approach|Proposed Method|Model|Framework|提案手法|手法",
+    "results": r"Experiments?|Experimental (?:Setup|Results|Evaluation)|Evaluation|Results|実験|評価|結果",
+    "discussion": r"Discussion|Analysis|Limitations|考察",
+    "conclusion": r"Conclusions?|Concluding Remarks|Future Work|結論|まとめ|おわりに|今後の課題",
+    "references": r"References|Bibliography|参考文献",
+    "acknowledgements": r"Acknowledge?ments?|謝辞",
+    "appendix": r"Appendix|Appendices|Supplementary Materials?|付録",
+}
+# 要約に残す優先順（ここにない種類は残さない。"body" は番号付きの見出しで種類が分からない節）
+KEEP_PRIORITY = ["abstract", "conclusion", "introduction", "results", "method", "discussion", "body", "related"]
+# この種類の節が出てきたら、それ以降（付録など）はすべて除く
+TAIL_KINDS = {"references", "appendix"}
+# 文書の前半にある「References」などは目次や本文の一部とみなして区切りにしない
+TAIL_MIN_POSITION = 0.3
+
+_NUMBER = r"(?:(?:\d{1,2}|[IVX]{1,4}|[A-Z])(?:\.\d{1,2})*\.?[ \t]+)?"
+_KNOWN_HEADING = re.compile(
+    rf"^[ \t]*{_NUMBER}(?P<title>{'|'.join(f'(?P<{kind}>{words})' for kind, words in SECTION_KINDS.items())})"
+    r"[ \t]*(?:[.:：—–-][ \t]*(?P<rest>.*))?$",
+    re.IGNORECASE,
+)
+# 「3 Proposed Model」のような番号付きの短い見出し
+_NUMBERED_HEADING = re.compile(r"^[ \t]*\d{1,2}(?:\.\d{1,2})?\.?[ \t]+[A-Z][A-Za-z\-]*(?:[ \t]+[A-Za-z\-]+){0,6}[ \t]*$")
+# 見出しの候補の行をテキスト全体から1回で探す（行ごとに Python で調べるより速い。確定は _heading_kind で行う）
+_CANDIDATE_LINE = re.compile(f"{_KNOWN_HEADING.pattern}|{_NUMBERED_HEADING.pattern}", re.IGNORECASE | re.MULTILINE)
+# 見出し語のあとに本文が続く行（"Abstract—We propose ..."）を見出しとみなすのはこの種類だけ
+_INLINE_KINDS = {"abstract"}
+# 保存したテキストで旧形式（節の区切りなし）のときに参考文献の始まりを探す
+_TAIL_PATTERN = re.compile(r"\b(?:References|REFERENCES|Bibliography)\b|参考文献")
+
+
+def _heading_kind(line: str):
+    """行が見出しなら (種類, 見出しの後ろに続く本文) を、そうでなければ None を返す。"""
+    if len(line) > 120:
+        return None
+    match = _KNOWN_HEADING.match(line)
+    if match:
+        kind = next(kind for kind in SECTION_KINDS if match.group(kind))
+        rest = (match.group("rest") or "").strip()
+        if rest and kind not in _INLINE_KINDS:
+            return None
+        return kind, rest
+    if _NUMBERED_HEADING.match(line):
+        return "body", ""
+    return None
+
+
+def split_sections(raw_text: str) -> list:
+    """
+    改行を残した抽出テキストを見出しの行で区切り、(種類, 見出し, 本文) のリストを返す。
+    最初の見出しより前（タイトル・著者など）は種類 "front"・見出しなしで返す。
+    """
+    sections = []
+    kind, heading, body_start, rest = "front", "", 0, ""
+    for match in _CANDIDATE_LINE.finditer(raw_text):
+        line = match.group(0)
+        found = _heading_kind(line)
+        if found is None:
+            continue
+        sections.append((kind, heading, rest + raw_text[body_start:match.start()]))
+        kind, rest = found
+        line = line.strip()
+        heading = line[:len(line) - len(rest)].rstrip(" .:：—–-") if rest else line
+        body_start = match.end()
+    sections.append((kind, heading, rest + raw_text[body_start:]))
+    return [(kind, heading, body) for kind, heading, body in sections if heading or body.strip()]
+
+
+def format_sections(sections, clean) -> str:
+    """節ごとに本文を clean で整形し、「見出し\\n本文」を空行で区切ってつなぐ（保存用の形式）。"""
+    blocks = []
+    for kind, heading, body in sections:
+        body = clean(body)
+        block = f"{clean(heading)}\n{body}" if heading else body
+        if block.strip():
+            blocks.append(block.strip())
+    return "\n\n".join(blocks)
+
+
+def parse_sections(text: str) -> list:
+    """format_sections の形式のテキストを (種類, 見出し, 本文) のリストに戻す。区切りがなければ空のリスト。"""
+    if "\n\n" not in text:
+        return []
+    sections = []
+    for block in text.split("\n\n"):
+        heading, _, body = block.partition("\n")
+        found = _heading_kind(heading) if body else None
+        if found is None:
+            sections.append(("front" if not sections else "body", "", block))
+        else:
+            sections.append((found[0], heading, body))
+    return sections
+
+
+def _truncate(text: str, tokens: int, count_tokens) -> str:
+    """text を先頭から約 tokens トークンに切り詰める（文の区切りで切る）。"""
+    total = count_tokens(text)
+    if total <= tokens:
+        return text
+    cut = text[:max(1, len(text) * tokens // total)]
+    end = max(cut.rfind(". "), cut.rfind("。"))
+    return cut[:end + 1] if end > len(cut) // 2 else cut
+
+
+def _drop_tail(sections: list) -> list:
+    """文書の後半にある参考文献・付録から後ろを除く。"""
+    total = sum(len(body) for _, _, body in sections) or 1
+    position = 0
+    for i, (kind, _, body) in enumerate(sections):
+        if kind in TAIL_KINDS and position / total >= TAIL_MIN_POSITION:
+            return sections[:i]
+        position += len(body)
+    return sections
+
+
+def _fit_budget(blocks: dict, candidates: list, budget: int, count_tokens) -> dict:
+    """
+    優先順の candidates に予算を配り、収まらない節は切り詰めて返す（入らない節は空文字列）。
+    まず各節に予算の SECTION_MAX_SHARE までを配り、余った分を優先順に足りない節へ配る。
+    """
+    tokens = {i: count_tokens(blocks[i]) for i in candidates}
+    allotted = {i: 0 for i in candidates}
+    remaining = budget
+    for share in (max(MIN_SECTION_TOKENS, int(budget * SECTION_MAX_SHARE)), budget):
+        for i in candidates:
+            give = min(tokens[i] - allotted[i], share - allotted[i], remaining)
+            if give <= 0 or allotted[i] + give < min(tokens[i], MIN_SECTION_TOKENS):
+                continue
+            allotted[i] += give
+            remaining -= give
+    return {
+        i: blocks[i] if allotted[i] >= tokens[i] else _truncate(blocks[i], allotted[i], count_tokens) if allotted[i] else ""
+        for i in candidates
+    }
+
+
+def reduce_text(text: str, budget: int = None) -> tuple:
+    """
+    保存した本文から要約に使う部分だけを残し、(残したテキスト, 統計) を返す。
+    統計は {"text_tokens": 元のトークン数, "input_tokens": 残したトークン数, "sections": [残した節の種類]}。
+    """
+    from utils.summarizer import count_tokens
+
+    budget = SUMMARY_TOKEN_BUDGET if budget is None else budget
+    text_tokens = count_tokens(text)
+    sections = parse_sections(text)
+
+    if not sections:
+        # 節の区切りがない（旧形式の）テキストは、後半の参考文献から後ろを除いて先頭から予算まで残す
+        match = None
+        for match in _TAIL_PATTERN.finditer(text):
+            pass
+        reduced = text[:match.start()].rstrip() if match and match.start() / len(text) >= 1 - TAIL_MIN_POSITION * 2 else text
+        if budget:
+            reduced = _truncate(reduced, budget, count_tokens)
+        return reduced, {"text_tokens": text_tokens, "input_tokens": count_tokens(reduced), "sections": []}
+
+    sections = _drop_tail(sections)
+    kinds = {kind for kind, _, _ in sections}
+    if "abstract" in kinds:
+        # Abstract があれば、その前はタイトルと著者の一覧
+        sections = [s for s in sections if s[0] != "front"]
+    else:
+        sections = [("abstract" if kind == "front" else kind, heading, body) for kind, heading, body in sections]
+
+    candidates = [i for kind in KEEP_PRIORITY for i, section in enumerate(sections) if section[0] == kind]
+    blocks = {i: f"{sections[i][1]}\n{sections[i][2]}" if sections[i][1] else sections[i][2] for i in candidates}
+    if budget:
+        blocks = _fit_budget(blocks, candidates, budget, count_tokens)
+
+    kept = {i: block for i, block in blocks.items() if block}
+    reduced = "\n\n".join(kept[i] for i in sorted(kept))
+    return reduced, {
+        "text_tokens": text_tokens,
+        "input_tokens": count_tokens(reduced),
+        "sections": [sections[i][0] for i in sorted(kept)],
+    }
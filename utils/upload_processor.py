@@ -0,0 +1,141 @@
+# utils/upload_processor.py
+# アップロードされたPDFを内容の SHA-256 で管理し、バックグラウンドのスレッドで要約する
+#   Streamlit は操作のたびにスクリプトを実行し直すため、処理中の状態はこのモジュール（プロセス内で共有）に持つ。
+#   同じ内容のPDFは何度アップロードしても1回だけ処理し、処理済みなら保存済みの要約をすぐに返す。
+#   要約はストリーミングで受け取り、確定した項目から upload_status の "partial" で見られる。
+
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from utils.blob_store import REF_PREFIX, exists, put_bytes
+from utils.db_manager import insert_or_update_paper, fetch_paper
+from utils.summarizer import preload
+from utils.pipeline import new_result, load_state, stale_stage, extract_stage, store_text, summarize_stage, load_summary
+
+logger = logging.getLogger(__name__)
+
+SOURCE = "uploaded_pdf"
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))  # 同時に処理するアップロードの数
+
+# 状態
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+_futures = {}  # sha256 → Future
+_partials = {}  # sha256 → 要約中に確定した項目 {項目名: 値}
+_lock = threading.Lock()
+
+
+def upload_id(digest: str) -> str:
+    """アップロードされたPDFのDB上のID。"""
+    return f"upload:{digest[:16]}"
+
+
+def _process(paper: dict) -> dict:
+    """保存済みのPDFから、古くなったステージ（抽出・要約）だけを実行する。"""
+    result = load_state(new_result(paper))
+    stage = stale_stage(result)
+    text = None
+    if stage == "extract":
+        result["stage"] = "extract"
+        # アップロードは1本ずつなので、PDFの中のページを並列に抽出する
+        text_ref, text = extract_stage(result["pdf_path"], workers=None)
+        store_text(result, text_ref)
+        stage = stale_stage(result)
+    if stage == "summarize":
+        result["stage"] = "summarize"
+        partial = {}
+        with _lock:
+            _partials[paper["digest"]] = partial
+
+        def on_field(key, value):
+            with _lock:
+                partial[key] = value
+
+        try:
+            summarize_stage(result, text, on_field=on_field)
+        finally:
+            with _lock:
+                _partials.pop(paper["digest"], None)
+    return result
+
+
+def _submit(paper: dict):
+    preload()  # 抽出のプロセスを fork する前に読み込んでおく
+
+    def log_failure(future):
+        if future.exception() is not None:
+            logger.error("%s の要約に失敗しました: %s", paper["title"], future.exception())
+
+    future = _executor.submit(_process, paper)
+    future.add_done_callback(log_failure)
+    _futures[paper["digest"]] = future
+
+
+def submit_upload(name: str, data: bytes) -> str:
+    """
+    アップロードされたPDFを blob に保存し、未処理なら処理に回す。内容の SHA-256 を返す。
+    処理済み・処理中のものは何もしない。
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    with _lock:
+        if digest in _futures:
+            return digest
+        pdf_ref = REF_PREFIX + digest
+        if not exists(pdf_ref):
+            put_bytes(data)
+        paper = {
+            "id": upload_id(digest), "title": name, "authors": "", "year": "", "source": SOURCE,
+            "url": "", "pdf_url": "", "digest": digest,
+        }
+        insert_or_update_paper({
+            **paper,
+            "query": "",
+            "searched_at": datetime.now().isoformat(),
+            "pdf_path": pdf_ref,
+            "pdf_sha256": digest,
+            "downloaded": 1,
+        })
+        if stale_stage(load_state(new_result(paper))) is not None:
+            _submit(paper)
+    return digest
+
+
+def retry_upload(digest: str):
+    """失敗したアップロードをもう一度処理に回す。"""
+    stored = fetch_paper(upload_id(digest))
+    if stored is None:
+        return
+    with _lock:
+        future = _futures.get(digest)
+        if future is not None and not future.done():
+            return
+        _submit({**stored, "digest": digest})
+
+
+def upload_status(digest: str) -> dict:
+    """アップロードの状態（state / summary / error / partial）を返す。partial は要約中に確定した項目。"""
+    with _lock:
+        future = _futures.get(digest)
+        partial = dict(_partials.get(digest) or {})
+    if future is not None and not future.done():
+        state = RUNNING if future.running() else PENDING
+        return {"state": state, "summary": None, "error": None, "partial": partial}
+    if future is not None and future.exception() is not None:
+        return {"state": FAILED, "summary": None, "error": str(future.exception()), "partial": {}}
+
+    stored = fetch_paper(upload_id(digest))
+    if stored is None:
+        return {"state": FAILED, "summary": None, "error": "アップロードの記録が見つかりません", "partial": {}}
+    result = load_state(new_result(stored))
+    if stale_stage(result) is not None:
+        # 処理中にサーバーが再起動した場合など
+        return {"state": FAILED, "summary": None, "error": "処理が完了していません", "partial": {}}
+    return {"state": DONE, "summary": load_summary(result), "error": None, "partial": {}}
@@ -0,0 +1,147 @@
+# utils/worker.py
+# キューに入った論文をブラウザとは独立に処理するワーカー
+#   python -m utils.worker --workers 4
+# Ctrl+C で止めても、次に起動したときに記録済みのステージから再開する。
+
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from utils.db_manager import init_db, close_connection
+from utils.job_queue import (
+    claim_job, update_job, renew_lease, fail_job, job_counts,
+    DOWNLOADING, EXTRACTED, SUMMARIZED, DEFAULT_LEASE_SECONDS,
+)
+from utils.pipeline import (
+    new_result, load_state, stale_stage, download_stage, extract_stage, store_text, summarize_stage,
+)
+from utils.metrics import configure_logging, timed
+from utils.summarizer import preload
+import utils.croma_manager  # noqa: F401  要約の保存時にベクトル索引も更新する
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5  # キューが空のときに待つ秒数
+HEARTBEAT_FRACTION = 3  # リースの 1/3 ごとに延長する
+
+
+def process_job(job: dict, extract_pool: ProcessPoolExecutor, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+    """1件のジョブを、DBと記録されている状態から古くなったステージだけ処理する。"""
+    payload = job["payload"]
+    result = new_result(payload["paper"])
+    result["pdf_path"] = payload.get("pdf_path")
+    result["text_path"] = payload.get("text_path")
+    load_state(result)
+    stage = stale_stage(result)
+    text = None
+
+    if stage == "download":
+        update_job(job["id"], DOWNLOADING, lease_seconds=lease_seconds)
+        download_stage(result)
+        stage = stale_stage(result)
+
+    if stage == "extract":
+        result["stage"] = "extract"
+        text_ref, text = extract_pool.submit(extract_stage, result["pdf_path"]).result()
+        store_text(result, text_ref)
+        payload.update(pdf_path=result["pdf_path"], text_path=result["text_path"])
+        update_job(job["id"], EXTRACTED, payload, lease_seconds=lease_seconds)
+        stage = stale_stage(result)
+
+    if stage == "summarize":
+        result["stage"] = "summarize"
+        summarize_stage(result, text)
+    update_job(job["id"], SUMMARIZED)
+    return result
+
+
+@contextmanager
+def lease_heartbeat(job: dict, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+    """with の間、ジョブのリースを定期的に延長する（長い抽出・要約の途中で別のワーカーに取られないように）。"""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(lease_seconds / HEARTBEAT_FRACTION):
+                try:
+                    renewed = renew_lease(job["id"], job["lease_owner"], lease_seconds)
+                except Exception as e:
+                    logger.warning("%s のリースの延長に失敗しました（次の周期で再試行します）: %s", job["paper_id"], e)
+                    continue
+                if not renewed:
+                    logger.warning("%s のリースを延長できませんでした（別のワーカーに引き継がれています）", job["paper_id"])
+                    return
+        finally:
+            close_connection()
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job['id']}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _worker_loop(worker_id: str, extract_pool, stop: threading.Event, once: bool, lease_seconds: int):
+    while not stop.is_set():
+        job = claim_job(worker_id, lease_seconds)
+        if job is None:
+            if once:
+                return
+            stop.wait(POLL_INTERVAL)
+            continue
+        try:
+            with timed("job"), lease_heartbeat(job, lease_seconds):
+                process_job(job, extract_pool, lease_seconds)
+            logger.info("[%s] %s の要約が完了しました。", worker_id, job["paper_id"])
+        except Exception as e:
+            fail_job(job["id"], str(e))
+            logger.error("[%s] %s の処理でエラーが発生しました: %s", worker_id, job["paper_id"], e)
+
+
+def run_workers(workers: int = 4, extract_workers: int = None, once: bool = False,
+                lease_seconds: int = DEFAULT_LEASE_SECONDS):
+    """workers 個のスレッドでキューを処理する（抽出は共有のプロセスプールで行う）。"""
+    init_db()
+    preload()  # 抽出のプロセスを fork する前に読み込んでおく
+    stop = threading.Event()
+    prefix = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    with ProcessPoolExecutor(max_workers=extract_workers) as extract_pool:
+        threads = [
+            threading.Thread(
+                target=_worker_loop, args=(f"{prefix}-{i}", extract_pool, stop, once, lease_seconds), daemon=True
+            )
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info("停止します（処理中のジョブはリースが切れた後に再開されます）")
+            stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="キューに入った論文のダウンロード・抽出・要約を実行します。")
+    parser.add_argument("--workers", type=int, default=4, help="同時に処理するジョブ数")
+    parser.add_argument("--extract-workers", type=int, default=None, help="テキスト抽出のプロセス数（既定はCPUコア数）")
+    parser.add_argument("--lease", type=int, default=DEFAULT_LEASE_SECONDS, help="ジョブのリース秒数")
+    parser.add_argument("--once", action="store_true", help="キューが空になったら終了する")
+    args = parser.parse_args()
+    configure_logging()
+
+    run_workers(args.workers, args.extract_workers, args.once, args.lease)
+    logger.info("ジョブの状態: %s", job_counts())
+
+
+if __name__ == "__main__":
+    main()